@@ -0,0 +1,65 @@
+"""
+API key hashing and the in-process authentication cache.
+
+数据库只保存API Key的SHA-256哈希; 鉴权时先查进程内的 LRU+TTL 缓存 (以哈希为键),
+命中时不访问数据库。Key轮换时显式失效旧哈希; 其他worker进程中的旧条目最多在TTL后过期。
+"""
+import hashlib
+import os
+import secrets
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "10000"))
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", "60"))
+
+def generate_api_key() -> str:
+    return secrets.token_urlsafe(32)
+
+def hash_api_key(api_key: str) -> str:
+    # API Key本身是高熵随机串, 不需要加盐/慢哈希
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+
+class AgentCache:
+    def __init__(self, maxsize: int = AUTH_CACHE_SIZE, ttl: float = AUTH_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict() # key_hash -> (expires_at, agent)
+        self._hash_by_agent: Dict[str, str] = {}
+
+    def get(self, key_hash: str):
+        entry = self._entries.get(key_hash)
+        if entry is None:
+            return None
+        expires_at, agent = entry
+        if expires_at < time.monotonic():
+            self.invalidate(key_hash)
+            return None
+        self._entries.move_to_end(key_hash)
+        return agent
+
+    def put(self, key_hash: str, agent):
+        self._entries[key_hash] = (time.monotonic() + self.ttl, agent)
+        self._entries.move_to_end(key_hash)
+        self._hash_by_agent[agent.id] = key_hash
+        while len(self._entries) > self.maxsize:
+            evicted_hash, (_, evicted) = self._entries.popitem(last=False)
+            if self._hash_by_agent.get(evicted.id) == evicted_hash:
+                del self._hash_by_agent[evicted.id]
+
+    def invalidate(self, key_hash: str):
+        entry = self._entries.pop(key_hash, None)
+        if entry and self._hash_by_agent.get(entry[1].id) == key_hash:
+            del self._hash_by_agent[entry[1].id]
+
+    def invalidate_agent(self, agent_id: str):
+        key_hash: Optional[str] = self._hash_by_agent.pop(agent_id, None)
+        if key_hash:
+            self._entries.pop(key_hash, None)
+
+    def clear(self):
+        self._entries.clear()
+        self._hash_by_agent.clear()
+
+agent_cache = AgentCache()
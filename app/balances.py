@@ -0,0 +1,102 @@
+"""
+Batched, per-block cached USDC balance queries.
+
+原来每个钱包查询余额需要两次RPC (decimals + balanceOf)。这里把多个钱包的 balanceOf 通过
+Multicall3.aggregate3 合并为一次 eth_call (每次最多 MULTICALL_BATCH_SIZE 个), 并在同一个区块高度上执行;
+结果按区块缓存, 出现新区块后才重新查询。显示数千个Agent余额只需要几次RPC。
+"""
+import asyncio
+import os
+from typing import Dict, List, Optional, Tuple
+
+from web3 import Web3
+
+from . import blockchain
+
+# Multicall3 在Base/Base Sepolia等主流链上部署于同一地址
+MULTICALL3_ADDRESS = os.getenv("MULTICALL3_ADDRESS", "0xcA11bde05977b3631167028862bE2a173976CA11")
+MULTICALL_BATCH_SIZE = int(os.getenv("MULTICALL_BATCH_SIZE", "500"))
+# 两次出块之间不重复查询链头高度
+CHAIN_BLOCK_TIME = float(os.getenv("CHAIN_BLOCK_TIME", "2")) # 秒, Base约2秒出一个块
+
+MULTICALL3_ABI = [
+    {
+        "inputs": [
+            {
+                "components": [
+                    {"name": "target", "type": "address"},
+                    {"name": "allowFailure", "type": "bool"},
+                    {"name": "callData", "type": "bytes"}
+                ],
+                "name": "calls",
+                "type": "tuple[]"
+            }
+        ],
+        "name": "aggregate3",
+        "outputs": [
+            {
+                "components": [
+                    {"name": "success", "type": "bool"},
+                    {"name": "returnData", "type": "bytes"}
+                ],
+                "name": "returnData",
+                "type": "tuple[]"
+            }
+        ],
+        "stateMutability": "payable",
+        "type": "function"
+    }
+]
+
+def _checksum(address: str) -> Optional[str]:
+    try:
+        return Web3.to_checksum_address(address)
+    except (ValueError, TypeError):
+        return None
+
+class BalanceService:
+    def __init__(self):
+        self._block_number: Optional[int] = None
+        self._block_checked_at = 0.0
+        self._balances: Dict[str, float] = {} # 当前区块上的余额, 换块时整体清空
+        self._lock = asyncio.Lock()
+
+    async def _head(self) -> int:
+        loop = asyncio.get_running_loop()
+        if self._block_number is None or loop.time() - self._block_checked_at >= CHAIN_BLOCK_TIME:
+            head = await blockchain.get_block_number()
+            if head != self._block_number:
+                self._block_number = head
+                self._balances = {}
+            self._block_checked_at = loop.time()
+        return self._block_number
+
+    def _fetch(self, addresses: List[str], block_number: int) -> Dict[str, float]:
+        w3 = blockchain.WEB3_PROVIDER
+        usdc_contract = blockchain.get_usdc_contract()
+        scale = 10 ** blockchain.CHAIN.decimals(usdc_contract)
+        multicall = w3.eth.contract(address=Web3.to_checksum_address(MULTICALL3_ADDRESS), abi=MULTICALL3_ABI)
+        balances = {}
+        for i in range(0, len(addresses), MULTICALL_BATCH_SIZE):
+            chunk = addresses[i:i + MULTICALL_BATCH_SIZE]
+            calls = [(usdc_contract.address, True, usdc_contract.encode_abi("balanceOf", args=[a])) for a in chunk]
+            results = multicall.functions.aggregate3(calls).call(block_identifier=block_number)
+            for address, (success, data) in zip(chunk, results):
+                if success and len(data) >= 32:
+                    balances[address] = int.from_bytes(data[:32], "big") / scale
+        return balances
+
+    async def get_balances(self, addresses: List[str]) -> Tuple[int, Dict[str, Optional[float]]]:
+        """返回 (区块高度, {地址: USDC余额}); 无效地址或查询失败的地址为None。"""
+        checksummed = {address: _checksum(address) for address in addresses}
+        async with self._lock:
+            block_number = await self._head()
+            missing = sorted({c for c in checksummed.values() if c and c not in self._balances})
+            if missing:
+                fetched = await blockchain.run_blocking(self._fetch, missing, block_number)
+                if block_number == self._block_number:
+                    self._balances.update(fetched)
+            cached = dict(self._balances)
+        return block_number, {address: cached.get(c) if c else None for address, c in checksummed.items()}
+
+balance_service = BalanceService()
@@ -1,7 +1,17 @@
+import asyncio
+import functools
+import math
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from web3 import Web3
+from web3.exceptions import TimeExhausted, TransactionNotFound, Web3RPCError
 # removed: geth_poa_middleware (not required)
 from dotenv import load_dotenv
+from hexbytes import HexBytes
+
+from . import chain_metadata, chain_sim, fees, nonces, rpc
 
 load_dotenv() # 加载.env文件中的环境变量
 
@@ -9,7 +19,15 @@ load_dotenv() # 加载.env文件中的环境变量
 # Base Sepolia Testnet RPC URL (替换为实际可用的RPC)
 # 或者 Base Mainnet RPC URL
 RPC_URL = os.getenv("RPC_URL", "https://sepolia.base.org") # 默认使用Base Sepolia
-WEB3_PROVIDER = Web3(Web3.HTTPProvider(RPC_URL))
+# 链后端: rpc (默认, 真实节点) 或 sim (进程内模拟链, 见 chain_sim.py, 用于离线压测支付流水线)
+CHAIN_BACKEND = os.getenv("CHAIN_BACKEND", "rpc")
+if CHAIN_BACKEND not in ("rpc", "sim"):
+    raise ValueError(f"Unknown CHAIN_BACKEND '{CHAIN_BACKEND}', expected 'rpc' or 'sim'")
+# 可通过 RPC_URLS 配置多个端点 (逗号分隔), 见 rpc.py: 连接池、自动批量、按延迟选择和熔断
+RPC_ENDPOINTS = [chain_sim.SIM_URL] if CHAIN_BACKEND == "sim" else rpc.rpc_urls(RPC_URL)
+WEB3_PROVIDER = Web3(rpc.PooledRPCProvider(RPC_ENDPOINTS))
+# chain_id、decimals只读取一次; gas价格按区块缓存; estimate_gas按调用形状缓存
+CHAIN = chain_metadata.ChainMetadata(WEB3_PROVIDER)
 
 # 添加POA中间件，因为Base Sepolia是Geth PoA兼容的链
 # removed: PoA middleware injection
@@ -26,10 +44,18 @@ PLATFORM_FEE_RECIPIENT_ADDRESS = os.getenv("PLATFORM_FEE_RECIPIENT_ADDRESS", "0x
 # 平台私钥 (用于发起交易的钱包私钥，需要有ETH支付Gas费)
 # **CRITICAL**: 生产环境中绝不能明文存储，应使用密钥管理服务
 PLATFORM_PRIVATE_KEY = os.getenv("PLATFORM_PRIVATE_KEY")
+if not PLATFORM_PRIVATE_KEY and CHAIN_BACKEND == "sim":
+    PLATFORM_PRIVATE_KEY = chain_sim.DEV_PRIVATE_KEY
 
 if not PLATFORM_PRIVATE_KEY:
     raise ValueError("PLATFORM_PRIVATE_KEY environment variable not set.")
 
+PLATFORM_ADDRESS = WEB3_PROVIDER.eth.account.from_key(PLATFORM_PRIVATE_KEY).address
+
+if CHAIN_BACKEND == "sim":
+    # 模拟链: USDC合约部署在配置的地址上, 平台钱包预先充值
+    chain_sim.chain.setup(USDC_CONTRACT_ADDRESS, {PLATFORM_ADDRESS: chain_sim.SIM_INITIAL_BALANCE})
+
 # --- USDC ABI (ERC-20标准简化版) ---
 USDC_ABI = [
     {
@@ -85,91 +111,323 @@ USDC_ABI = [
     }
 ]
 
+# --- 批量支付 (Disperse合约) ---
+# 设置后, settlement worker把多笔赏金合并为一次 disperseToken 调用 (合约通过transferFrom从平台钱包扣款,
+# 需要预先approve); 未设置时每个收款地址单独发送一笔ERC-20 transfer
+DISPERSE_CONTRACT_ADDRESS = os.getenv("DISPERSE_CONTRACT_ADDRESS")
+# 单笔批量交易的gas预算, 按每个收款地址的gas开销计算每批最多包含多少个收款地址
+PAYOUT_BATCH_GAS_BUDGET = int(os.getenv("PAYOUT_BATCH_GAS_BUDGET", "3000000"))
+DISPERSE_BASE_GAS = int(os.getenv("DISPERSE_BASE_GAS", "60000"))
+DISPERSE_GAS_PER_RECIPIENT = int(os.getenv("DISPERSE_GAS_PER_RECIPIENT", "40000"))
+
+DISPERSE_ABI = [
+    {
+        "constant": False,
+        "inputs": [
+            {"name": "token", "type": "address"},
+            {"name": "recipients", "type": "address[]"},
+            {"name": "values", "type": "uint256[]"}
+        ],
+        "name": "disperseToken",
+        "outputs": [],
+        "payable": False,
+        "stateMutability": "nonpayable",
+        "type": "function"
+    }
+]
+
+# Disperse合约通过transferFrom扣款, 需要预先approve: 额度不足时settlement worker生成一笔approve的outbox交易,
+# 授权 max(本轮批量总额, DISPERSE_APPROVAL_USDC), 不做无限授权
+DISPERSE_APPROVAL_USDC = float(os.getenv("DISPERSE_APPROVAL_USDC", "10000"))
+
+def payout_batch_size() -> int:
+    """一笔批量交易最多包含的收款地址数; 未配置Disperse合约时为1。"""
+    if not DISPERSE_CONTRACT_ADDRESS:
+        return 1
+    return max(1, (PAYOUT_BATCH_GAS_BUDGET - DISPERSE_BASE_GAS) // DISPERSE_GAS_PER_RECIPIENT)
+
+# --- 阻塞调用的执行器 ---
+# Web3(HTTPProvider) 是同步的; 所有RPC调用都放到有界线程池中执行, 不阻塞事件循环,
+# 并发的RPC调用可以重叠。等待回执使用异步轮询, 不长期占用线程。
+BLOCKCHAIN_MAX_WORKERS = int(os.getenv("BLOCKCHAIN_MAX_WORKERS", "16"))
+RECEIPT_TIMEOUT = float(os.getenv("RECEIPT_TIMEOUT", "120"))
+RECEIPT_POLL_INTERVAL = float(os.getenv("RECEIPT_POLL_INTERVAL", "1.0"))
+RECEIPT_BATCH_SIZE = int(os.getenv("RECEIPT_BATCH_SIZE", "100")) # 每个JSON-RPC批量请求包含的回执查询数
+
+_executor = ThreadPoolExecutor(max_workers=BLOCKCHAIN_MAX_WORKERS, thread_name_prefix="blockchain")
+
+async def run_blocking(fn, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(fn, *args, **kwargs))
+
+async def wait_for_receipt(tx_hash, timeout: float = RECEIPT_TIMEOUT, poll_interval: float = RECEIPT_POLL_INTERVAL):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            return await run_blocking(WEB3_PROVIDER.eth.get_transaction_receipt, tx_hash)
+        except TransactionNotFound:
+            if time.monotonic() >= deadline:
+                raise TimeExhausted(f"Transaction {Web3.to_hex(tx_hash)} is not in the chain after {timeout} seconds")
+            await asyncio.sleep(poll_interval)
+
 # --- 区块链交互函数 ---
 def get_usdc_contract():
-    return WEB3_PROVIDER.eth.contract(address=USDC_CONTRACT_ADDRESS, abi=USDC_ABI)
+    return WEB3_PROVIDER.eth.contract(address=WEB3_PROVIDER.to_checksum_address(USDC_CONTRACT_ADDRESS), abi=USDC_ABI)
 
-async def transfer_usdc(sender_private_key: str, receiver_address: str, amount_usd: float, platform_fee_usd: float):
-    if not WEB3_PROVIDER.is_connected():
-        raise ConnectionError("Not connected to Web3 provider.")
+def _tx_params(gas: int) -> dict:
+    # 交易的公共字段 (除nonce外), 全部来自缓存
+    return {'chainId': CHAIN.chain_id, 'gas': gas, **CHAIN.fee_params()}
+
+def _gas_limit(call, sender_address: str, recipients: int = 1) -> int:
+    # 调用形状: (合约, 函数, 收款地址数); 同形状的调用共用一次 estimate_gas
+    shape = (call.address, call.fn_name, recipients)
+    return CHAIN.gas_limit(shape, lambda: call.estimate_gas({'from': sender_address}), recipients)
+
+# --- nonce分配 ---
+_nonce_managers = {}
+_nonce_managers_lock = threading.Lock()
+
+def _fetch_pending_nonce(address: str) -> int:
+    return WEB3_PROVIDER.eth.get_transaction_count(address, "pending")
+
+def get_nonce_manager(address: str) -> nonces.NonceManager:
+    with _nonce_managers_lock:
+        if address not in _nonce_managers:
+            _nonce_managers[address] = nonces.NonceManager(address, _fetch_pending_nonce)
+        return _nonce_managers[address]
+
+def _is_nonce_conflict(error: Exception) -> bool:
+    message = str(error).lower()
+    return "nonce too low" in message or "replacement transaction underpriced" in message
+
+def _sign(sender_private_key: str, build_tx, persist=None):
+    """分配nonce并签名, 返回 (nonce, signed_tx)。
 
+    build_tx(nonce) 返回未签名交易; persist(conn, nonce, tx_hash, raw_tx) 与nonce分配在同一个数据库事务中执行,
+    settlement用它把签好的交易记录到outbox行上, 之后才广播。
+    """
+    sender_account = WEB3_PROVIDER.eth.account.from_key(sender_private_key)
+    signed = []
+
+    def assign(conn, nonces):
+        signed_tx = WEB3_PROVIDER.eth.account.sign_transaction(build_tx(nonces[0]), private_key=sender_private_key)
+        if persist:
+            persist(conn, nonces[0], Web3.to_hex(signed_tx.hash), Web3.to_hex(signed_tx.raw_transaction))
+        signed.append((nonces[0], signed_tx))
+    get_nonce_manager(sender_account.address).reserve(assign=assign)
+    return signed[-1]
+
+def _broadcast(raw_tx) -> bytes:
+    try:
+        return WEB3_PROVIDER.eth.send_raw_transaction(raw_tx)
+    except Web3RPCError as e:
+        if "already known" in str(e).lower():
+            return Web3.keccak(HexBytes(raw_tx))
+        raise
+
+def _sign_and_send(sender_private_key: str, build_tx):
+    # 不经过outbox的发送 (transfer_usdc/approve_usdc): 签名后立即广播
+    manager = get_nonce_manager(WEB3_PROVIDER.eth.account.from_key(sender_private_key).address)
+    for attempt in range(2):
+        nonce, signed_tx = _sign(sender_private_key, build_tx)
+        try:
+            return _broadcast(signed_tx.raw_transaction)
+        except Web3RPCError as e:
+            if _is_nonce_conflict(e) and attempt == 0:
+                # nonce已被其他交易占用 (例如钱包被外部使用): 重新同步后换一个nonce
+                manager.resync()
+                continue
+            # 节点明确拒绝了交易, nonce未被使用, 可以回收;
+            # 连接错误时交易可能已经广播, 不回收nonce
+            manager.release([nonce])
+            raise
+
+def _transfer_builder(sender_private_key: str, receiver_address: str, amount_micro: int):
     usdc_contract = get_usdc_contract()
     sender_account = WEB3_PROVIDER.eth.account.from_key(sender_private_key)
-    
-    # 获取USDC的decimals
-    decimals = usdc_contract.functions.decimals().call()
-    
-    # 转换金额为合约所需的单位 (例如，USDC通常是6位小数)
-    amount_wei = int(amount_usd * (10 ** decimals))
-    platform_fee_wei = int(platform_fee_usd * (10 ** decimals))
-    
+    # 金额在outbox中就是整数micro-USDC, 按合约精度做整数换算, 不经过浮点
+    amount_units = fees.to_token_units(amount_micro, CHAIN.decimals(usdc_contract))
+    call = usdc_contract.functions.transfer(WEB3_PROVIDER.to_checksum_address(receiver_address), amount_units)
+    params = _tx_params(_gas_limit(call, sender_account.address))
+    return lambda nonce: call.build_transaction({**params, 'nonce': nonce})
+
+def _send_transfers(sender_private_key: str, receiver_address: str, amount_micro: int, platform_fee_micro: int):
     # 平台收取手续费
-    if platform_fee_wei > 0:
-        platform_fee_tx = usdc_contract.functions.transfer(
-            WEB3_PROVIDER.to_checksum_address(PLATFORM_FEE_RECIPIENT_ADDRESS),
-            platform_fee_wei
-        ).build_transaction({
-            'chainId': WEB3_PROVIDER.eth.chain_id,
-            'gas': 200000, # 估算Gas limit
-            'gasPrice': WEB3_PROVIDER.eth.gas_price,
-            'nonce': WEB3_PROVIDER.eth.get_transaction_count(sender_account.address)
-        })
-        signed_platform_fee_tx = WEB3_PROVIDER.eth.account.sign_transaction(platform_fee_tx, private_key=sender_private_key)
-        platform_fee_tx_hash = WEB3_PROVIDER.eth.send_raw_transaction(signed_platform_fee_tx.rawTransaction)
-        print(f"Platform fee transaction sent: {platform_fee_tx_hash.hex()}")
-        # 等待交易确认
-        WEB3_PROVIDER.eth.wait_for_transaction_receipt(platform_fee_tx_hash)
+    platform_fee_tx_hash = None
+    if platform_fee_micro > 0:
+        platform_fee_tx_hash = _sign_and_send(
+            sender_private_key, _transfer_builder(sender_private_key, PLATFORM_FEE_RECIPIENT_ADDRESS, platform_fee_micro)
+        )
+        print(f"Platform fee transaction sent: {Web3.to_hex(platform_fee_tx_hash)}")
 
     # 支付赏金给认领者
-    bounty_tx = usdc_contract.functions.transfer(
-        WEB3_PROVIDER.to_checksum_address(receiver_address),
-        amount_wei
-    ).build_transaction({
-        'chainId': WEB3_PROVIDER.eth.chain_id,
-        'gas': 200000, # 估算Gas limit
-        'gasPrice': WEB3_PROVIDER.eth.gas_price,
-        'nonce': WEB3_PROVIDER.eth.get_transaction_count(sender_account.address) + (1 if platform_fee_wei > 0 else 0) # Nonce需要递增
-    })
-    signed_bounty_tx = WEB3_PROVIDER.eth.account.sign_transaction(bounty_tx, private_key=sender_private_key)
-    bounty_tx_hash = WEB3_PROVIDER.eth.send_raw_transaction(signed_bounty_tx.rawTransaction)
-    print(f"Bounty transaction sent: {bounty_tx_hash.hex()}")
-    # 等待交易确认
-    WEB3_PROVIDER.eth.wait_for_transaction_receipt(bounty_tx_hash)
-
-    return {"bounty_tx_hash": bounty_tx_hash.hex(), "platform_fee_tx_hash": platform_fee_tx_hash.hex() if platform_fee_wei > 0 else None}
+    bounty_tx_hash = _sign_and_send(sender_private_key, _transfer_builder(sender_private_key, receiver_address, amount_micro))
+    print(f"Bounty transaction sent: {Web3.to_hex(bounty_tx_hash)}")
+    return bounty_tx_hash, platform_fee_tx_hash
 
-async def get_usdc_balance(wallet_address: str) -> float:
-    if not WEB3_PROVIDER.is_connected():
-        raise ConnectionError("Not connected to Web3 provider.")
+async def send_usdc_transfer(sender_private_key: str, receiver_address: str, amount_micro: int, platform_fee_micro: int = 0):
+    # 签名后立即广播, 不等待确认; 金额为整数micro-USDC
+    bounty_tx_hash, platform_fee_tx_hash = await run_blocking(
+        _send_transfers, sender_private_key, receiver_address, amount_micro, platform_fee_micro
+    )
+    return {"bounty_tx_hash": Web3.to_hex(bounty_tx_hash), "platform_fee_tx_hash": Web3.to_hex(platform_fee_tx_hash) if platform_fee_tx_hash else None}
+
+def _signed(nonce_and_tx):
+    _, signed_tx = nonce_and_tx
+    return Web3.to_hex(signed_tx.hash), Web3.to_hex(signed_tx.raw_transaction)
+
+async def sign_usdc_transfer(sender_private_key: str, receiver_address: str, amount_micro: int, persist):
+    """outbox支付: 分配nonce、签名并通过persist记录, 不广播; 返回 (tx_hash, raw_tx)。"""
+    def sign():
+        return _signed(_sign(sender_private_key, _transfer_builder(sender_private_key, receiver_address, amount_micro), persist))
+    return await run_blocking(sign)
+
+# 在同一nonce上替换交易时, gas价格字段至少提高这个倍数 (节点通常要求提价10%以上), 并且不低于当前市场价
+TX_REPLACEMENT_FEE_BUMP = float(os.getenv("TX_REPLACEMENT_FEE_BUMP", "1.125"))
+CANCEL_GAS = 21000 # 取消交易: 0金额的自转账
+
+def _sign_replacement(sender_private_key: str, raw_tx: str, cancel: bool = False):
+    tx = rpc.decode_raw_transaction(HexBytes(raw_tx))
+    if "chainId" not in tx: # legacy交易
+        tx["chainId"] = CHAIN.chain_id
+    for key in ("v", "r", "s"):
+        tx.pop(key, None)
+    market = CHAIN.fee_params()
+    for key in ("maxFeePerGas", "maxPriorityFeePerGas", "gasPrice"):
+        if key in tx:
+            tx[key] = max(math.ceil(tx[key] * TX_REPLACEMENT_FEE_BUMP), market.get(key, 0))
+    if "maxFeePerGas" in tx:
+        tx["maxFeePerGas"] = max(tx["maxFeePerGas"], tx["maxPriorityFeePerGas"])
+    if cancel:
+        sender_address = WEB3_PROVIDER.eth.account.from_key(sender_private_key).address
+        tx.update({"to": sender_address, "value": 0, "data": b"", "gas": CANCEL_GAS})
+    else:
+        tx["to"] = WEB3_PROVIDER.to_checksum_address(tx["to"])
+    signed_tx = WEB3_PROVIDER.eth.account.sign_transaction(tx, private_key=sender_private_key)
+    return Web3.to_hex(signed_tx.hash), Web3.to_hex(signed_tx.raw_transaction)
+
+async def sign_replacement(sender_private_key: str, raw_tx: str, cancel: bool = False):
+    """在原交易的nonce上签一笔提价的替换交易 (cancel=True 时改为0金额的自转账), 不广播; 返回 (tx_hash, raw_tx)。"""
+    return await run_blocking(_sign_replacement, sender_private_key, raw_tx, cancel)
+
+def is_rejected(error: Exception) -> bool:
+    """节点明确返回了JSON-RPC错误 (交易没有被接受); 其他错误 (连接失败、超时) 时交易可能已经广播, 状态未知。"""
+    return isinstance(error, Web3RPCError)
+
+async def send_raw_transaction(raw_tx: str) -> str:
+    """广播 (或重新广播) 一笔已签名的交易; 节点已经有这笔交易时同样返回其哈希。"""
+    return Web3.to_hex(await run_blocking(_broadcast, raw_tx))
+
+def _approve_builder(sender_private_key: str, spender_address: str, amount_micro: int):
+    usdc_contract = get_usdc_contract()
+    sender_account = WEB3_PROVIDER.eth.account.from_key(sender_private_key)
+    amount_units = fees.to_token_units(amount_micro, CHAIN.decimals(usdc_contract))
+    call = usdc_contract.functions.approve(WEB3_PROVIDER.to_checksum_address(spender_address), amount_units)
+    params = _tx_params(_gas_limit(call, sender_account.address, recipients=0))
+    return lambda nonce: call.build_transaction({**params, 'nonce': nonce})
+
+async def sign_usdc_approve(sender_private_key: str, spender_address: str, amount_micro: int, persist):
+    """outbox授权: 分配nonce、签名并通过persist记录, 不广播也不等待上链; 返回 (tx_hash, raw_tx)。"""
+    def sign():
+        return _signed(_sign(sender_private_key, _approve_builder(sender_private_key, spender_address, amount_micro), persist))
+    return await run_blocking(sign)
+
+def _get_usdc_allowance_micro(owner_address: str, spender_address: str) -> int:
     usdc_contract = get_usdc_contract()
-    decimals = usdc_contract.functions.decimals().call()
+    decimals = CHAIN.decimals(usdc_contract)
+    allowance = usdc_contract.functions.allowance(
+        WEB3_PROVIDER.to_checksum_address(owner_address), WEB3_PROVIDER.to_checksum_address(spender_address)
+    ).call()
+    return allowance * fees.MICRO_PER_USDC // 10 ** decimals
+
+async def get_usdc_allowance_micro(owner_address: str, spender_address: str) -> int:
+    """最新区块上的授权额度 (micro-USDC, 向下取整)。"""
+    return await run_blocking(_get_usdc_allowance_micro, owner_address, spender_address)
+
+def _batch_builder(sender_private_key: str, payouts):
+    if len(payouts) > payout_batch_size():
+        raise ValueError(f"Batch of {len(payouts)} payouts exceeds the gas budget ({payout_batch_size()} recipients)")
+
+    usdc_contract = get_usdc_contract()
+    decimals = CHAIN.decimals(usdc_contract)
+    recipients = [WEB3_PROVIDER.to_checksum_address(address) for address, _ in payouts]
+    values = [fees.to_token_units(amount_micro, decimals) for _, amount_micro in payouts]
+
+    sender_account = WEB3_PROVIDER.eth.account.from_key(sender_private_key)
+    disperse = WEB3_PROVIDER.eth.contract(address=WEB3_PROVIDER.to_checksum_address(DISPERSE_CONTRACT_ADDRESS), abi=DISPERSE_ABI)
+    call = disperse.functions.disperseToken(usdc_contract.address, recipients, values)
+    params = _tx_params(_gas_limit(call, sender_account.address, recipients=len(recipients)))
+    return lambda nonce: call.build_transaction({**params, 'nonce': nonce})
+
+async def sign_usdc_batch(sender_private_key: str, payouts, persist):
+    """payouts: [(receiver_address, amount_micro)], 签名一笔Disperse批量交易并通过persist记录, 不广播; 返回 (tx_hash, raw_tx)。"""
+    def sign():
+        return _signed(_sign(sender_private_key, _batch_builder(sender_private_key, payouts), persist))
+    return await run_blocking(sign)
+
+async def transfer_usdc(sender_private_key: str, receiver_address: str, amount_usd: float, platform_fee_usd: float):
+    tx_info = await send_usdc_transfer(
+        sender_private_key, receiver_address, fees.to_micro(amount_usd), fees.to_micro(platform_fee_usd)
+    )
+    # 等待交易确认 (两笔交易并行等待)
+    await asyncio.gather(*(wait_for_receipt(h) for h in tx_info.values() if h))
+    return tx_info
+
+async def get_transaction_receipt(tx_hash):
+    # 交易尚未上链时返回None
+    try:
+        return await run_blocking(WEB3_PROVIDER.eth.get_transaction_receipt, tx_hash)
+    except TransactionNotFound:
+        return None
+
+def _get_transaction_receipts(tx_hashes):
+    # JSON-RPC批量请求: 每 RECEIPT_BATCH_SIZE 个哈希一次HTTP往返; 返回原始回执 (hex字段), 未上链为None
+    receipts = {}
+    for i in range(0, len(tx_hashes), RECEIPT_BATCH_SIZE):
+        chunk = tx_hashes[i:i + RECEIPT_BATCH_SIZE]
+        responses = WEB3_PROVIDER.provider.make_batch_request([("eth_getTransactionReceipt", [h]) for h in chunk])
+        if not isinstance(responses, list):
+            raise Web3RPCError(f"Batch receipt request failed: {responses.get('error')}")
+        for tx_hash, response in zip(chunk, responses):
+            if "error" in response:
+                raise Web3RPCError(f"eth_getTransactionReceipt({tx_hash}) failed: {response['error']}")
+            receipt = response.get("result")
+            receipts[tx_hash] = None if receipt is None else {
+                "blockNumber": int(receipt["blockNumber"], 16),
+                "blockHash": receipt["blockHash"],
+                "status": int(receipt["status"], 16),
+            }
+    return receipts
+
+async def get_transaction_receipts(tx_hashes):
+    """批量查询回执: {tx_hash: {"blockNumber", "blockHash", "status"} 或 None}。"""
+    return await run_blocking(_get_transaction_receipts, list(tx_hashes))
+
+async def get_block_number() -> int:
+    return await run_blocking(lambda: WEB3_PROVIDER.eth.block_number)
+
+async def get_transaction_count(address: str, block_identifier) -> int:
+    """address在指定区块 (含) 之前已使用的nonce数, 即下一个nonce。"""
+    return await run_blocking(WEB3_PROVIDER.eth.get_transaction_count, address, block_identifier)
+
+def _get_usdc_balance(wallet_address: str) -> float:
+    usdc_contract = get_usdc_contract()
+    decimals = CHAIN.decimals(usdc_contract)
     balance_wei = usdc_contract.functions.balanceOf(WEB3_PROVIDER.to_checksum_address(wallet_address)).call()
     return balance_wei / (10 ** decimals)
 
+async def get_usdc_balance(wallet_address: str) -> float:
+    return await run_blocking(_get_usdc_balance, wallet_address)
+
+def _send_approve(sender_private_key: str, spender_address: str, amount_usd: float):
+    tx_hash = _sign_and_send(sender_private_key, _approve_builder(sender_private_key, spender_address, fees.to_micro(amount_usd)))
+    print(f"Approval transaction sent: {Web3.to_hex(tx_hash)}")
+    return tx_hash
+
 async def approve_usdc(sender_private_key: str, spender_address: str, amount_usd: float):
-    if not WEB3_PROVIDER.is_connected():
-        raise ConnectionError("Not connected to Web3 provider.")
-    
-    usdc_contract = get_usdc_contract()
-    sender_account = WEB3_PROVIDER.eth.account.from_key(sender_private_key)
-    decimals = usdc_contract.functions.decimals().call()
-    amount_wei = int(amount_usd * (10 ** decimals))
-
-    tx = usdc_contract.functions.approve(
-        WEB3_PROVIDER.to_checksum_address(spender_address),
-        amount_wei
-    ).build_transaction({
-        'chainId': WEB3_PROVIDER.eth.chain_id,
-        'gas': 100000, # 估算Gas limit
-        'gasPrice': WEB3_PROVIDER.eth.gas_price,
-        'nonce': WEB3_PROVIDER.eth.get_transaction_count(sender_account.address)
-    })
-    
-    signed_tx = WEB3_PROVIDER.eth.account.sign_transaction(tx, private_key=sender_private_key)
-    tx_hash = WEB3_PROVIDER.eth.send_raw_transaction(signed_tx.rawTransaction)
-    print(f"Approval transaction sent: {tx_hash.hex()}")
-    WEB3_PROVIDER.eth.wait_for_transaction_receipt(tx_hash)
-    return tx_hash.hex()
+    tx_hash = await run_blocking(_send_approve, sender_private_key, spender_address, amount_usd)
+    await wait_for_receipt(tx_hash)
+    return Web3.to_hex(tx_hash)
 
 if __name__ == "__main__":
     print("Blockchain module initialized.")
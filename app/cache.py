@@ -0,0 +1,166 @@
+"""
+Write-invalidated in-process caches: task listing responses and the webhook registry.
+
+大量Agent以相同的参数轮询 GET /tasks/ (例如 ?status=open&limit=100), 每次都查询数据库并用Pydantic序列化。
+这里按规范化后的查询参数缓存已序列化的响应体 (bytes):
+- crud中的任务写入提交后调用 invalidate(): 代数 (generation) 加一并清空缓存; 写入之前开始的填充
+  带着旧代数, 完成后不会写入缓存, 不会把旧数据放回去;
+- 同一个键的并发未命中合并为一次填充 (single-flight), 其余请求等待同一个结果;
+- LRU淘汰, 同时限制条目数 (TASK_CACHE_MAX_ENTRIES) 和响应体总字节数 (TASK_CACHE_MAX_BYTES);
+- 条目有较短的TTL (TASK_CACHE_TTL): 失效只发生在本进程内, 其他worker进程或绕过crud的写入最多在TTL后可见。
+  TASK_CACHE_TTL=0 关闭缓存。
+
+webhook注册表 (webhook_registry): 每次任务写入都要查找相关Agent的webhook, 绝大多数Agent没有注册任何webhook。
+按agent_id缓存其有效webhook (空列表同样缓存), 注册/删除时失效; 其他进程中的旧条目最多在
+WEBHOOK_REGISTRY_TTL 后过期 (已删除的webhook在投递时还会再检查一次active)。
+"""
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, FrozenSet, Hashable, Iterable, List, Optional, Set, Tuple
+
+TASK_CACHE_TTL = float(os.getenv("TASK_CACHE_TTL", "1"))
+TASK_CACHE_MAX_ENTRIES = int(os.getenv("TASK_CACHE_MAX_ENTRIES", "1000"))
+TASK_CACHE_MAX_BYTES = int(os.getenv("TASK_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+WEBHOOK_REGISTRY_TTL = float(os.getenv("WEBHOOK_REGISTRY_TTL", "30"))
+WEBHOOK_REGISTRY_MAX_ENTRIES = int(os.getenv("WEBHOOK_REGISTRY_MAX_ENTRIES", "100000"))
+
+class CachedResponse:
+    __slots__ = ("body", "headers", "etag")
+
+    def __init__(self, body: bytes, headers: Dict[str, str], etag: Optional[str] = None):
+        self.body = body
+        self.headers = headers
+        self.etag = etag
+
+class ResponseCache:
+    def __init__(self, ttl: float = TASK_CACHE_TTL, max_entries: int = TASK_CACHE_MAX_ENTRIES,
+                 max_bytes: int = TASK_CACHE_MAX_BYTES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.generation = 0
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict() # key -> (expires_at, response)
+        self._bytes = 0
+        self._flights: Dict[tuple, asyncio.Future] = {} # (key, generation) -> 进行中的填充
+        self.stats = {"hits": 0, "misses": 0, "coalesced": 0, "evictions": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0 and self.max_entries > 0
+
+    def get(self, key: Hashable) -> Optional[CachedResponse]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, response = entry
+        if expires_at < time.monotonic():
+            self._discard(key)
+            return None
+        self._entries.move_to_end(key)
+        self.stats["hits"] += 1
+        return response
+
+    def _discard(self, key: Hashable):
+        entry = self._entries.pop(key, None)
+        if entry:
+            self._bytes -= len(entry[1].body)
+
+    def _put(self, key: Hashable, response: CachedResponse, generation: int):
+        # 填充期间发生了写入: 结果可能已过期, 只返回给等待者, 不缓存
+        if generation != self.generation or len(response.body) > self.max_bytes:
+            return
+        self._discard(key)
+        self._entries[key] = (time.monotonic() + self.ttl, response)
+        self._bytes += len(response.body)
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            _, (_, evicted) = self._entries.popitem(last=False)
+            self._bytes -= len(evicted.body)
+            self.stats["evictions"] += 1
+
+    async def get_or_fill(self, key: Hashable, fill: Callable[[], Awaitable[CachedResponse]]) -> CachedResponse:
+        """命中时直接返回; 未命中时执行 fill (同一个键同时只执行一次), 结果写入缓存。"""
+        if not self.enabled:
+            return await fill()
+        response = self.get(key)
+        if response is not None:
+            return response
+
+        # 按 (键, 代数) 合并: 写入之后到达的请求不会等待写入之前开始的填充
+        generation = self.generation
+        flight = self._flights.get((key, generation))
+        if flight is None:
+            self.stats["misses"] += 1
+            flight = asyncio.ensure_future(fill())
+            self._flights[(key, generation)] = flight
+
+            def done(future: asyncio.Future):
+                self._flights.pop((key, generation), None)
+                if not future.cancelled() and future.exception() is None:
+                    self._put(key, future.result(), generation)
+            flight.add_done_callback(done)
+        else:
+            self.stats["coalesced"] += 1
+        # shield: 发起填充的请求被取消 (客户端断开) 时, 填充继续为其他等待者完成
+        return await asyncio.shield(flight)
+
+    def invalidate(self):
+        self.generation += 1
+        self._entries.clear()
+        self._bytes = 0
+
+    @property
+    def size_bytes(self) -> int:
+        return self._bytes
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+task_list_cache = ResponseCache()
+
+CachedWebhook = Tuple[str, Optional[FrozenSet[str]]] # (webhook_id, event_types; None表示全部事件)
+
+class WebhookRegistry:
+    def __init__(self, ttl: float = WEBHOOK_REGISTRY_TTL, max_entries: int = WEBHOOK_REGISTRY_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.generation = 0
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict() # agent_id -> (expires_at, [CachedWebhook])
+        self.stats = {"hits": 0, "misses": 0}
+
+    def get_many(self, agent_ids: Iterable[str]) -> Tuple[Dict[str, List[CachedWebhook]], Set[str]]:
+        """返回 (已缓存的 agent_id -> webhooks, 需要从数据库加载的agent_id)。"""
+        found, missing = {}, set()
+        now = time.monotonic()
+        for agent_id in agent_ids:
+            entry = self._entries.get(agent_id)
+            if entry is None or entry[0] < now:
+                missing.add(agent_id)
+                continue
+            self._entries.move_to_end(agent_id)
+            found[agent_id] = entry[1]
+        self.stats["hits"] += len(found)
+        self.stats["misses"] += len(missing)
+        return found, missing
+
+    def put_many(self, webhooks_by_agent: Dict[str, List[CachedWebhook]], generation: int):
+        # 读取之后发生了注册/删除: 结果可能已过期, 不缓存
+        if generation != self.generation or self.ttl <= 0:
+            return
+        expires_at = time.monotonic() + self.ttl
+        for agent_id, webhooks in webhooks_by_agent.items():
+            self._entries[agent_id] = (expires_at, webhooks)
+            self._entries.move_to_end(agent_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, agent_id: Optional[str] = None):
+        """agent_id为None时清空全部 (例如按webhook id停用, 不知道所属Agent)。"""
+        self.generation += 1
+        if agent_id is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(agent_id, None)
+
+webhook_registry = WebhookRegistry()
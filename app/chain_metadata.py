@@ -0,0 +1,78 @@
+"""
+Chain metadata and fee-oracle cache.
+
+每笔转账原来都要通过RPC重新读取 decimals()、chain_id 和 gas_price, 并使用固定的gas limit。
+- 不变的值 (chain_id、代币decimals) 只读取一次;
+- EIP-1559 的 base fee / priority fee 按区块号缓存: 每次只查询一次很便宜的 eth_blockNumber,
+  链头前进之后才重新读取区块和priority fee (按时间过期的缓存可能在新区块上继续使用旧的base fee);
+- estimate_gas 按调用形状 (合约地址, 函数选择器, 收款地址数) 缓存估算值。
+"""
+import os
+import threading
+import time
+from typing import Callable, Dict, Hashable, Optional, Tuple
+
+GAS_ESTIMATE_TTL = float(os.getenv("GAS_ESTIMATE_TTL", "600"))
+GAS_LIMIT_MULTIPLIER = float(os.getenv("GAS_LIMIT_MULTIPLIER", "1.2")) # estimate_gas 结果的余量
+# 收款地址首次持有代币时要多写一个存储槽, 估算时的收款地址未必如此; 未用完的gas会退还, 多留不多付
+NEW_HOLDER_GAS = int(os.getenv("NEW_HOLDER_GAS", "20000"))
+# maxFeePerGas = base fee * 倍数 + priority fee, 可以承受连续几个区块的base fee上涨
+BASE_FEE_MULTIPLIER = float(os.getenv("BASE_FEE_MULTIPLIER", "2"))
+
+class ChainMetadata:
+    def __init__(self, w3):
+        self.w3 = w3
+        self._lock = threading.Lock()
+        self._chain_id: Optional[int] = None
+        self._decimals: Dict[str, int] = {}
+        self._fees: Optional[Tuple[int, dict]] = None # (block_number, fee_params)
+        self._gas: Dict[Hashable, Tuple[float, int]] = {} # shape -> (estimated_at, estimate), 过期后用新的估算值替换
+
+    @property
+    def chain_id(self) -> int:
+        if self._chain_id is None:
+            self._chain_id = self.w3.eth.chain_id
+        return self._chain_id
+
+    def decimals(self, contract) -> int:
+        address = contract.address
+        if address not in self._decimals:
+            self._decimals[address] = contract.functions.decimals().call()
+        return self._decimals[address]
+
+    def fee_params(self) -> dict:
+        """交易的gas价格字段: 支持EIP-1559的链返回 maxFeePerGas/maxPriorityFeePerGas, 否则返回 gasPrice。"""
+        head = self.w3.eth.block_number
+        with self._lock:
+            if self._fees and self._fees[0] >= head:
+                return self._fees[1]
+        block = self.w3.eth.get_block(head)
+        base_fee = block.get("baseFeePerGas")
+        if base_fee is None:
+            params = {"gasPrice": self.w3.eth.gas_price}
+        else:
+            priority_fee = self.w3.eth.max_priority_fee
+            params = {
+                "maxFeePerGas": int(base_fee * BASE_FEE_MULTIPLIER) + priority_fee,
+                "maxPriorityFeePerGas": priority_fee,
+            }
+        with self._lock:
+            # 并发的调用者可能已经写入了更新的区块
+            if not self._fees or self._fees[0] <= block["number"]:
+                self._fees = (block["number"], params)
+        return params
+
+    def gas_limit(self, shape: Hashable, estimate: Callable[[], int], recipients: int = 1) -> int:
+        """shape 相同的调用在 GAS_ESTIMATE_TTL 内共用一次 estimate_gas 的结果。"""
+        now = time.monotonic()
+        with self._lock:
+            cached = self._gas.get(shape)
+        if cached is None or now - cached[0] > GAS_ESTIMATE_TTL:
+            cached = (now, estimate())
+            with self._lock:
+                self._gas[shape] = cached
+        return int(cached[1] * GAS_LIMIT_MULTIPLIER) + NEW_HOLDER_GAS * recipients
+
+    def invalidate_gas(self, shape: Hashable):
+        with self._lock:
+            self._gas.pop(shape, None)
@@ -0,0 +1,589 @@
+"""
+In-process simulated ERC-20 chain (CHAIN_BACKEND=sim).
+
+用于在没有网络的构建机上压测和回归测试支付流水线 (审核通过 -> settlement worker -> 确认跟踪):
+模拟节点以 sim:// 端点的形式接入 rpc.PooledRPCProvider, 直接处理JSON-RPC请求体,
+因此 blockchain.py 中的签名、nonce分配、自动批量、批量回执查询等代码路径与真实节点完全相同。
+
+- 一个USDC合约 (transfer/approve/transferFrom/balanceOf/allowance/decimals, 产生Transfer日志);
+  任意地址上的 disperseToken 和 aggregate3 调用分别按 Disperse 合约和 Multicall3 处理;
+- 交易先进入mempool (nonce检查、already known、替换交易需提价10%), 每 SIM_BLOCK_TIME 秒出一个块,
+  按nonce顺序打包, 受 SIM_BLOCK_GAS_LIMIT 限制; SIM_BLOCK_TIME=0 时每笔交易立即出块;
+- 故障注入: RPC连接失败 (SIM_RPC_ERROR_RATE, 请求未到达节点)、响应丢失 (SIM_RPC_LOST_RATE, 请求已被处理,
+  例如交易已经进入mempool, 但客户端只看到连接错误)、交易被静默丢弃 (SIM_DROP_RATE)、
+  交易revert (SIM_REVERT_RATE)、出块后重组最近 1..SIM_REORG_DEPTH 个区块 (SIM_REORG_RATE);
+- SIM_LATENCY_MS 模拟每次HTTP往返的延迟, 批量请求只计一次。
+
+SIM_SEED 固定随机数种子, 压测结果可复现。
+"""
+import json
+import os
+import random
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import requests
+from eth_abi import decode, encode
+from eth_account import Account
+from web3 import Web3
+
+from .rpc import Endpoint, decode_raw_transaction
+
+SIM_URL = "sim://local"
+SIM_CHAIN_ID = int(os.getenv("SIM_CHAIN_ID", "84532"))
+SIM_BLOCK_TIME = float(os.getenv("SIM_BLOCK_TIME", "2")) # 秒; 0: 每笔交易立即出块
+SIM_BLOCK_GAS_LIMIT = int(os.getenv("SIM_BLOCK_GAS_LIMIT", "30000000"))
+SIM_MEMPOOL_SIZE = int(os.getenv("SIM_MEMPOOL_SIZE", "10000"))
+SIM_BASE_FEE = int(os.getenv("SIM_BASE_FEE", "10000000")) # wei
+SIM_PRIORITY_FEE = int(os.getenv("SIM_PRIORITY_FEE", "1000000")) # wei
+SIM_DECIMALS = int(os.getenv("SIM_DECIMALS", "6"))
+SIM_INITIAL_BALANCE = float(os.getenv("SIM_INITIAL_BALANCE", "1000000")) # 平台钱包的初始USDC
+SIM_LATENCY = float(os.getenv("SIM_LATENCY_MS", "0")) / 1000
+# 保留历史状态的区块数: 按区块号查询 (例如确认深度处的nonce) 需要; 更早的区块用最新状态近似
+SIM_STATE_HISTORY = int(os.getenv("SIM_STATE_HISTORY", "64"))
+SIM_MAX_LOG_RANGE = int(os.getenv("SIM_MAX_LOG_RANGE", "10000")) # eth_getLogs 单次最大区块范围
+# --- 故障注入 (概率, 0~1) ---
+SIM_RPC_ERROR_RATE = float(os.getenv("SIM_RPC_ERROR_RATE", "0"))
+SIM_RPC_LOST_RATE = float(os.getenv("SIM_RPC_LOST_RATE", "0")) # 请求已被处理, 但响应丢失
+SIM_DROP_RATE = float(os.getenv("SIM_DROP_RATE", "0"))
+SIM_REVERT_RATE = float(os.getenv("SIM_REVERT_RATE", "0"))
+SIM_REORG_RATE = float(os.getenv("SIM_REORG_RATE", "0"))
+SIM_REORG_DEPTH = int(os.getenv("SIM_REORG_DEPTH", "2"))
+SIM_SEED = os.getenv("SIM_SEED")
+
+# PLATFORM_PRIVATE_KEY 未设置时模拟链使用的开发私钥, 只能用于模拟链
+DEV_PRIVATE_KEY = "0x" + "5a" * 32
+
+# --- gas模型 (近似真实ERC-20的开销) ---
+GAS_TX = 21000
+GAS_TRANSFER = 12000
+GAS_NEW_HOLDER = 20000 # 收款地址首次持有代币
+GAS_APPROVE = 25000
+GAS_CALL_OVERHEAD = 10000 # Disperse合约自身的开销
+
+def _selector(signature: str) -> bytes:
+    return bytes(Web3.keccak(text=signature)[:4])
+
+TRANSFER = _selector("transfer(address,uint256)")
+APPROVE = _selector("approve(address,uint256)")
+TRANSFER_FROM = _selector("transferFrom(address,address,uint256)")
+BALANCE_OF = _selector("balanceOf(address)")
+ALLOWANCE = _selector("allowance(address,address)")
+DECIMALS = _selector("decimals()")
+DISPERSE_TOKEN = _selector("disperseToken(address,address[],uint256[])")
+AGGREGATE3 = _selector("aggregate3((address,bool,bytes)[])")
+TRANSFER_TOPIC = bytes(Web3.keccak(text="Transfer(address,address,uint256)"))
+APPROVAL_TOPIC = bytes(Web3.keccak(text="Approval(address,address,uint256)"))
+
+class Revert(Exception):
+    pass
+
+class RPCError(Exception):
+    def __init__(self, message: str, code: int = -32000):
+        super().__init__(message)
+        self.code = code
+
+def _hex(value) -> str:
+    return hex(value) if isinstance(value, int) else "0x" + bytes(value).hex()
+
+def _word(address: str) -> bytes:
+    return bytes(12) + bytes.fromhex(address[2:])
+
+def _intrinsic_gas(data: bytes) -> int:
+    return GAS_TX + sum(16 if b else 4 for b in data)
+
+class State:
+    def __init__(self, balances=None, allowances=None, nonces=None):
+        self.balances: Dict[str, int] = balances or {}
+        self.allowances: Dict[Tuple[str, str], int] = allowances or {}
+        self.nonces: Dict[str, int] = nonces or {}
+
+    def copy(self) -> "State":
+        return State(dict(self.balances), dict(self.allowances), dict(self.nonces))
+
+class SimulatedChain:
+    def __init__(self, block_time: float = SIM_BLOCK_TIME, seed=SIM_SEED):
+        self.block_time = block_time
+        self.random = random.Random(seed)
+        self.token: Optional[str] = None
+        self.state = State()
+        self.blocks: List[dict] = []
+        self.mempool: Dict[Tuple[str, int], dict] = {} # (sender, nonce) -> tx, 按到达顺序
+        self._snapshots: Dict[int, State] = {} # 区块号 -> 执行该区块之前的状态, 保留最近 SIM_STATE_HISTORY 个区块
+        self._tx_blocks: Dict[str, int] = {} # 交易哈希 -> 区块号
+        self._salt = 0 # 重组后新区块的哈希与被替换的区块不同
+        self._lock = threading.RLock()
+        self._producer: Optional[threading.Thread] = None
+        self.stats = {"mined": 0, "reverted": 0, "dropped": 0, "reorgs": 0, "rpc_errors": 0, "rpc_lost": 0}
+        self._append_block([], [])
+
+    # --- 初始化 ---
+    def setup(self, token_address: str, balances: Dict[str, float]):
+        """在 token_address 部署模拟USDC合约, 并给指定钱包充值 (单位USDC)。"""
+        with self._lock:
+            self.token = token_address.lower()
+            for address, amount in balances.items():
+                self.mint(address, amount)
+
+    def mint(self, address: str, amount: float):
+        with self._lock:
+            address = address.lower()
+            self.state.balances[address] = self.state.balances.get(address, 0) + int(amount * 10 ** SIM_DECIMALS)
+
+    def start(self):
+        with self._lock:
+            if self.block_time > 0 and self._producer is None:
+                self._producer = threading.Thread(target=self._produce, name="sim-chain", daemon=True)
+                self._producer.start()
+
+    def _produce(self):
+        while True:
+            time.sleep(self.block_time)
+            self.mine()
+
+    # --- 区块 ---
+    @property
+    def head(self) -> int:
+        return len(self.blocks) - 1
+
+    def _append_block(self, txs: List[dict], receipts: List[dict]):
+        number = len(self.blocks)
+        parent = self.blocks[-1]["hash"] if self.blocks else bytes(32)
+        block_hash = bytes(Web3.keccak(parent + number.to_bytes(8, "big") + self._salt.to_bytes(8, "big")))
+        for receipt in receipts:
+            receipt["blockHash"], receipt["blockNumber"] = block_hash, number
+            for log in receipt["logs"]:
+                log["blockHash"], log["blockNumber"] = block_hash, number
+            self._tx_blocks[receipt["transactionHash"]] = number
+        self.blocks.append({
+            "number": number,
+            "hash": block_hash,
+            "parentHash": parent,
+            "timestamp": int(time.time()),
+            "transactions": txs,
+            "receipts": receipts,
+            "gasUsed": sum(r["gasUsed"] for r in receipts),
+        })
+
+    def mine(self, blocks: int = 1):
+        for _ in range(blocks):
+            with self._lock:
+                self._mine_block()
+                if SIM_REORG_RATE and self.random.random() < SIM_REORG_RATE:
+                    self.reorg(self.random.randint(1, max(SIM_REORG_DEPTH, 1)))
+
+    def _mine_block(self):
+        number = len(self.blocks)
+        self._snapshots[number] = self.state.copy()
+        for old in [n for n in self._snapshots if n <= number - max(SIM_REORG_DEPTH, SIM_STATE_HISTORY, 1)]:
+            del self._snapshots[old]
+
+        txs, receipts, gas_used = [], [], 0
+        progress = True
+        while progress:
+            progress = False
+            for key, tx in list(self.mempool.items()):
+                if tx["nonce"] != self.state.nonces.get(tx["from"], 0):
+                    continue
+                if gas_used + tx["gas"] > SIM_BLOCK_GAS_LIMIT:
+                    continue
+                del self.mempool[key]
+                receipt = self._apply(tx, len(txs), gas_used)
+                txs.append(tx)
+                receipts.append(receipt)
+                gas_used = receipt["cumulativeGasUsed"]
+                progress = True
+        # nonce已被其他交易使用的mempool交易永远无法打包
+        for key in [k for k, tx in self.mempool.items() if tx["nonce"] < self.state.nonces.get(tx["from"], 0)]:
+            del self.mempool[key]
+        self._append_block(txs, receipts)
+
+    def reorg(self, depth: int):
+        """丢弃最近 depth 个区块, 其中的交易回到mempool, 再出同样数量的新区块 (哈希不同)。"""
+        with self._lock:
+            depth = min(depth, len(self._snapshots), self.head)
+            if depth <= 0:
+                return
+            orphaned = self.blocks[-depth:]
+            del self.blocks[-depth:]
+            self.state = self._snapshots[orphaned[0]["number"]]
+            for block in orphaned:
+                self._snapshots.pop(block["number"], None)
+                for receipt in block["receipts"]:
+                    self._tx_blocks.pop(receipt["transactionHash"], None)
+            requeued = {(tx["from"], tx["nonce"]): tx for block in orphaned for tx in block["transactions"]}
+            self.mempool = {**requeued, **{k: v for k, v in self.mempool.items() if k not in requeued}}
+            self._salt += 1
+            self.stats["reorgs"] += 1
+            for _ in range(depth):
+                self._mine_block()
+
+    # --- 合约执行 ---
+    def _move(self, state: State, source: str, target: str, amount: int, logs: List[tuple]) -> int:
+        if state.balances.get(source, 0) < amount:
+            raise Revert("ERC20: transfer amount exceeds balance")
+        new_holder = state.balances.get(target, 0) == 0
+        state.balances[source] = state.balances.get(source, 0) - amount
+        state.balances[target] = state.balances.get(target, 0) + amount
+        logs.append((self.token, [TRANSFER_TOPIC, _word(source), _word(target)], amount.to_bytes(32, "big")))
+        return GAS_TRANSFER + (GAS_NEW_HOLDER if new_holder and amount else 0)
+
+    def _spend_allowance(self, state: State, owner: str, spender: str, amount: int):
+        allowance = state.allowances.get((owner, spender), 0)
+        if allowance < amount:
+            raise Revert("ERC20: insufficient allowance")
+        if allowance != 2 ** 256 - 1:
+            state.allowances[(owner, spender)] = allowance - amount
+
+    def _execute(self, state: State, sender: str, to: str, data: bytes, logs: List[tuple]) -> Tuple[int, bytes]:
+        """执行一次调用, 返回 (gas消耗, 返回值); 失败时抛出Revert, 调用方负责丢弃state。"""
+        if not data:
+            return 0, b"" # 普通转账 (例如用于占用nonce的取消交易), 不模拟ETH余额
+        selector, args = data[:4], data[4:]
+        ok = encode(["bool"], [True])
+        if to == self.token:
+            if selector == TRANSFER:
+                target, amount = decode(["address", "uint256"], args)
+                return self._move(state, sender, target.lower(), amount, logs), ok
+            if selector == TRANSFER_FROM:
+                owner, target, amount = decode(["address", "address", "uint256"], args)
+                self._spend_allowance(state, owner.lower(), sender, amount)
+                return GAS_APPROVE + self._move(state, owner.lower(), target.lower(), amount, logs), ok
+            if selector == APPROVE:
+                spender, amount = decode(["address", "uint256"], args)
+                state.allowances[(sender, spender.lower())] = amount
+                logs.append((self.token, [APPROVAL_TOPIC, _word(sender), _word(spender.lower())], amount.to_bytes(32, "big")))
+                return GAS_APPROVE, ok
+            return 0, self._view(state, to, data)
+        if selector == DISPERSE_TOKEN:
+            token, recipients, values = decode(["address", "address[]", "uint256[]"], args)
+            if token.lower() != self.token or len(recipients) != len(values):
+                raise Revert("disperseToken: invalid arguments")
+            gas = GAS_CALL_OVERHEAD
+            for recipient, value in zip(recipients, values):
+                self._spend_allowance(state, sender, to, value)
+                gas += GAS_APPROVE + self._move(state, sender, recipient.lower(), value, logs)
+            return gas, b""
+        return 0, self._view(state, to, data)
+
+    def _view(self, state: State, to: str, data: bytes) -> bytes:
+        selector, args = data[:4], data[4:]
+        if to == self.token:
+            if selector == BALANCE_OF:
+                (owner,) = decode(["address"], args)
+                return encode(["uint256"], [state.balances.get(owner.lower(), 0)])
+            if selector == ALLOWANCE:
+                owner, spender = decode(["address", "address"], args)
+                return encode(["uint256"], [state.allowances.get((owner.lower(), spender.lower()), 0)])
+            if selector == DECIMALS:
+                return encode(["uint8"], [SIM_DECIMALS])
+        if selector == AGGREGATE3:
+            (calls,) = decode(["(address,bool,bytes)[]"], args)
+            results = []
+            for target, allow_failure, call_data in calls:
+                try:
+                    results.append((True, self._view(state, target.lower(), call_data)))
+                except Revert:
+                    if not allow_failure:
+                        raise
+                    results.append((False, b""))
+            return encode(["(bool,bytes)[]"], [results])
+        raise Revert(f"no simulated contract at {to}")
+
+    def _apply(self, tx: dict, index: int, cumulative_gas: int) -> dict:
+        state, logs = self.state.copy(), []
+        gas_used, status = _intrinsic_gas(tx["data"]), 1
+        try:
+            if SIM_REVERT_RATE and self.random.random() < SIM_REVERT_RATE:
+                raise Revert("simulated revert")
+            gas_used += self._execute(state, tx["from"], tx["to"], tx["data"], logs)[0]
+            if gas_used > tx["gas"]:
+                raise Revert("out of gas")
+        except Revert:
+            state, logs, status = self.state.copy(), [], 0
+            gas_used = min(tx["gas"], max(gas_used, _intrinsic_gas(tx["data"])))
+        # revert的交易同样消耗nonce
+        state.nonces[tx["from"]] = tx["nonce"] + 1
+        self.state = state
+        self.stats["mined"] += 1
+        self.stats["reverted"] += status == 0
+        return {
+            "transactionHash": tx["hash"],
+            "transactionIndex": index,
+            "from": tx["from"],
+            "to": tx["to"],
+            "status": status,
+            "gasUsed": gas_used,
+            "cumulativeGasUsed": cumulative_gas + gas_used,
+            "effectiveGasPrice": min(tx["maxFeePerGas"], SIM_BASE_FEE + tx["maxPriorityFeePerGas"]),
+            "type": tx["type"],
+            "logs": [
+                {"address": address, "topics": topics, "data": data, "transactionHash": tx["hash"],
+                 "transactionIndex": index, "logIndex": None, "removed": False}
+                for address, topics, data in logs
+            ],
+        }
+
+    # --- 交易池 ---
+    def _decode_raw(self, raw: bytes) -> dict:
+        fields = decode_raw_transaction(raw)
+        if raw[0] <= 0x7f:
+            chain_id = fields["chainId"]
+            max_fee = fields.get("maxFeePerGas", fields.get("gasPrice"))
+            priority_fee = fields.get("maxPriorityFeePerGas", max_fee)
+            tx_type = raw[0]
+        else:
+            chain_id = (fields["v"] - 35) // 2 if fields["v"] >= 35 else None
+            max_fee = priority_fee = fields["gasPrice"]
+            tx_type = 0
+        if chain_id is not None and chain_id != SIM_CHAIN_ID:
+            raise RPCError(f"invalid chain id {chain_id}")
+        return {
+            "hash": bytes(Web3.keccak(raw)),
+            "from": Account.recover_transaction(raw).lower(),
+            "to": "0x" + bytes(fields["to"]).hex() if fields["to"] else None,
+            "nonce": fields["nonce"],
+            "gas": fields["gas"],
+            "data": bytes(fields["data"]),
+            "maxFeePerGas": max_fee,
+            "maxPriorityFeePerGas": priority_fee,
+            "type": tx_type,
+        }
+
+    def send_raw_transaction(self, raw: bytes) -> bytes:
+        tx = self._decode_raw(raw)
+        with self._lock:
+            key = (tx["from"], tx["nonce"])
+            existing = self.mempool.get(key)
+            if tx["hash"] in self._tx_blocks or (existing and existing["hash"] == tx["hash"]):
+                raise RPCError("already known")
+            if tx["nonce"] < self.state.nonces.get(tx["from"], 0):
+                raise RPCError("nonce too low")
+            if tx["gas"] < _intrinsic_gas(tx["data"]):
+                raise RPCError("intrinsic gas too low")
+            if tx["gas"] > SIM_BLOCK_GAS_LIMIT:
+                raise RPCError("exceeds block gas limit")
+            if existing and (tx["maxPriorityFeePerGas"] * 10 < existing["maxPriorityFeePerGas"] * 11
+                             or tx["maxFeePerGas"] * 10 < existing["maxFeePerGas"] * 11):
+                raise RPCError("replacement transaction underpriced")
+            if not existing and len(self.mempool) >= SIM_MEMPOOL_SIZE:
+                raise RPCError("txpool is full")
+            if SIM_DROP_RATE and self.random.random() < SIM_DROP_RATE:
+                # 节点接受了交易但没有传播出去: 返回哈希, 但交易永远不会上链
+                self.stats["dropped"] += 1
+            else:
+                self.mempool[key] = tx
+        if self.block_time <= 0:
+            self.mine()
+        return tx["hash"]
+
+    def pending_nonce(self, address: str) -> int:
+        with self._lock:
+            nonce = self.state.nonces.get(address, 0)
+            while (address, nonce) in self.mempool:
+                nonce += 1
+            return nonce
+
+    # --- JSON-RPC ---
+    def _block_number(self, tag) -> int:
+        if tag in (None, "latest", "pending", "safe", "finalized"):
+            return self.head
+        if tag == "earliest":
+            return 0
+        return int(tag, 16) if isinstance(tag, str) else int(tag)
+
+    def _state_at(self, tag) -> State:
+        # 区块n执行后的状态 = 区块n+1执行前的快照; 更早的历史状态不保留, 用最新状态近似
+        number = self._block_number(tag)
+        return self._snapshots.get(number + 1, self.state)
+
+    def _format_block(self, block: dict, full: bool) -> dict:
+        return {
+            "number": _hex(block["number"]),
+            "hash": _hex(block["hash"]),
+            "parentHash": _hex(block["parentHash"]),
+            "timestamp": _hex(block["timestamp"]),
+            "gasLimit": _hex(SIM_BLOCK_GAS_LIMIT),
+            "gasUsed": _hex(block["gasUsed"]),
+            "baseFeePerGas": _hex(SIM_BASE_FEE),
+            "miner": "0x" + "00" * 20,
+            "transactions": [self._format_tx(tx, block) if full else _hex(tx["hash"]) for tx in block["transactions"]],
+        }
+
+    def _format_tx(self, tx: dict, block: Optional[dict]) -> dict:
+        return {
+            "hash": _hex(tx["hash"]),
+            "from": tx["from"],
+            "to": tx["to"],
+            "nonce": _hex(tx["nonce"]),
+            "gas": _hex(tx["gas"]),
+            "input": _hex(tx["data"]),
+            "value": "0x0",
+            "maxFeePerGas": _hex(tx["maxFeePerGas"]),
+            "maxPriorityFeePerGas": _hex(tx["maxPriorityFeePerGas"]),
+            "type": _hex(tx["type"]),
+            "blockNumber": _hex(block["number"]) if block else None,
+            "blockHash": _hex(block["hash"]) if block else None,
+        }
+
+    def _format_log(self, log: dict, log_index: int) -> dict:
+        return {
+            "address": log["address"],
+            "topics": [_hex(t) for t in log["topics"]],
+            "data": _hex(log["data"]),
+            "blockNumber": _hex(log["blockNumber"]),
+            "blockHash": _hex(log["blockHash"]),
+            "transactionHash": _hex(log["transactionHash"]),
+            "transactionIndex": _hex(log["transactionIndex"]),
+            "logIndex": _hex(log_index),
+            "removed": False,
+        }
+
+    def _format_receipt(self, receipt: dict) -> dict:
+        logs, offset = [], 0
+        block = self.blocks[receipt["blockNumber"]]
+        for previous in block["receipts"][:receipt["transactionIndex"]]:
+            offset += len(previous["logs"])
+        logs = [self._format_log(log, offset + i) for i, log in enumerate(receipt["logs"])]
+        return {
+            "transactionHash": _hex(receipt["transactionHash"]),
+            "transactionIndex": _hex(receipt["transactionIndex"]),
+            "blockHash": _hex(receipt["blockHash"]),
+            "blockNumber": _hex(receipt["blockNumber"]),
+            "from": receipt["from"],
+            "to": receipt["to"],
+            "status": _hex(receipt["status"]),
+            "gasUsed": _hex(receipt["gasUsed"]),
+            "cumulativeGasUsed": _hex(receipt["cumulativeGasUsed"]),
+            "effectiveGasPrice": _hex(receipt["effectiveGasPrice"]),
+            "type": _hex(receipt["type"]),
+            "contractAddress": None,
+            "logs": logs,
+            "logsBloom": "0x" + "00" * 256,
+        }
+
+    def _get_logs(self, criteria: dict) -> List[dict]:
+        from_block = self._block_number(criteria.get("fromBlock", "latest"))
+        to_block = self._block_number(criteria.get("toBlock", "latest"))
+        if to_block - from_block + 1 > SIM_MAX_LOG_RANGE:
+            raise RPCError(f"block range too large, max {SIM_MAX_LOG_RANGE} blocks")
+        addresses = criteria.get("address")
+        if isinstance(addresses, str):
+            addresses = [addresses]
+        addresses = {a.lower() for a in addresses} if addresses else None
+        topics = [
+            None if t is None else {x.lower() for x in ([t] if isinstance(t, str) else t)}
+            for t in criteria.get("topics") or []
+        ]
+        results = []
+        for block in self.blocks[max(from_block, 0):to_block + 1]:
+            log_index = 0
+            for receipt in block["receipts"]:
+                for log in receipt["logs"]:
+                    formatted = self._format_log(log, log_index)
+                    log_index += 1
+                    if addresses is not None and log["address"] not in addresses:
+                        continue
+                    if len(topics) > len(log["topics"]) or any(
+                        wanted is not None and formatted["topics"][i] not in wanted for i, wanted in enumerate(topics)
+                    ):
+                        continue
+                    results.append(formatted)
+        return results
+
+    def _call_params(self, call: dict) -> Tuple[str, str, bytes]:
+        sender = (call.get("from") or "0x" + "00" * 20).lower()
+        data = call.get("data") or call.get("input") or "0x"
+        return sender, (call.get("to") or "").lower(), bytes.fromhex(data[2:])
+
+    def handle(self, method: str, params: list):
+        """处理一个JSON-RPC调用, 返回result; 节点错误抛出RPCError。"""
+        with self._lock:
+            if method in ("eth_chainId", "net_version"):
+                return _hex(SIM_CHAIN_ID) if method == "eth_chainId" else str(SIM_CHAIN_ID)
+            if method == "web3_clientVersion":
+                return "SimulatedChain/v1"
+            if method == "eth_blockNumber":
+                return _hex(self.head)
+            if method == "eth_gasPrice":
+                return _hex(SIM_BASE_FEE + SIM_PRIORITY_FEE)
+            if method == "eth_maxPriorityFeePerGas":
+                return _hex(SIM_PRIORITY_FEE)
+            if method == "eth_getBalance":
+                return _hex(10 ** 18) # gas费不计入模拟, 所有地址都有足够的ETH
+            if method == "eth_getCode":
+                return "0x01" if params[0].lower() == self.token else "0x"
+            if method == "eth_getTransactionCount":
+                address = params[0].lower()
+                if params[1] == "pending":
+                    return _hex(self.pending_nonce(address))
+                return _hex(self._state_at(params[1]).nonces.get(address, 0))
+            if method == "eth_getBlockByNumber":
+                number = self._block_number(params[0])
+                return self._format_block(self.blocks[number], params[1]) if 0 <= number <= self.head else None
+            if method == "eth_getBlockByHash":
+                block = next((b for b in self.blocks if _hex(b["hash"]) == params[0].lower()), None)
+                return self._format_block(block, params[1]) if block else None
+            if method == "eth_getTransactionReceipt":
+                number = self._tx_blocks.get(bytes.fromhex(params[0][2:]))
+                if number is None:
+                    return None
+                block = self.blocks[number]
+                return self._format_receipt(next(r for r in block["receipts"] if _hex(r["transactionHash"]) == params[0].lower()))
+            if method == "eth_getTransactionByHash":
+                tx_hash = bytes.fromhex(params[0][2:])
+                number = self._tx_blocks.get(tx_hash)
+                if number is not None:
+                    block = self.blocks[number]
+                    return self._format_tx(next(tx for tx in block["transactions"] if tx["hash"] == tx_hash), block)
+                tx = next((tx for tx in self.mempool.values() if tx["hash"] == tx_hash), None)
+                return self._format_tx(tx, None) if tx else None
+            if method == "eth_getLogs":
+                return self._get_logs(params[0])
+            if method in ("eth_call", "eth_estimateGas"):
+                sender, to, data = self._call_params(params[0])
+                state = self._state_at(params[1] if len(params) > 1 else "latest").copy()
+                try:
+                    gas, result = self._execute(state, sender, to, data, [])
+                except Revert as e:
+                    raise RPCError(f"execution reverted: {e}", code=3)
+                return _hex(_intrinsic_gas(data) + gas) if method == "eth_estimateGas" else _hex(result)
+        if method == "eth_sendRawTransaction":
+            return _hex(self.send_raw_transaction(bytes.fromhex(params[0][2:])))
+        raise RPCError(f"the method {method} does not exist/is not available", code=-32601)
+
+    def _respond(self, request: dict) -> dict:
+        response = {"jsonrpc": "2.0", "id": request.get("id")}
+        try:
+            response["result"] = self.handle(request["method"], request.get("params") or [])
+        except RPCError as e:
+            response["error"] = {"code": e.code, "message": str(e)}
+        except (ValueError, TypeError, KeyError, IndexError) as e:
+            response["error"] = {"code": -32602, "message": f"invalid params: {e}"}
+        return response
+
+    def serve(self, payload: bytes) -> bytes:
+        """处理一个HTTP请求体 (单个或批量JSON-RPC请求), 返回响应体。"""
+        self.start()
+        if SIM_LATENCY:
+            time.sleep(SIM_LATENCY)
+        if SIM_RPC_ERROR_RATE and self.random.random() < SIM_RPC_ERROR_RATE:
+            self.stats["rpc_errors"] += 1
+            raise requests.ConnectionError("simulated connection failure")
+        request = json.loads(payload)
+        if isinstance(request, list):
+            response = json.dumps([self._respond(r) for r in request]).encode("utf-8")
+        else:
+            response = json.dumps(self._respond(request)).encode("utf-8")
+        if SIM_RPC_LOST_RATE and self.random.random() < SIM_RPC_LOST_RATE:
+            self.stats["rpc_lost"] += 1
+            raise requests.ConnectionError("simulated connection reset after the request was processed")
+        return response
+
+chain = SimulatedChain()
+
+class SimulatedEndpoint(Endpoint):
+    """sim:// 端点: 请求不经过网络, 直接交给进程内的模拟链处理。"""
+    def post(self, payload: bytes) -> bytes:
+        return chain.serve(payload)
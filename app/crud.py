@@ -1,46 +1,219 @@
-from typing import Optional
-from sqlalchemy.orm import Session
-from sqlalchemy import or_
-from datetime import datetime
+import base64
+import json
+from typing import List, Optional
+from sqlalchemy.engine import Connection
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, insert, update, delete, bindparam, func, or_, tuple_
+from sqlalchemy.orm import selectinload
+from datetime import datetime, timedelta
 from uuid import uuid4
 
-from . import models, database
+from . import models, database, auth, cache, events, fees
 
 # --- Agent CRUD ---
-def get_agent(db: Session, agent_id: str):
-    return db.query(database.AgentDB).filter(database.AgentDB.id == agent_id).first()
+async def get_agent(db: AsyncSession, agent_id: str):
+    result = await db.execute(select(database.AgentDB).filter(database.AgentDB.id == agent_id))
+    return result.scalars().first()
 
-def get_agent_by_name(db: Session, name: str):
-    return db.query(database.AgentDB).filter(database.AgentDB.name == name).first()
+async def get_agent_by_name(db: AsyncSession, name: str):
+    result = await db.execute(select(database.AgentDB).filter(database.AgentDB.name == name))
+    return result.scalars().first()
 
-def get_agent_by_api_key(db: Session, api_key: str):
-    return db.query(database.AgentDB).filter(database.AgentDB.api_key == api_key).first()
+async def get_agent_by_api_key(db: AsyncSession, api_key: str):
+    return await get_agent_by_api_key_hash(db, auth.hash_api_key(api_key))
 
-def create_agent(db: Session, agent: models.AgentCreate, api_key: str, wallet_address: str, referral_code: str):
+def agent_by_api_key_hash_query(api_key_hash: str):
+    return select(database.AgentDB).filter(database.AgentDB.api_key_hash == api_key_hash)
+
+async def get_agent_by_api_key_hash(db: AsyncSession, api_key_hash: str):
+    result = await db.execute(agent_by_api_key_hash_query(api_key_hash))
+    return result.scalars().first()
+
+async def get_agents_by_ids(db: AsyncSession, agent_ids: List[str]):
+    result = await db.execute(select(database.AgentDB).filter(database.AgentDB.id.in_(agent_ids)))
+    return result.scalars().all()
+
+async def create_agent(db: AsyncSession, agent: models.AgentCreate, api_key: str, wallet_address: str, referral_code: str):
     db_agent = database.AgentDB(
         id=str(uuid4()), # 生成唯一Agent ID
         name=agent.name,
-        api_key=api_key,
+        api_key_hash=auth.hash_api_key(api_key), # 只保存哈希
         wallet_address=wallet_address,
         referral_code=referral_code,
         created_at=datetime.utcnow()
     )
     db.add(db_agent)
-    db.commit()
-    db.refresh(db_agent)
+    await db.commit()
+    await db.refresh(db_agent)
+    return db_agent
+
+async def update_agent_api_key(db: AsyncSession, agent_id: str, api_key: str):
+    db_agent = await get_agent(db, agent_id)
+    if db_agent:
+        db_agent.api_key_hash = auth.hash_api_key(api_key)
+        await db.commit()
+        await db.refresh(db_agent)
     return db_agent
 
 # --- Task CRUD ---
-def get_task(db: Session, task_id: str):
-    return db.query(database.TaskDB).filter(database.TaskDB.id == task_id).first()
+# *_query 函数只构造查询, 供这里的CRUD函数和 migrations.hot_queries (执行计划检查) 共用
+def task_query(task_id: str):
+    return select(database.TaskDB).filter(database.TaskDB.id == task_id)
+
+async def get_task(db: AsyncSession, task_id: str):
+    # 异步会话不支持懒加载, 预先加载审核支付需要的claimer;
+    # populate_existing: 同一会话中批量UPDATE之后再读取时返回最新值
+    result = await db.execute(
+        task_query(task_id)
+        .options(selectinload(database.TaskDB.claimer))
+        .execution_options(populate_existing=True)
+    )
+    return result.scalars().first()
+
+async def get_tasks_by_ids(db: AsyncSession, task_ids: List[str]):
+    result = await db.execute(
+        select(database.TaskDB)
+        .options(selectinload(database.TaskDB.claimer))
+        .filter(database.TaskDB.id.in_(task_ids))
+    )
+    return result.scalars().all()
+
+async def get_task_version(db: AsyncSession, task_id: str) -> Optional[int]:
+    # 只读版本号 (主键查找), 条件GET命中时不加载整行
+    result = await db.execute(select(database.TaskDB.version).filter(database.TaskDB.id == task_id))
+    return result.scalars().first()
+
+async def get_task_versions(db: AsyncSession, task_ids: List[str]) -> dict:
+    result = await db.execute(
+        select(database.TaskDB.id, database.TaskDB.version).filter(database.TaskDB.id.in_(task_ids))
+    )
+    return dict(result.all())
+
+def task_board_version_query():
+    return select(func.max(database.TaskDB.version))
+
+async def get_task_board_version(db: AsyncSession) -> int:
+    """任务板的版本: 任何任务的创建或修改都会使其增大 (ix_tasks_version 上的max查询只读一个索引项)。"""
+    result = await db.execute(task_board_version_query())
+    return result.scalar() or 0
+
+async def next_task_version(db: AsyncSession) -> int:
+    """在当前写事务中取下一个任务版本号。
+
+    计数器行在事务提交前一直被锁住, 所以版本号的顺序与提交顺序一致, 读者不会先看到较大的版本、
+    之后又出现较小的版本 (否则基于 max(version) 的ETag可能漏掉变更)。
+    """
+    stmt = (
+        update(database.CounterDB)
+        .where(database.CounterDB.name == "task_version")
+        .values(value=database.CounterDB.value + 1)
+        .execution_options(synchronize_session=False)
+    )
+    if db.bind.dialect.update_returning:
+        result = await db.execute(stmt.returning(database.CounterDB.value))
+        return result.scalar_one()
+    await db.execute(stmt)
+    result = await db.execute(select(database.CounterDB.value).filter(database.CounterDB.name == "task_version"))
+    return result.scalar_one()
+
+def tasks_query(skip: int = 0, limit: int = 100, status: Optional[str] = None):
+    query = select(database.TaskDB)
+    if status:
+        query = query.filter(database.TaskDB.status == status)
+    return query.offset(skip).limit(limit)
+
+async def get_tasks(db: AsyncSession, skip: int = 0, limit: int = 100, status: Optional[str] = None):
+    result = await db.execute(tasks_query(skip, limit, status))
+    return result.scalars().all()
+
+# --- Keyset (cursor) pagination ---
+# 排序键 -> 列; 每个键都以 id 作为次序打破平局, 并有 (status, key, id) / (key, id) 复合索引支撑
+TASK_SORT_KEYS = {
+    "created_at": database.TaskDB.created_at,
+    "amount": database.TaskDB.amount,
+    "deadline_at": database.TaskDB.deadline_at,
+}
+
+def _encode_cursor(sort: str, order: str, value, task_id: str) -> str:
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    raw = json.dumps({"s": sort, "o": order, "v": value, "id": task_id}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def _decode_cursor(cursor: str, sort: str, order: str):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        value, task_id = data["v"], data["id"]
+        if data["s"] != sort or data["o"] != order:
+            raise ValueError("cursor was issued for a different sort order")
+        if value is not None and sort in ("created_at", "deadline_at"):
+            value = datetime.fromisoformat(value)
+    except (ValueError, KeyError, TypeError) as e:
+        raise ValueError(f"Invalid cursor: {e}")
+    return value, task_id
 
-def get_tasks(db: Session, skip: int = 0, limit: int = 100, status: Optional[str] = None):
-    query = db.query(database.TaskDB)
+def task_page_query(limit: int, status: Optional[str] = None, sort: str = "created_at", order: str = "asc",
+                    after: Optional[tuple] = None, null_segment: bool = False):
+    """keyset分页的一段查询: 非NULL段是 (sort, id) 上的范围扫描, NULL段按id继续。after 为上一页最后一行的 (value, id)。"""
+    column = TASK_SORT_KEYS[sort]
+    task_id_column = database.TaskDB.id
+    descending = order == "desc"
+    query = select(database.TaskDB)
     if status:
         query = query.filter(database.TaskDB.status == status)
-    return query.offset(skip).limit(limit).all()
+    if null_segment:
+        query = query.filter(column.is_(None))
+        if after is not None and after[0] is None:
+            query = query.filter(task_id_column < after[1] if descending else task_id_column > after[1])
+        return query.order_by(task_id_column.desc() if descending else task_id_column.asc()).limit(limit)
+    query = query.filter(column.is_not(None))
+    if after is not None:
+        key = tuple_(column, task_id_column)
+        query = query.filter(key < tuple_(*after) if descending else key > tuple_(*after))
+    if descending:
+        return query.order_by(column.desc(), task_id_column.desc()).limit(limit)
+    return query.order_by(column.asc(), task_id_column.asc()).limit(limit)
 
-def create_task(db: Session, task: models.TaskCreate, poster_id: str):
+async def get_tasks_page(db: AsyncSession, limit: int = 100, status: Optional[str] = None, cursor: Optional[str] = None,
+                         sort: str = "created_at", order: str = "asc"):
+    """按 (sort, id) 做keyset分页, 返回 (tasks, next_cursor)。
+
+    每一页都是索引上的一次范围扫描, 代价与页深度无关; 新插入/被认领的任务不会让后续页错位。
+    排序键为NULL的任务 (例如没有deadline) 排在最后, 按id分页。
+    """
+    if sort not in TASK_SORT_KEYS:
+        raise ValueError(f"Unsupported sort key '{sort}'")
+    if order not in ("asc", "desc"):
+        raise ValueError(f"Unsupported order '{order}'")
+    if limit < 1:
+        raise ValueError("limit must be at least 1")
+    after = _decode_cursor(cursor, sort, order) if cursor else None
+
+    tasks = []
+    # 非NULL段
+    if after is None or after[0] is not None:
+        result = await db.execute(task_page_query(limit + 1, status, sort, order, after))
+        tasks.extend(result.scalars().all())
+
+    # NULL段: 非NULL段取完后按id继续
+    if len(tasks) <= limit:
+        result = await db.execute(task_page_query(limit + 1 - len(tasks), status, sort, order, after, null_segment=True))
+        tasks.extend(result.scalars().all())
+
+    next_cursor = None
+    if tasks and len(tasks) > limit:
+        tasks = tasks[:limit]
+        last = tasks[-1]
+        next_cursor = _encode_cursor(sort, order, getattr(last, sort), last.id)
+    return tasks, next_cursor
+
+def _tasks_committed(tasks, status: Optional[str] = None):
+    # 任务写入提交之后调用: 失效列表缓存并推送事件 (提交之前失效, 并发的读请求可能把旧数据重新填入缓存)
+    cache.task_list_cache.invalidate()
+    events.publish_tasks(tasks, status)
+
+async def create_task(db: AsyncSession, task: models.TaskCreate, poster_id: str):
     db_task = database.TaskDB(
         id=str(uuid4()),
         title=task.title,
@@ -49,17 +222,47 @@ def create_task(db: Session, task: models.TaskCreate, poster_id: str):
         status="open",
         created_at=datetime.utcnow(),
         deadline_at=task.deadline_at,
-        poster_id=poster_id
+        poster_id=poster_id,
+        version=await next_task_version(db),
     )
     db.add(db_task)
-    db.commit()
-    db.refresh(db_task)
+    await enqueue_task_webhooks(db, [db_task])
+    await db.commit()
+    await db.refresh(db_task)
+    _tasks_committed([db_task])
     return db_task
 
-def update_task_status(db: Session, task_id: str, new_status: str, claimer_id: Optional[str] = None):
-    db_task = get_task(db, task_id)
+async def create_tasks_bulk(db: AsyncSession, tasks: List[models.TaskCreate], poster_id: str) -> List[str]:
+    # 一次executemany插入、一次提交; 不逐行refresh
+    if not tasks:
+        return []
+    now = datetime.utcnow()
+    version = await next_task_version(db) # 同一批次共用一个版本号
+    rows = [
+        {
+            "id": str(uuid4()),
+            "title": task.title,
+            "description": task.description,
+            "amount": task.amount,
+            "status": "open",
+            "created_at": now,
+            "deadline_at": task.deadline_at,
+            "poster_id": poster_id,
+            "version": version,
+        }
+        for task in tasks
+    ]
+    await db.execute(insert(database.TaskDB), rows)
+    await enqueue_task_webhooks(db, rows)
+    await db.commit()
+    _tasks_committed(rows)
+    return [row["id"] for row in rows]
+
+async def update_task_status(db: AsyncSession, task_id: str, new_status: str, claimer_id: Optional[str] = None):
+    db_task = await get_task(db, task_id)
     if db_task:
         db_task.status = new_status
+        db_task.version = await next_task_version(db)
         if new_status == "claimed" and claimer_id:
             db_task.claimer_id = claimer_id
         elif new_status == "submitted":
@@ -68,21 +271,174 @@ def update_task_status(db: Session, task_id: str, new_status: str, claimer_id: O
             db_task.approved_at = datetime.utcnow()
         elif new_status == "rejected":
             db_task.rejected_at = datetime.utcnow()
-        db.commit()
-        db.refresh(db_task)
+        await enqueue_task_webhooks(db, [db_task])
+        await db.commit()
+        await db.refresh(db_task)
+        _tasks_committed([db_task])
     return db_task
 
-def submit_task_work(db: Session, task_id: str, submission_content: str):
-    db_task = get_task(db, task_id)
+async def claim_task(db: AsyncSession, task_id: str, claimer_id: str):
+    """原子认领: 一条带条件的UPDATE (compare-and-swap), 受影响行数决定谁赢得竞争。
+
+    成功返回认领后的任务; 任务不存在、不是open或已被认领时返回None (此时不做任何修改)。
+    """
+    stmt = (
+        update(database.TaskDB)
+        .where(
+            database.TaskDB.id == task_id,
+            database.TaskDB.status == "open",
+            database.TaskDB.claimer_id.is_(None),
+        )
+        .values(status="claimed", claimer_id=claimer_id)
+        .execution_options(synchronize_session=False)
+    )
+    if db.bind.dialect.update_returning:
+        # UPDATE ... RETURNING: 一次往返同时完成判定和读取
+        result = await db.execute(stmt.returning(database.TaskDB), execution_options={"populate_existing": True})
+        return await _claimed(db, result.scalars().first())
+
+    result = await db.execute(stmt)
+    if result.rowcount != 1:
+        await db.rollback()
+        return None
+    return await _claimed(db, await get_task(db, task_id))
+
+async def _claimed(db: AsyncSession, db_task):
+    # 条件UPDATE命中之后才取版本号: 竞争失败的认领者不会去锁全局版本计数器
+    if db_task is None:
+        await db.rollback()
+        return None
+    db_task.version = await next_task_version(db)
+    await enqueue_task_webhooks(db, [db_task])
+    await db.commit()
+    _tasks_committed([db_task])
+    return db_task
+
+def open_poster_ids_query():
+    return select(database.TaskDB.poster_id).filter(database.TaskDB.status == "open").distinct()
+
+async def get_open_poster_ids(db: AsyncSession):
+    result = await db.execute(open_poster_ids_query())
+    return result.scalars().all()
+
+def claim_candidate_query(claimer_id: str, poster_id: Optional[str] = None, min_amount: Optional[float] = None,
+                          deadline_after: Optional[datetime] = None):
+    candidate = (
+        select(database.TaskDB.id)
+        .filter(
+            database.TaskDB.status == "open",
+            database.TaskDB.claimer_id.is_(None),
+            database.TaskDB.poster_id != claimer_id, # 不派发自己发布的任务
+            or_(database.TaskDB.deadline_at.is_(None), database.TaskDB.deadline_at > (deadline_after or datetime.utcnow())),
+        )
+        .order_by(database.TaskDB.amount.desc(), database.TaskDB.created_at.asc())
+        .limit(1)
+    )
+    if poster_id:
+        candidate = candidate.filter(database.TaskDB.poster_id == poster_id)
+    if min_amount is not None:
+        candidate = candidate.filter(database.TaskDB.amount >= min_amount)
+    return candidate
+
+async def claim_next_task(db: AsyncSession, claimer_id: str, poster_id: Optional[str] = None,
+                          min_amount: Optional[float] = None, deadline_after: Optional[datetime] = None):
+    """认领符合条件的最佳open任务 (赏金最高, 其次最早发布), 没有可认领的任务时返回None。
+
+    选择与认领在同一条UPDATE中完成: SQLite的写操作是串行的, 子查询总能看到最新状态;
+    PostgreSQL上子查询使用 FOR UPDATE SKIP LOCKED, 并发的认领者会各自拿到不同的行。
+    """
+    candidate = claim_candidate_query(claimer_id, poster_id, min_amount, deadline_after)
+    if db.bind.dialect.name == "postgresql":
+        candidate = candidate.with_for_update(skip_locked=True)
+
+    if not db.bind.dialect.update_returning:
+        result = await db.execute(candidate)
+        task_id = result.scalars().first()
+        return await claim_task(db, task_id, claimer_id) if task_id else None
+
+    stmt = (
+        update(database.TaskDB)
+        .where(
+            database.TaskDB.id == candidate.scalar_subquery(),
+            database.TaskDB.status == "open",
+            database.TaskDB.claimer_id.is_(None),
+        )
+        .values(status="claimed", claimer_id=claimer_id)
+        .returning(database.TaskDB)
+        .execution_options(synchronize_session=False)
+    )
+    result = await db.execute(stmt, execution_options={"populate_existing": True})
+    return await _claimed(db, result.scalars().first())
+
+async def submit_task_work(db: AsyncSession, task_id: str, submission_content: str):
+    db_task = await get_task(db, task_id)
     if db_task and db_task.status == "claimed": # 只有被认领的任务才能提交工作
         db_task.submission_content = submission_content
         db_task.status = "submitted"
-        db.commit()
-        db.refresh(db_task)
+        db_task.version = await next_task_version(db)
+        await enqueue_task_webhooks(db, [db_task])
+        await db.commit()
+        await db.refresh(db_task)
+        _tasks_committed([db_task])
     return db_task
 
+async def apply_task_reviews(db: AsyncSession, approved_ids: List[str], rejected_ids: List[str], transactions: List[dict]):
+    """在一个事务中批量写入审核结果和交易记录, 返回实际被更新 (仍处于submitted) 的任务id集合。"""
+    now = datetime.utcnow()
+    updated = set()
+    changed = [] # (新状态, 任务行), 提交后发布事件
+    event_columns = [getattr(database.TaskDB, name) for name in events.TASK_EVENT_FIELDS]
+    for task_ids, values in ((approved_ids, {"status": "approved", "approved_at": now}),
+                             (rejected_ids, {"status": "rejected", "rejected_at": now})):
+        if not task_ids:
+            continue
+        stmt = (
+            update(database.TaskDB)
+            .where(database.TaskDB.id.in_(task_ids), database.TaskDB.status == "submitted")
+            .values(**values)
+            .execution_options(synchronize_session=False)
+        )
+        if db.bind.dialect.update_returning:
+            result = await db.execute(stmt.returning(*event_columns))
+        else:
+            result = await db.execute(
+                select(*event_columns).filter(database.TaskDB.id.in_(task_ids), database.TaskDB.status == "submitted")
+            )
+            await db.execute(stmt)
+        task_rows = result.all()
+        updated.update(row.id for row in task_rows)
+        changed.append((values["status"], task_rows))
+    if updated:
+        # 有任务真正被更新之后才取版本号, 整批审核共用一个
+        await db.execute(
+            update(database.TaskDB)
+            .where(database.TaskDB.id.in_(updated))
+            .values(version=await next_task_version(db))
+            .execution_options(synchronize_session=False)
+        )
+    rows = [
+        {"id": str(uuid4()), "status": "pending", "created_at": now, **transaction}
+        for transaction in transactions if transaction["task_id"] in updated
+    ]
+    if rows:
+        await db.execute(insert(database.TransactionDB), rows)
+        # 手续费只记入账本, 由settlement worker定期归集为一笔转账
+        accruals = [
+            {"task_id": row["task_id"], "transaction_id": row["id"], "amount_micro": fees.to_micro(row["fee_amount"]),
+             "created_at": now}
+            for row in rows if row.get("fee_amount")
+        ]
+        if accruals:
+            await db.execute(insert(database.FeeAccrualDB), accruals)
+    for new_status, task_rows in changed:
+        await enqueue_task_webhooks(db, task_rows, status=new_status)
+    await db.commit()
+    for new_status, task_rows in changed:
+        _tasks_committed(task_rows, status=new_status)
+    return updated
+
 # --- Transaction CRUD (Simplified for initial version) ---
-def create_transaction(db: Session, transaction: models.TransactionCreate, tx_hash: Optional[str] = None):
+async def create_transaction(db: AsyncSession, transaction: models.TransactionCreate, tx_hash: Optional[str] = None):
     db_transaction = database.TransactionDB(
         id=str(uuid4()),
         task_id=transaction.task_id,
@@ -96,16 +452,548 @@ def create_transaction(db: Session, transaction: models.TransactionCreate, tx_ha
         created_at=datetime.utcnow()
     )
     db.add(db_transaction)
-    db.commit()
-    db.refresh(db_transaction)
+    await db.commit()
+    await db.refresh(db_transaction)
     return db_transaction
 
-def update_transaction_status(db: Session, transaction_id: str, new_status: str, tx_hash: Optional[str] = None):
-    db_transaction = db.query(database.TransactionDB).filter(database.TransactionDB.id == transaction_id).first()
+async def update_transaction_status(db: AsyncSession, transaction_id: str, new_status: str, tx_hash: Optional[str] = None,
+                                    error: Optional[str] = None):
+    result = await db.execute(select(database.TransactionDB).filter(database.TransactionDB.id == transaction_id))
+    db_transaction = result.scalars().first()
     if db_transaction:
         db_transaction.status = new_status
         if tx_hash:
             db_transaction.tx_hash = tx_hash
-        db.commit()
-        db.refresh(db_transaction)
+        if error:
+            db_transaction.last_error = error
+        if new_status == "completed":
+            db_transaction.completed_at = datetime.utcnow()
+        db_transaction.locked_until = None # 终态或状态变化后释放worker租约
+        await db.commit()
+        await db.refresh(db_transaction)
     return db_transaction
+
+# --- Payout outbox ---
+async def lease_due_transactions(db: AsyncSession, limit: int, lease_seconds: float):
+    """租用一批到期且尚未广播的pending交易, 租约期内其他worker不会处理这些行。已广播的交易由确认跟踪器处理。"""
+    now = datetime.utcnow()
+    TransactionDB = database.TransactionDB
+    due = (
+        select(TransactionDB.id)
+        .filter(
+            TransactionDB.status == "pending",
+            TransactionDB.tx_hash.is_(None),
+            or_(TransactionDB.next_attempt_at.is_(None), TransactionDB.next_attempt_at <= now),
+            or_(TransactionDB.locked_until.is_(None), TransactionDB.locked_until < now),
+        )
+        .order_by(TransactionDB.created_at)
+        .limit(limit)
+    )
+    if db.bind.dialect.name == "postgresql":
+        due = due.with_for_update(skip_locked=True)
+    result = await db.execute(due)
+    transaction_ids = result.scalars().all()
+    if not transaction_ids:
+        return []
+    # 条件UPDATE再次检查租约, 并发的worker只有一个能拿到同一行
+    stmt = (
+        update(TransactionDB)
+        .where(
+            TransactionDB.id.in_(transaction_ids),
+            or_(TransactionDB.locked_until.is_(None), TransactionDB.locked_until < now),
+        )
+        .values(locked_until=now + timedelta(seconds=lease_seconds))
+        .execution_options(synchronize_session=False)
+    )
+    if db.bind.dialect.update_returning:
+        result = await db.execute(stmt.returning(TransactionDB), execution_options={"populate_existing": True})
+        leased = result.scalars().all()
+        await db.commit()
+        return leased
+    await db.execute(stmt)
+    await db.commit()
+    result = await db.execute(select(TransactionDB).filter(TransactionDB.id.in_(transaction_ids)))
+    return result.scalars().all()
+
+class TransactionLeaseLost(RuntimeError):
+    pass
+
+def assign_signed_transaction(conn: Connection, transaction_ids: List[str], locked_until: datetime,
+                              address: str, nonce: int, kind: str, tx_hash: str, raw_tx: str):
+    """同步版本, 在NonceManager分配nonce的事务中执行: 把签好的交易记录到租用的outbox行上。
+
+    租约已被其他worker接管 (locked_until 变了) 或行已经有nonce时抛出异常, nonce分配随之回滚。
+    提交之后这些行就是 "已提交、状态未知": 之后只会重新广播/替换这笔交易, 不会换nonce重新支付。
+    """
+    table = database.TransactionDB.__table__
+    result = conn.execute(
+        table.update()
+        .where(table.c.id.in_(transaction_ids), table.c.locked_until == locked_until, table.c.nonce.is_(None))
+        .values(nonce=nonce, raw_tx=raw_tx, tx_hash=tx_hash, submitted_at=datetime.utcnow(), broadcast_at=None,
+                last_error=None, block_number=None, block_hash=None, locked_until=None)
+    )
+    if result.rowcount != len(transaction_ids):
+        raise TransactionLeaseLost(f"Lease on transactions {transaction_ids} was lost before signing")
+    conn.execute(database.SignedTransactionDB.__table__.insert().values(
+        tx_hash=tx_hash, address=address, nonce=nonce, kind=kind, raw_tx=raw_tx, created_at=datetime.utcnow()
+    ))
+
+async def get_signed_transactions(db: AsyncSession, address: str, nonces: List[int]):
+    """address在这些nonce上签过的所有交易 (原交易、提价替换、取消), 按nonce分组, 每组按签名时间排序。"""
+    SignedTransactionDB = database.SignedTransactionDB
+    by_nonce = {}
+    if not nonces:
+        return by_nonce
+    result = await db.execute(
+        select(SignedTransactionDB)
+        .filter(SignedTransactionDB.address == address, SignedTransactionDB.nonce.in_(nonces))
+        .order_by(SignedTransactionDB.created_at)
+    )
+    for signed in result.scalars().all():
+        by_nonce.setdefault(signed.nonce, []).append(signed)
+    return by_nonce
+
+async def get_inflight_disperse_micro(db: AsyncSession) -> int:
+    """已提交但还没有上链的Disperse批量支付总额 (micro-USDC): 它们上链时还会消耗授权额度。"""
+    TransactionDB, SignedTransactionDB = database.TransactionDB, database.SignedTransactionDB
+    result = await db.execute(
+        select(TransactionDB.amount)
+        .join(SignedTransactionDB, SignedTransactionDB.tx_hash == TransactionDB.tx_hash)
+        .filter(TransactionDB.status == "pending", TransactionDB.block_hash.is_(None), SignedTransactionDB.kind == "disperse")
+    )
+    return sum(fees.to_micro(amount) for amount in result.scalars().all())
+
+async def has_pending_approval(db: AsyncSession, spender_address: str) -> bool:
+    result = await db.execute(
+        select(database.TransactionDB.id)
+        .filter(database.TransactionDB.kind == "approval", database.TransactionDB.status == "pending",
+                database.TransactionDB.to_address == spender_address)
+        .limit(1)
+    )
+    return result.first() is not None
+
+async def create_approval_transaction(db: AsyncSession, from_address: str, spender_address: str, amount_micro: int):
+    """写入一笔approve的outbox交易, 与赏金走同样的签名/广播/确认流程, 不阻塞等待上链。"""
+    db_transaction = database.TransactionDB(
+        id=str(uuid4()),
+        task_id=None,
+        from_address=from_address,
+        to_address=spender_address,
+        amount=fees.from_micro(amount_micro),
+        fee_amount=0,
+        status="pending",
+        kind="approval",
+        created_at=datetime.utcnow(),
+    )
+    db.add(db_transaction)
+    await db.commit()
+    return db_transaction
+
+async def record_transaction_replacement(db: AsyncSession, transaction_ids: List[str], replaced_tx_hash: str,
+                                         address: str, nonce: int, kind: str, tx_hash: str, raw_tx: str) -> bool:
+    """在同一nonce上签了一笔替换交易: 记录它, 并把outbox行指向它; 行已被其他worker处理过时返回False。"""
+    now = datetime.utcnow()
+    TransactionDB = database.TransactionDB
+    result = await db.execute(
+        update(TransactionDB)
+        .where(TransactionDB.id.in_(transaction_ids), TransactionDB.tx_hash == replaced_tx_hash,
+               TransactionDB.status == "pending")
+        .values(tx_hash=tx_hash, raw_tx=raw_tx, submitted_at=now, broadcast_at=None)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount != len(transaction_ids):
+        await db.rollback()
+        return False
+    db.add(database.SignedTransactionDB(tx_hash=tx_hash, address=address, nonce=nonce, kind=kind, raw_tx=raw_tx, created_at=now))
+    await db.commit()
+    return True
+
+async def record_transaction_broadcast(db: AsyncSession, tx_hashes: List[str], error: Optional[str] = None):
+    # 记录广播时间 (确认跟踪器据此决定何时重新广播) 和广播时节点返回的错误
+    if not tx_hashes:
+        return
+    await db.execute(
+        update(database.TransactionDB)
+        .where(database.TransactionDB.tx_hash.in_(tx_hashes), database.TransactionDB.status == "pending")
+        .values(broadcast_at=datetime.utcnow(), last_error=error)
+        .execution_options(synchronize_session=False)
+    )
+    await db.commit()
+
+async def schedule_transaction_retry(db: AsyncSession, transaction_ids: List[str], error: str, next_attempt_at: datetime):
+    await db.execute(
+        update(database.TransactionDB)
+        .where(database.TransactionDB.id.in_(transaction_ids))
+        .values(
+            attempts=database.TransactionDB.attempts + 1,
+            last_error=error,
+            next_attempt_at=next_attempt_at,
+            locked_until=None,
+            tx_hash=None,
+            platform_fee_tx_hash=None,
+            submitted_at=None,
+            block_number=None,
+            block_hash=None,
+            nonce=None,
+            raw_tx=None,
+            broadcast_at=None,
+        )
+        .execution_options(synchronize_session=False)
+    )
+    await db.commit()
+
+async def release_transactions(db: AsyncSession, transaction_ids: List[str], next_attempt_at: Optional[datetime] = None):
+    await db.execute(
+        update(database.TransactionDB)
+        .where(database.TransactionDB.id.in_(transaction_ids))
+        .values(locked_until=None, next_attempt_at=next_attempt_at)
+        .execution_options(synchronize_session=False)
+    )
+    await db.commit()
+
+async def get_submitted_transactions(db: AsyncSession):
+    """已广播、等待确认的pending交易。"""
+    TransactionDB = database.TransactionDB
+    result = await db.execute(
+        select(TransactionDB).filter(TransactionDB.status == "pending", TransactionDB.tx_hash.is_not(None))
+    )
+    return result.scalars().all()
+
+async def record_transaction_blocks(db: AsyncSession, blocks: List[dict]):
+    """批量记录回执: [{"id", "tx_hash", "raw_tx", "block_number", "block_hash"}], 区块为None表示交易已被重组移出。
+
+    tx_hash/raw_tx是实际上链的那笔交易: 提价替换之后, 上链的可能是同一nonce上更早签的交易。
+    """
+    if not blocks:
+        return
+    table = database.TransactionDB.__table__
+    conn = await db.connection()
+    await conn.execute(
+        table.update()
+        .where(table.c.id == bindparam("b_id"), table.c.status == "pending")
+        .values(tx_hash=bindparam("b_tx_hash"), raw_tx=bindparam("b_raw_tx"),
+                block_number=bindparam("b_block_number"), block_hash=bindparam("b_block_hash")),
+        [{"b_id": b["id"], "b_tx_hash": b["tx_hash"], "b_raw_tx": b["raw_tx"], "b_block_number": b["block_number"],
+          "b_block_hash": b["block_hash"]} for b in blocks],
+    )
+    await db.commit()
+
+async def complete_transactions(db: AsyncSession, transaction_ids: List[str]) -> int:
+    """把达到确认深度的交易一次性标记为completed, 返回更新的行数。"""
+    if not transaction_ids:
+        return 0
+    result = await db.execute(
+        update(database.TransactionDB)
+        .where(database.TransactionDB.id.in_(transaction_ids), database.TransactionDB.status == "pending")
+        .values(status="completed", completed_at=datetime.utcnow(), locked_until=None)
+        .execution_options(synchronize_session=False)
+    )
+    await db.commit()
+    return result.rowcount
+
+# --- Platform fee ledger ---
+def _sweepable_accruals():
+    # 赏金已支付完成、且尚未归集 (或所在归集的转账最终失败) 的手续费
+    FeeAccrualDB, TransactionDB = database.FeeAccrualDB, database.TransactionDB
+    failed_sweeps = (
+        select(database.FeeSweepDB.id)
+        .join(TransactionDB, TransactionDB.id == database.FeeSweepDB.transaction_id)
+        .filter(TransactionDB.status == "failed")
+    )
+    completed_payouts = select(TransactionDB.id).filter(TransactionDB.status == "completed")
+    return (
+        or_(FeeAccrualDB.sweep_id.is_(None), FeeAccrualDB.sweep_id.in_(failed_sweeps)),
+        FeeAccrualDB.transaction_id.in_(completed_payouts),
+    )
+
+async def get_fee_ledger_summary(db: AsyncSession):
+    """返回 (待归集总额micro, 条数, 最早一条的时间)。"""
+    FeeAccrualDB = database.FeeAccrualDB
+    result = await db.execute(
+        select(func.coalesce(func.sum(FeeAccrualDB.amount_micro), 0), func.count(), func.min(FeeAccrualDB.created_at))
+        .filter(*_sweepable_accruals())
+    )
+    return tuple(result.one())
+
+async def open_fee_sweep(db: AsyncSession, from_address: str, to_address: str):
+    """把所有待归集的手续费划入一次新的归集, 并在同一事务中写入对应的outbox交易; 没有可归集的手续费时返回None。"""
+    FeeAccrualDB = database.FeeAccrualDB
+    now = datetime.utcnow()
+    sweep_id, transaction_id = str(uuid4()), str(uuid4())
+    # 先写入归集行, 再用条件UPDATE认领账本行; 并发的worker不会把同一条手续费归集两次
+    db.add(database.FeeSweepDB(id=sweep_id, transaction_id=transaction_id, amount_micro=0, accrual_count=0, created_at=now))
+    await db.flush()
+    await db.execute(
+        update(FeeAccrualDB)
+        .where(*_sweepable_accruals())
+        .values(sweep_id=sweep_id)
+        .execution_options(synchronize_session=False)
+    )
+    result = await db.execute(
+        select(func.coalesce(func.sum(FeeAccrualDB.amount_micro), 0), func.count()).filter(FeeAccrualDB.sweep_id == sweep_id)
+    )
+    amount_micro, accrual_count = result.one()
+    if not accrual_count:
+        await db.rollback()
+        return None
+    await db.execute(
+        update(database.FeeSweepDB)
+        .where(database.FeeSweepDB.id == sweep_id)
+        .values(amount_micro=amount_micro, accrual_count=accrual_count)
+        .execution_options(synchronize_session=False)
+    )
+    db.add(database.TransactionDB(
+        id=transaction_id,
+        task_id=None,
+        from_address=from_address,
+        to_address=to_address,
+        amount=fees.from_micro(amount_micro),
+        fee_amount=0,
+        fee_recipient_address=to_address,
+        status="pending",
+        created_at=now,
+    ))
+    await db.commit()
+    return await get_fee_sweep(db, sweep_id)
+
+async def get_fee_sweep(db: AsyncSession, sweep_id: str):
+    result = await db.execute(
+        select(database.FeeSweepDB)
+        .options(selectinload(database.FeeSweepDB.transaction))
+        .filter(database.FeeSweepDB.id == sweep_id)
+        .execution_options(populate_existing=True)
+    )
+    return result.scalars().first()
+
+async def get_fee_sweep_accruals(db: AsyncSession, sweep_id: str):
+    """对账: 一次归集包含的手续费明细 (task_id, transaction_id, amount_micro)。"""
+    result = await db.execute(
+        select(database.FeeAccrualDB).filter(database.FeeAccrualDB.sweep_id == sweep_id).order_by(database.FeeAccrualDB.id)
+    )
+    return result.scalars().all()
+
+# --- On-chain transfer index ---
+async def get_agent_wallets(db: AsyncSession) -> List[str]:
+    result = await db.execute(select(database.AgentDB.wallet_address).filter(database.AgentDB.wallet_address.is_not(None)))
+    return result.scalars().all()
+
+async def get_indexer_checkpoint(db: AsyncSession, name: str):
+    result = await db.execute(
+        select(database.IndexerCheckpointDB)
+        .filter(database.IndexerCheckpointDB.name == name)
+        .execution_options(populate_existing=True)
+    )
+    return result.scalars().first()
+
+async def save_indexed_transfers(db: AsyncSession, name: str, from_block: int, to_block: int, to_block_hash: str,
+                                 transfers: List[dict]):
+    """在一个事务中写入 [from_block, to_block] 区间的转账并推进检查点; 重复索引同一区间是幂等的。"""
+    UsdcTransferDB = database.UsdcTransferDB
+    await db.execute(
+        delete(UsdcTransferDB)
+        .where(UsdcTransferDB.block_number >= from_block, UsdcTransferDB.block_number <= to_block)
+        .execution_options(synchronize_session=False)
+    )
+    if transfers:
+        await db.execute(insert(UsdcTransferDB), transfers)
+    checkpoint = await get_indexer_checkpoint(db, name)
+    if checkpoint is None:
+        checkpoint = database.IndexerCheckpointDB(name=name)
+        db.add(checkpoint)
+    checkpoint.block_number = to_block
+    checkpoint.block_hash = to_block_hash
+    checkpoint.updated_at = datetime.utcnow()
+    await db.commit()
+
+async def rewind_indexer(db: AsyncSession, name: str, block_number: int, block_hash: str):
+    """链重组: 删除 block_number 之后索引的转账, 检查点回退到 block_number。"""
+    await db.execute(
+        delete(database.UsdcTransferDB)
+        .where(database.UsdcTransferDB.block_number > block_number)
+        .execution_options(synchronize_session=False)
+    )
+    await db.execute(
+        update(database.IndexerCheckpointDB)
+        .where(database.IndexerCheckpointDB.name == name)
+        .values(block_number=block_number, block_hash=block_hash, updated_at=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    )
+    await db.commit()
+
+async def get_transfers_for_address(db: AsyncSession, address: str, limit: int = 50, before_block: Optional[int] = None,
+                                    before_log_index: Optional[int] = None):
+    # from/to 各走一个 (address, block_number, log_index) 索引, 合并后按区块倒序; (block_number, log_index) 做keyset翻页
+    UsdcTransferDB = database.UsdcTransferDB
+    address = address.lower()
+    stmt = select(UsdcTransferDB).filter(or_(UsdcTransferDB.from_address == address, UsdcTransferDB.to_address == address))
+    if before_block is not None and before_log_index is not None:
+        stmt = stmt.filter(tuple_(UsdcTransferDB.block_number, UsdcTransferDB.log_index) < (before_block, before_log_index))
+    elif before_block is not None:
+        stmt = stmt.filter(UsdcTransferDB.block_number < before_block)
+    result = await db.execute(
+        stmt.order_by(UsdcTransferDB.block_number.desc(), UsdcTransferDB.log_index.desc()).limit(limit)
+    )
+    return result.scalars().all()
+
+# --- Webhooks ---
+async def create_webhook(db: AsyncSession, agent_id: str, url: str, secret: str, event_types: Optional[List[str]] = None):
+    db_webhook = database.WebhookDB(
+        id=str(uuid4()),
+        agent_id=agent_id,
+        url=url,
+        secret=secret,
+        event_types=",".join(event_types) if event_types else None,
+        active=True,
+        created_at=datetime.utcnow(),
+    )
+    db.add(db_webhook)
+    await db.commit()
+    cache.webhook_registry.invalidate(agent_id)
+    await db.refresh(db_webhook)
+    return db_webhook
+
+async def get_webhooks(db: AsyncSession, agent_id: str):
+    result = await db.execute(
+        select(database.WebhookDB)
+        .filter(database.WebhookDB.agent_id == agent_id, database.WebhookDB.active.is_(True))
+        .order_by(database.WebhookDB.created_at)
+    )
+    return result.scalars().all()
+
+async def get_webhooks_by_ids(db: AsyncSession, webhook_ids: List[str]):
+    result = await db.execute(select(database.WebhookDB).filter(database.WebhookDB.id.in_(webhook_ids)))
+    return result.scalars().all()
+
+async def deactivate_webhook(db: AsyncSession, webhook_id: str, reason: str, agent_id: Optional[str] = None) -> bool:
+    """停用webhook (保留投递历史), 未投递的事件标记为failed。"""
+    stmt = update(database.WebhookDB).where(database.WebhookDB.id == webhook_id, database.WebhookDB.active.is_(True))
+    if agent_id is not None:
+        stmt = stmt.where(database.WebhookDB.agent_id == agent_id)
+    result = await db.execute(stmt.values(active=False).execution_options(synchronize_session=False))
+    if result.rowcount != 1:
+        await db.commit()
+        return False
+    await db.execute(
+        update(database.WebhookDeliveryDB)
+        .where(database.WebhookDeliveryDB.webhook_id == webhook_id, database.WebhookDeliveryDB.status == "pending")
+        .values(status="failed", last_error=reason, locked_until=None)
+        .execution_options(synchronize_session=False)
+    )
+    await db.commit()
+    cache.webhook_registry.invalidate(agent_id)
+    return True
+
+async def enqueue_task_webhooks(db: AsyncSession, tasks, status: Optional[str] = None):
+    """在调用方的事务中为任务状态变化写入webhook投递 (发布者和认领者注册的webhook), 不提交。"""
+    payloads = [events.task_payload(task, status) for task in tasks]
+    payloads = [p for p in payloads if p["status"] in events.EVENT_TYPES]
+    agent_ids = {p["poster_id"] for p in payloads} | {p["claimer_id"] for p in payloads}
+    agent_ids.discard(None)
+    if not agent_ids:
+        return
+    # 注册表缓存命中时不查询数据库 (见 cache.WebhookRegistry)
+    generation = cache.webhook_registry.generation
+    webhooks_by_agent, missing = cache.webhook_registry.get_many(agent_ids)
+    if missing:
+        result = await db.execute(
+            select(database.WebhookDB.id, database.WebhookDB.agent_id, database.WebhookDB.event_types)
+            .filter(database.WebhookDB.agent_id.in_(missing), database.WebhookDB.active.is_(True))
+        )
+        loaded = {agent_id: [] for agent_id in missing}
+        for webhook_id, agent_id, event_types in result.all():
+            loaded[agent_id].append((webhook_id, frozenset(event_types.split(",")) if event_types else None))
+        cache.webhook_registry.put_many(loaded, generation)
+        webhooks_by_agent.update(loaded)
+    if not any(webhooks_by_agent.values()):
+        return
+
+    now = datetime.utcnow()
+    rows = []
+    for payload in payloads:
+        event_type = events.EVENT_TYPES[payload["status"]]
+        event_id = f"evt_{uuid4().hex}"
+        body = None
+        for agent_id in {payload["poster_id"], payload["claimer_id"]}:
+            for webhook_id, event_types in webhooks_by_agent.get(agent_id, []):
+                if event_types and event_type not in event_types:
+                    continue
+                if body is None:
+                    body = json.dumps(
+                        {"id": event_id, "type": event_type, "created_at": now, "data": payload},
+                        default=events.json_default,
+                    )
+                rows.append({"webhook_id": webhook_id, "event_id": event_id, "payload": body, "status": "pending",
+                             "attempts": 0, "created_at": now})
+    if rows:
+        await db.execute(insert(database.WebhookDeliveryDB), rows)
+
+async def lease_webhook_deliveries(db: AsyncSession, limit: int, lease_seconds: float):
+    """租用一批到期的pending投递 (按事件顺序), 租约期内其他worker不会处理这些行。"""
+    now = datetime.utcnow()
+    WebhookDeliveryDB = database.WebhookDeliveryDB
+    due = (
+        select(WebhookDeliveryDB.id)
+        .filter(
+            WebhookDeliveryDB.status == "pending",
+            or_(WebhookDeliveryDB.next_attempt_at.is_(None), WebhookDeliveryDB.next_attempt_at <= now),
+            or_(WebhookDeliveryDB.locked_until.is_(None), WebhookDeliveryDB.locked_until < now),
+        )
+        .order_by(WebhookDeliveryDB.id)
+        .limit(limit)
+    )
+    if db.bind.dialect.name == "postgresql":
+        due = due.with_for_update(skip_locked=True)
+    result = await db.execute(due)
+    delivery_ids = result.scalars().all()
+    if not delivery_ids:
+        return []
+    stmt = (
+        update(WebhookDeliveryDB)
+        .where(
+            WebhookDeliveryDB.id.in_(delivery_ids),
+            or_(WebhookDeliveryDB.locked_until.is_(None), WebhookDeliveryDB.locked_until < now),
+        )
+        .values(locked_until=now + timedelta(seconds=lease_seconds))
+        .execution_options(synchronize_session=False)
+    )
+    if db.bind.dialect.update_returning:
+        result = await db.execute(stmt.returning(WebhookDeliveryDB), execution_options={"populate_existing": True})
+        leased = sorted(result.scalars().all(), key=lambda d: d.id)
+        await db.commit()
+        return leased
+    await db.execute(stmt)
+    await db.commit()
+    result = await db.execute(select(WebhookDeliveryDB).filter(WebhookDeliveryDB.id.in_(delivery_ids)).order_by(WebhookDeliveryDB.id))
+    return result.scalars().all()
+
+async def mark_webhook_deliveries(db: AsyncSession, delivery_ids: List[int], status: str, error: Optional[str] = None):
+    # 终态: delivered 或 failed (死信)
+    await db.execute(
+        update(database.WebhookDeliveryDB)
+        .where(database.WebhookDeliveryDB.id.in_(delivery_ids))
+        .values(
+            status=status,
+            attempts=database.WebhookDeliveryDB.attempts + 1,
+            last_error=error,
+            locked_until=None,
+            delivered_at=datetime.utcnow() if status == "delivered" else None,
+        )
+        .execution_options(synchronize_session=False)
+    )
+    await db.commit()
+
+async def schedule_webhook_retry(db: AsyncSession, delivery_ids: List[int], error: str, next_attempt_at: datetime,
+                                 attempted: bool = True):
+    # attempted=False: 排在失败批次之后、本轮未发送的事件, 只推迟不计入重试次数
+    await db.execute(
+        update(database.WebhookDeliveryDB)
+        .where(database.WebhookDeliveryDB.id.in_(delivery_ids))
+        .values(
+            attempts=database.WebhookDeliveryDB.attempts + (1 if attempted else 0),
+            last_error=error,
+            next_attempt_at=next_attempt_at,
+            locked_until=None,
+        )
+        .execution_options(synchronize_session=False)
+    )
+    await db.commit()
@@ -1,20 +1,110 @@
-from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, Boolean, ForeignKey
+import os
+from sqlalchemy import create_engine, event, Column, Integer, String, Float, DateTime, Boolean, ForeignKey, Index
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
 from datetime import datetime
 
-DATABASE_URL = "sqlite:///./sql_app.db" # 本地SQLite数据库文件
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./sql_app.db") # 默认本地SQLite数据库文件
 
-engine = create_engine(DATABASE_URL)
+# --- 引擎配置 (可通过环境变量覆盖) ---
+# DB_ENGINE_PROFILE=production: WAL + 调优的pragma + 连接池; =default: SQLAlchemy/SQLite默认行为
+DB_ENGINE_PROFILE = os.getenv("DB_ENGINE_PROFILE", "production")
+
+ENGINE_PROFILES = {
+    "default": {
+        "sqlite_pragmas": {},
+        "pool": {},
+    },
+    "production": {
+        "sqlite_pragmas": {
+            "journal_mode": os.getenv("SQLITE_JOURNAL_MODE", "WAL"), # 读者不再被写者阻塞
+            "synchronous": os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"), # WAL下NORMAL是安全的, 省去每次提交的fsync
+            "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000")), # 写锁冲突时等待而不是立刻报 database is locked
+            "cache_size": -int(os.getenv("SQLITE_CACHE_SIZE_KB", "65536")), # 负数表示KiB
+            "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024))),
+            "temp_store": "MEMORY",
+        },
+        "pool": {
+            "pool_size": int(os.getenv("DB_POOL_SIZE", "10")),
+            "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "20")),
+            "pool_timeout": int(os.getenv("DB_POOL_TIMEOUT", "30")),
+            "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "1800")),
+            "pool_pre_ping": True,
+        },
+    },
+}
+
+if DB_ENGINE_PROFILE not in ENGINE_PROFILES:
+    raise ValueError(f"Unknown DB_ENGINE_PROFILE '{DB_ENGINE_PROFILE}', expected one of {sorted(ENGINE_PROFILES)}")
+
+# 同步驱动 -> 异步驱动 (API请求走异步引擎, 脚本/建表仍可使用同步引擎)
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "mysql": "mysql+aiomysql",
+}
+
+def to_async_url(url: str) -> str:
+    parsed = make_url(url)
+    if parsed.get_dialect().is_async:
+        return url
+    backend = parsed.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver known for database backend '{backend}'")
+    return parsed.set(drivername=ASYNC_DRIVERS[backend]).render_as_string(hide_password=False)
+
+def to_sync_url(url: str) -> str:
+    parsed = make_url(url)
+    if not parsed.get_dialect().is_async:
+        return url
+    return parsed.set(drivername=parsed.get_backend_name()).render_as_string(hide_password=False)
+
+def is_memory_sqlite(url: str) -> bool:
+    parsed = make_url(url)
+    return parsed.get_backend_name() == "sqlite" and parsed.database in (None, "", ":memory:")
+
+def engine_kwargs(url: str) -> dict:
+    profile = ENGINE_PROFILES[DB_ENGINE_PROFILE]
+    # 内存SQLite使用单连接池, 不接受连接池大小参数
+    if is_memory_sqlite(url):
+        return {}
+    return dict(profile["pool"])
+
+def install_sqlite_pragmas(sync_engine):
+    pragmas = ENGINE_PROFILES[DB_ENGINE_PROFILE]["sqlite_pragmas"]
+    if sync_engine.dialect.name != "sqlite" or not pragmas:
+        return
+    if is_memory_sqlite(str(sync_engine.url)):
+        pragmas = {k: v for k, v in pragmas.items() if k not in ("journal_mode", "mmap_size")}
+
+    # 每个新建的DBAPI连接都执行一次; 对aiosqlite同样生效 (适配后的连接提供同步cursor)
+    @event.listens_for(sync_engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+ASYNC_DATABASE_URL = to_async_url(DATABASE_URL)
+
+engine = create_engine(to_sync_url(DATABASE_URL), **engine_kwargs(DATABASE_URL))
+install_sqlite_pragmas(engine)
 Base = declarative_base()
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+async_engine = create_async_engine(ASYNC_DATABASE_URL, **engine_kwargs(DATABASE_URL))
+install_sqlite_pragmas(async_engine.sync_engine)
+# expire_on_commit=False: 提交后返回的ORM对象仍可被序列化, 不会触发隐式的异步懒加载
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
 class AgentDB(Base):
     __tablename__ = "agents"
 
     id = Column(String, primary_key=True, index=True) # Agent ID
     name = Column(String, unique=True, index=True)
-    api_key = Column(String, unique=True, index=True)
+    api_key_hash = Column(String, unique=True, index=True) # SHA-256(API Key), 不保存明文
     wallet_address = Column(String, unique=True)
     referral_code = Column(String, unique=True)
     created_at = Column(DateTime, default=datetime.utcnow)
@@ -33,21 +123,38 @@ class TaskDB(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     deadline_at = Column(DateTime, nullable=True) # 任务截止时间
 
-    poster_id = Column(String, ForeignKey("agents.id"))
-    poster = relationship("AgentDB", back_populates="tasks_posted")
+    poster_id = Column(String, ForeignKey("agents.id"), index=True)
+    poster = relationship("AgentDB", foreign_keys=[poster_id], back_populates="tasks_posted")
 
-    claimer_id = Column(String, ForeignKey("agents.id"), nullable=True)
-    claimer = relationship("AgentDB", back_populates="tasks_claimed")
+    claimer_id = Column(String, ForeignKey("agents.id"), nullable=True, index=True)
+    claimer = relationship("AgentDB", foreign_keys=[claimer_id], back_populates="tasks_claimed")
     
     submission_content = Column(String, nullable=True)
     approved_at = Column(DateTime, nullable=True)
     rejected_at = Column(DateTime, nullable=True)
+    # 每次修改时取全局递增的版本号 (counters表), 用于ETag; max(version) 即任务板的版本
+    version = Column(Integer, nullable=False, default=0)
+
+    # 已有数据库上的索引由 migrations.py 创建, 名称需与这里保持一致
+    # (key, id) 复合索引同时服务于过滤和keyset分页的排序
+    __table_args__ = (
+        Index("ix_tasks_status_created_at_id", "status", "created_at", "id"),
+        Index("ix_tasks_status_amount_id", "status", "amount", "id"),
+        Index("ix_tasks_status_deadline_at_id", "status", "deadline_at", "id"),
+        Index("ix_tasks_created_at_id", "created_at", "id"),
+        Index("ix_tasks_amount_id", "amount", "id"),
+        Index("ix_tasks_deadline_at_id", "deadline_at", "id"),
+        Index("ix_tasks_version", "version"),
+    )
+
+# claim-next 按发布者取最佳任务 (amount DESC, created_at ASC), 索引方向与排序一致
+Index("ix_tasks_status_poster_id_amount", TaskDB.status, TaskDB.poster_id, TaskDB.amount.desc(), TaskDB.created_at)
 
 class TransactionDB(Base):
     __tablename__ = "transactions"
 
     id = Column(String, primary_key=True, index=True) # Transaction ID (UUID)
-    task_id = Column(String, ForeignKey("tasks.id"))
+    task_id = Column(String, ForeignKey("tasks.id"), index=True)
     task = relationship("TaskDB")
     
     from_address = Column(String)
@@ -59,6 +166,141 @@ class TransactionDB(Base):
     status = Column(String, default="pending") # pending, completed, failed
     created_at = Column(DateTime, default=datetime.utcnow)
 
+    # --- 支付outbox: 由 settlement.py 的后台worker处理 ---
+    platform_fee_tx_hash = Column(String, nullable=True)
+    attempts = Column(Integer, default=0, nullable=False)
+    next_attempt_at = Column(DateTime, nullable=True) # 重试退避
+    locked_until = Column(DateTime, nullable=True) # worker租约, 防止多个worker重复支付
+    last_error = Column(String, nullable=True)
+    submitted_at = Column(DateTime, nullable=True) # 交易已广播, 等待确认
+    completed_at = Column(DateTime, nullable=True)
+    # 回执所在区块, 确认跟踪器用区块哈希判断交易是否被重组移出
+    block_number = Column(Integer, nullable=True)
+    block_hash = Column(String, nullable=True)
+    # 签好的交易与nonce在分配nonce的同一个事务中写入; 交易丢失时重新广播同一笔交易, 不会换nonce重新支付
+    nonce = Column(Integer, nullable=True)
+    raw_tx = Column(String, nullable=True) # 已签名交易 (hex)
+    broadcast_at = Column(DateTime, nullable=True) # 最近一次广播
+    kind = Column(String, default="payout", nullable=False) # payout: 赏金/手续费归集; approval: 给Disperse合约的授权
+
+    __table_args__ = (
+        Index("ix_transactions_status_next_attempt_at", "status", "next_attempt_at"),
+        Index("ix_transactions_tx_hash", "tx_hash"),
+    )
+
+class FeeAccrualDB(Base):
+    __tablename__ = "fee_accruals"
+
+    # 平台手续费账本: 每笔审核通过的任务记一条, 不再为每个任务单独发送手续费转账
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    task_id = Column(String, ForeignKey("tasks.id"), index=True)
+    transaction_id = Column(String, ForeignKey("transactions.id"), index=True) # 对应的赏金支付, 支付完成后手续费才可归集
+    amount_micro = Column(Integer, nullable=False) # 整数micro-USDC
+    sweep_id = Column(String, ForeignKey("fee_sweeps.id"), nullable=True, index=True) # 为空表示尚未归集
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class FeeSweepDB(Base):
+    __tablename__ = "fee_sweeps"
+
+    # 一次归集 = 一笔转到 PLATFORM_FEE_RECIPIENT_ADDRESS 的outbox交易, 由settlement worker支付
+    id = Column(String, primary_key=True) # Sweep ID (UUID)
+    transaction_id = Column(String, ForeignKey("transactions.id"), index=True)
+    transaction = relationship("TransactionDB")
+    amount_micro = Column(Integer, nullable=False) # 等于所含fee_accruals之和
+    accrual_count = Column(Integer, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class UsdcTransferDB(Base):
+    __tablename__ = "usdc_transfers"
+
+    # indexer.py 从链上 Transfer 日志同步的、涉及平台或Agent钱包的USDC转账; 地址统一小写
+    id = Column(String, primary_key=True) # "<tx_hash>:<log_index>"
+    block_number = Column(Integer, nullable=False, index=True)
+    block_hash = Column(String, nullable=False)
+    tx_hash = Column(String, nullable=False, index=True)
+    log_index = Column(Integer, nullable=False)
+    from_address = Column(String, nullable=False)
+    to_address = Column(String, nullable=False)
+    amount_micro = Column(Integer, nullable=False)
+
+    __table_args__ = (
+        Index("ix_usdc_transfers_from_address_block", "from_address", "block_number", "log_index"),
+        Index("ix_usdc_transfers_to_address_block", "to_address", "block_number", "log_index"),
+    )
+
+class IndexerCheckpointDB(Base):
+    __tablename__ = "indexer_checkpoints"
+
+    # 已完整索引到的区块 (含), 重启后从下一个区块继续; 区块哈希用于发现重组
+    name = Column(String, primary_key=True)
+    block_number = Column(Integer, nullable=False)
+    block_hash = Column(String, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+class SignerNonceDB(Base):
+    __tablename__ = "signer_nonces"
+
+    # 平台签名钱包的nonce分配状态, 由 nonces.py 维护; 多个worker进程共享同一行
+    address = Column(String, primary_key=True)
+    next_nonce = Column(Integer, nullable=False) # 下一个可分配的nonce
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+class SignedTransactionDB(Base):
+    __tablename__ = "signed_transactions"
+
+    # outbox签过的每一笔交易, 包括同一nonce上的提价替换和取消交易: 替换之后旧交易仍可能上链, 确认跟踪器按nonce查询所有哈希
+    tx_hash = Column(String, primary_key=True)
+    address = Column(String, nullable=False)
+    nonce = Column(Integer, nullable=False)
+    # transfer / disperse / approve: 原交易或其提价替换; cancel: 0金额的自转账, 只用于占用nonce
+    kind = Column(String, nullable=False)
+    raw_tx = Column(String, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_signed_transactions_address_nonce", "address", "nonce"),
+    )
+
+class CounterDB(Base):
+    __tablename__ = "counters"
+
+    # 全局单调递增计数器, 例如 task_version; 递增在写事务中进行, 提交顺序与取值顺序一致
+    name = Column(String, primary_key=True)
+    value = Column(Integer, nullable=False, default=0)
+
+class WebhookDB(Base):
+    __tablename__ = "webhooks"
+
+    # Agent注册的webhook: 其发布或认领的任务状态变化时, 由 webhooks.py 的worker推送
+    id = Column(String, primary_key=True) # Webhook ID (UUID)
+    agent_id = Column(String, ForeignKey("agents.id"), index=True)
+    url = Column(String, nullable=False)
+    secret = Column(String, nullable=False) # HMAC签名密钥, 需要明文保存
+    event_types = Column(String, nullable=True) # 逗号分隔的事件类型, 为空表示全部
+    active = Column(Boolean, default=True, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class WebhookDeliveryDB(Base):
+    __tablename__ = "webhook_deliveries"
+
+    # 投递队列: 与任务状态变更在同一个事务中写入, 进程重启后继续投递
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    webhook_id = Column(String, ForeignKey("webhooks.id"), index=True)
+    webhook = relationship("WebhookDB")
+    event_id = Column(String, nullable=False) # 同一事件投递到多个webhook时相同, 接收方用于去重
+    payload = Column(String, nullable=False) # 事件JSON
+    status = Column(String, default="pending", nullable=False) # pending, delivered, failed
+    attempts = Column(Integer, default=0, nullable=False)
+    next_attempt_at = Column(DateTime, nullable=True)
+    locked_until = Column(DateTime, nullable=True)
+    last_error = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    delivered_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index("ix_webhook_deliveries_status_next_attempt_at", "status", "next_attempt_at"),
+    )
+
 def get_db():
     db = SessionLocal()
     try:
@@ -67,7 +309,9 @@ def get_db():
         db.close()
 
 def init_db():
+    from . import migrations
     Base.metadata.create_all(bind=engine)
+    migrations.upgrade(engine)
 
 if __name__ == "__main__":
     init_db()
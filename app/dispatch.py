@@ -0,0 +1,96 @@
+"""
+Work-queue dispatch for POST /tasks/claim-next.
+
+Agent不再轮询任务列表后竞争同一个任务, 而是由服务端直接分配一个符合条件的open任务。
+发布者之间按加权公平排队 (start-time fair queuing): 每个发布者有一个虚拟完成时间,
+每派发一个任务增加 1/weight, 总是优先派发虚拟时间最小的发布者,
+因此一个发布者一次性发布大量任务也不会饿死其他发布者。
+发布者权重来自 CLAIM_NEXT_POSTER_WEIGHTS ("<poster_id>:<weight>,..."), 未配置的发布者权重为1。
+
+每次尝试都是一个写事务 (带条件的UPDATE), 所以按公平顺序最多尝试 CLAIM_NEXT_MAX_POSTER_ATTEMPTS 个发布者,
+之后用一条语句认领全局最佳任务。
+"""
+import os
+import random
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import crud
+
+# 每次claim-next最多按公平顺序尝试的发布者数量, 超过后退化为全局最佳任务
+CLAIM_NEXT_MAX_POSTER_ATTEMPTS = int(os.getenv("CLAIM_NEXT_MAX_POSTER_ATTEMPTS", "2"))
+CLAIM_NEXT_POSTER_WEIGHTS = os.getenv("CLAIM_NEXT_POSTER_WEIGHTS", "")
+# open任务的发布者集合缓存时间 (秒)
+CLAIM_NEXT_POSTER_CACHE_TTL = float(os.getenv("CLAIM_NEXT_POSTER_CACHE_TTL", "1.0"))
+
+class FairDispatcher:
+    def __init__(self, default_weight: float = 1.0):
+        self.default_weight = default_weight
+        self._weights: Dict[str, float] = {}
+        self._finish: Dict[str, float] = {}
+        self._virtual_time = 0.0
+        self._posters: List[str] = []
+        self._posters_loaded_at = 0.0
+
+    def set_weight(self, poster_id: str, weight: float):
+        if weight <= 0:
+            raise ValueError("weight must be positive")
+        self._weights[poster_id] = weight
+
+    def load_weights(self, spec: str):
+        """解析 "<poster_id>:<weight>,..." 格式的权重配置。"""
+        for item in filter(None, (part.strip() for part in spec.split(","))):
+            poster_id, sep, weight = item.rpartition(":")
+            if not sep or not poster_id:
+                raise ValueError(f"Invalid poster weight '{item}', expected <poster_id>:<weight>")
+            self.set_weight(poster_id.strip(), float(weight))
+
+    def _start_tag(self, poster_id: str) -> float:
+        return max(self._finish.get(poster_id, 0.0), self._virtual_time)
+
+    def order(self, poster_ids: List[str]) -> List[str]:
+        # 虚拟时间相同的发布者随机打散, 避免并发请求总是先尝试同一个发布者
+        return sorted(poster_ids, key=lambda p: (self._start_tag(p), random.random()))
+
+    def charge(self, poster_id: str):
+        start = self._start_tag(poster_id)
+        self._finish[poster_id] = start + 1.0 / self._weights.get(poster_id, self.default_weight)
+        self._virtual_time = start
+        # 虚拟时间已经追上的发布者不再需要单独记录
+        if len(self._finish) > 10000:
+            self._finish = {p: f for p, f in self._finish.items() if f > self._virtual_time}
+
+    async def poster_ids(self, db: AsyncSession) -> List[str]:
+        now = time.monotonic()
+        if now - self._posters_loaded_at > CLAIM_NEXT_POSTER_CACHE_TTL:
+            self._posters = list(await crud.get_open_poster_ids(db))
+            self._posters_loaded_at = now
+        return self._posters
+
+dispatcher = FairDispatcher()
+dispatcher.load_weights(CLAIM_NEXT_POSTER_WEIGHTS)
+
+async def claim_next(db: AsyncSession, claimer_id: str, min_amount: Optional[float] = None,
+                     deadline_horizon_minutes: Optional[int] = None):
+    deadline_after = None
+    if deadline_horizon_minutes:
+        # 只派发截止时间在horizon之后的任务, 保证Agent有时间完成
+        deadline_after = datetime.utcnow() + timedelta(minutes=deadline_horizon_minutes)
+
+    posters = [p for p in await dispatcher.poster_ids(db) if p != claimer_id]
+    for poster_id in dispatcher.order(posters)[:CLAIM_NEXT_MAX_POSTER_ATTEMPTS]:
+        db_task = await crud.claim_next_task(
+            db, claimer_id, poster_id=poster_id, min_amount=min_amount, deadline_after=deadline_after
+        )
+        if db_task:
+            dispatcher.charge(poster_id)
+            return db_task
+
+    # 公平顺序中的发布者都没有匹配的任务 (或缓存已过期): 取全局最佳任务
+    db_task = await crud.claim_next_task(db, claimer_id, min_amount=min_amount, deadline_after=deadline_after)
+    if db_task:
+        dispatcher.charge(db_task.poster_id)
+    return db_task
@@ -0,0 +1,209 @@
+"""
+In-process fan-out broker for task lifecycle events (SSE / WebSocket push).
+
+Agent和发布者不再轮询 GET /tasks/: crud写入成功后发布 task.created/claimed/submitted/approved/rejected 事件,
+订阅者按状态、发布者、最小赏金过滤。
+- 每个订阅者一个有界队列 (EVENT_QUEUE_SIZE); 队列满说明客户端消费太慢, 直接断开 (evicted),
+  不让一个慢客户端拖住发布方或无限占用内存;
+- 最近 EVENT_HISTORY_SIZE 个事件保存在环形缓冲区中, 断线重连时按 Last-Event-ID 补发错过的事件;
+  ID已不在缓冲区内 (或来自另一个进程/重启之前) 时发送 reset, 客户端应通过REST重新拉取列表;
+- 一次写入超过 EVENT_BULK_THRESHOLD 个任务 (例如 /tasks/batch、/tasks/review-batch) 时, 每个状态只发布一个
+  tasks.bulk 汇总事件 {event, status, count, poster_ids, min_amount, max_amount, version}, 不逐个发布:
+  否则一次批量发布就会塞满所有订阅者的队列并把环形缓冲区冲掉。客户端收到后通过REST重新拉取。
+
+事件只在本进程内分发: 多进程部署时每个进程只推送自己处理的写请求。
+"""
+import asyncio
+import json
+import os
+import uuid
+from collections import deque
+from datetime import datetime
+from typing import Deque, Iterable, List, Optional, Set, Tuple
+
+EVENT_HISTORY_SIZE = int(os.getenv("EVENT_HISTORY_SIZE", "10000"))
+EVENT_QUEUE_SIZE = int(os.getenv("EVENT_QUEUE_SIZE", "1000"))
+EVENT_HEARTBEAT_INTERVAL = float(os.getenv("EVENT_HEARTBEAT_INTERVAL", "15")) # 秒, 空闲连接的保活
+EVENT_BULK_THRESHOLD = int(os.getenv("EVENT_BULK_THRESHOLD", "100"))
+BULK_EVENT_TYPE = "tasks.bulk"
+
+# 任务的新状态 -> 事件类型
+EVENT_TYPES = {
+    "open": "task.created",
+    "claimed": "task.claimed",
+    "submitted": "task.submitted",
+    "approved": "task.approved",
+    "rejected": "task.rejected",
+}
+TASK_EVENT_FIELDS = ("id", "title", "amount", "status", "poster_id", "claimer_id", "deadline_at")
+
+def json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+class Event:
+    __slots__ = ("id", "seq", "type", "task")
+
+    def __init__(self, event_id: str, seq: int, event_type: str, task: dict):
+        self.id = event_id
+        self.seq = seq
+        self.type = event_type
+        self.task = task
+
+    def to_json(self) -> str:
+        return json.dumps({"id": self.id, "event": self.type, "data": self.task}, default=json_default)
+
+    def to_sse(self) -> str:
+        return f"id: {self.id}\nevent: {self.type}\ndata: {json.dumps(self.task, default=json_default)}\n\n"
+
+class Subscription:
+    def __init__(self, statuses: Optional[Set[str]] = None, poster_id: Optional[str] = None,
+                 min_amount: Optional[float] = None):
+        self.statuses = statuses
+        self.poster_id = poster_id
+        self.min_amount = min_amount
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=EVENT_QUEUE_SIZE)
+        self.evicted = False
+        self._wakeup = asyncio.Event()
+
+    def matches(self, event: Event) -> bool:
+        task = event.task
+        if event.type == BULK_EVENT_TYPE:
+            return ((not self.statuses or task["status"] in self.statuses)
+                    and (not self.poster_id or self.poster_id in task["poster_ids"])
+                    and (self.min_amount is None or (task["max_amount"] or 0) >= self.min_amount))
+        if self.statuses and task["status"] not in self.statuses:
+            return False
+        if self.poster_id and task["poster_id"] != self.poster_id:
+            return False
+        if self.min_amount is not None and (task["amount"] or 0) < self.min_amount:
+            return False
+        return True
+
+    def evict(self):
+        self.evicted = True
+        self._wakeup.set()
+
+    async def next(self, timeout: float) -> Optional[Event]:
+        """下一个事件; 超时返回None (调用方发送心跳)。被驱逐后不再返回积压的事件。"""
+        if self.evicted:
+            return None
+        if not self.queue.empty():
+            return self.queue.get_nowait()
+        getter = asyncio.ensure_future(self.queue.get())
+        evicted = asyncio.ensure_future(self._wakeup.wait())
+        try:
+            done, _ = await asyncio.wait({getter, evicted}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            getter.cancel()
+            evicted.cancel()
+        if getter in done and not self.evicted:
+            return getter.result()
+        return None
+
+class EventBroker:
+    def __init__(self, history_size: int = EVENT_HISTORY_SIZE):
+        # 每个进程 (每次启动) 一个epoch, 其他epoch的事件ID无法续传
+        self.epoch = uuid.uuid4().hex[:8]
+        self._seq = 0
+        self._history: Deque[Event] = deque(maxlen=history_size)
+        self._subscribers: Set[Subscription] = set()
+
+    def _parse_id(self, event_id: Optional[str]) -> Optional[int]:
+        epoch, _, seq = (event_id or "").partition("-")
+        if epoch != self.epoch or not seq.isdigit():
+            return None
+        return int(seq)
+
+    def publish(self, event_type: str, task: dict) -> Event:
+        self._seq += 1
+        event = Event(f"{self.epoch}-{self._seq}", self._seq, event_type, task)
+        self._history.append(event)
+        for subscription in list(self._subscribers):
+            if not subscription.matches(event):
+                continue
+            try:
+                subscription.queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # 慢消费者: 断开, 客户端重连后从环形缓冲区补发
+                self._subscribers.discard(subscription)
+                subscription.evict()
+        return event
+
+    def subscribe(self, subscription: Subscription, last_event_id: Optional[str] = None) -> Tuple[Subscription, bool]:
+        """注册订阅并补发 last_event_id 之后的事件; 返回 (subscription, 是否需要reset)。"""
+        reset = False
+        if last_event_id:
+            seq = self._parse_id(last_event_id)
+            oldest = self._history[0].seq if self._history else self._seq + 1
+            if seq is None or seq > self._seq or seq < oldest - 1:
+                reset = True
+            else:
+                missed = [e for e in self._history if e.seq > seq and subscription.matches(e)]
+                if len(missed) > EVENT_QUEUE_SIZE:
+                    reset = True
+                else:
+                    for event in missed:
+                        subscription.queue.put_nowait(event)
+        self._subscribers.add(subscription)
+        return subscription, reset
+
+    def unsubscribe(self, subscription: Subscription):
+        self._subscribers.discard(subscription)
+
+    def close(self):
+        # 关闭服务时断开所有订阅者
+        for subscription in list(self._subscribers):
+            subscription.evict()
+        self._subscribers.clear()
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+broker = EventBroker()
+
+def _field(task, name: str):
+    return task.get(name) if isinstance(task, dict) else getattr(task, name, None)
+
+def task_payload(task, status: Optional[str] = None) -> dict:
+    """事件中的任务字段; task 可以是ORM对象、Row或dict, status 覆盖任务当前的状态。"""
+    payload = {name: _field(task, name) for name in TASK_EVENT_FIELDS}
+    if status:
+        payload["status"] = status
+    return payload
+
+def _bulk_payload(event_type: str, payloads: List[dict], versions: List) -> dict:
+    amounts = [p["amount"] for p in payloads if p["amount"] is not None]
+    return {
+        "event": event_type,
+        "status": payloads[0]["status"],
+        "count": len(payloads),
+        "poster_ids": sorted({p["poster_id"] for p in payloads if p["poster_id"]}),
+        "min_amount": min(amounts, default=None),
+        "max_amount": max(amounts, default=None),
+        "version": max((v for v in versions if v is not None), default=None),
+    }
+
+def publish_tasks(tasks: Iterable, status: Optional[str] = None) -> List[Event]:
+    """为每个任务按其 (新) 状态发布一个事件; 同一状态超过 EVENT_BULK_THRESHOLD 个任务时合并为一个 tasks.bulk 事件。"""
+    by_type = {}
+    for task in tasks:
+        payload = task_payload(task, status)
+        event_type = EVENT_TYPES.get(payload["status"])
+        if event_type:
+            by_type.setdefault(event_type, []).append((payload, _field(task, "version")))
+    events = []
+    for event_type, items in by_type.items():
+        payloads = [payload for payload, _ in items]
+        if len(payloads) > EVENT_BULK_THRESHOLD:
+            events.append(broker.publish(BULK_EVENT_TYPE, _bulk_payload(event_type, payloads, [v for _, v in items])))
+        else:
+            events.extend(broker.publish(event_type, payload) for payload in payloads)
+    return events
+
+def parse_statuses(status: Optional[str]) -> Optional[Set[str]]:
+    # ?status=open,claimed
+    statuses = {s.strip() for s in (status or "").split(",") if s.strip()}
+    return statuses or None
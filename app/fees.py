@@ -0,0 +1,38 @@
+"""
+Bounty/fee arithmetic in integer micro-USDC.
+
+USDC有6位小数, 金额在计算时统一转换为整数micro-USDC (1 USDC = 1_000_000),
+避免浮点误差; 只有写入数据库的Float列和展示时才转换回USDC。
+"""
+import os
+from decimal import Decimal, ROUND_HALF_UP
+from typing import List, Tuple
+
+MICRO_PER_USDC = 1_000_000
+PLATFORM_FEE_BPS = int(os.getenv("PLATFORM_FEE_BPS", "100")) # 平台手续费, 100 bps = 1%
+
+def to_micro(amount_usd: float) -> int:
+    # 经过str()再转Decimal, 使 0.1 这样的输入得到精确的 100000
+    return int((Decimal(str(amount_usd)) * MICRO_PER_USDC).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+def from_micro(amount_micro: int) -> float:
+    return amount_micro / MICRO_PER_USDC
+
+def split_fee(amount_micro: int, fee_bps: int = PLATFORM_FEE_BPS) -> Tuple[int, int]:
+    """返回 (payout_micro, fee_micro); 手续费向下取整, payout + fee 恒等于 amount。"""
+    fee_micro = amount_micro * fee_bps // 10_000
+    return amount_micro - fee_micro, fee_micro
+
+def split_fees(amounts_micro: List[int], fee_bps: int = PLATFORM_FEE_BPS) -> Tuple[List[int], List[int]]:
+    fees = [amount * fee_bps // 10_000 for amount in amounts_micro]
+    payouts = [amount - fee for amount, fee in zip(amounts_micro, fees)]
+    return payouts, fees
+
+def to_token_units(amount_micro: int, decimals: int) -> int:
+    """micro-USDC -> 合约最小单位 (10**-decimals), 整数运算; 精度不足以精确表示时报错而不是截断。"""
+    if decimals >= 6:
+        return amount_micro * 10 ** (decimals - 6)
+    units, remainder = divmod(amount_micro, 10 ** (6 - decimals))
+    if remainder:
+        raise ValueError(f"{amount_micro} micro-USDC is not representable with {decimals} decimals")
+    return units
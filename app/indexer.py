@@ -0,0 +1,151 @@
+"""
+Incremental indexer for USDC Transfer logs.
+
+后台同步涉及平台钱包、手续费钱包和Agent钱包的USDC Transfer事件到 usdc_transfers 表, 用于发现充值、
+核对外部结算; API直接查询本地表。
+- eth_getLogs 按自适应区块范围拉取: 成功后范围扩大, 节点报错 (结果过多/范围过大/超时) 时范围减半;
+- 每个区间的转账与检查点在同一事务中写入, 重启后从检查点继续, 只处理新区块;
+- 只索引到 head - INDEXER_CONFIRMATIONS; 检查点所在区块的哈希与链上不一致时 (更深的重组),
+  回退 INDEXER_REORG_REWIND 个区块重新索引。
+
+默认作为独立进程运行; 本地开发时可以设置 INDEXER_IN_APP=1 随API进程启动:
+    python -m scripts.transfer_indexer
+"""
+import asyncio
+import os
+from typing import Dict, List, Optional, Set
+
+from web3 import Web3
+
+from . import blockchain, crud, database
+
+INDEXER_NAME = "usdc_transfers"
+INDEXER_IN_APP = os.getenv("INDEXER_IN_APP", "0") == "1"
+INDEXER_POLL_INTERVAL = float(os.getenv("INDEXER_POLL_INTERVAL", "5"))
+INDEXER_START_BLOCK = os.getenv("INDEXER_START_BLOCK") # 未设置时从当前区块开始, 不回溯历史
+INDEXER_CONFIRMATIONS = int(os.getenv("INDEXER_CONFIRMATIONS", "3"))
+INDEXER_REORG_REWIND = int(os.getenv("INDEXER_REORG_REWIND", "64"))
+INDEXER_INITIAL_RANGE = int(os.getenv("INDEXER_INITIAL_RANGE", "500"))
+INDEXER_MAX_RANGE = int(os.getenv("INDEXER_MAX_RANGE", "10000"))
+# 关注的地址不多时用topic过滤 (每个区间两次getLogs: from/to); 否则拉取全部Transfer在本地过滤
+INDEXER_TOPIC_FILTER_MAX = int(os.getenv("INDEXER_TOPIC_FILTER_MAX", "100"))
+
+TRANSFER_TOPIC = "0x" + Web3.keccak(text="Transfer(address,address,uint256)").hex().removeprefix("0x")
+
+def _topic(address: str) -> str:
+    return "0x" + address.lower().removeprefix("0x").rjust(64, "0")
+
+def _address(topic) -> str:
+    return "0x" + bytes(topic)[-20:].hex()
+
+class TransferIndexer:
+    def __init__(self, name: str = INDEXER_NAME):
+        self.name = name
+        self.block_range = INDEXER_INITIAL_RANGE
+
+    # --- 链上读取 (在区块链线程池中执行) ---
+    def _block_hash(self, block_number: int) -> str:
+        return Web3.to_hex(blockchain.WEB3_PROVIDER.eth.get_block(block_number)["hash"])
+
+    def _get_logs(self, from_block: int, to_block: int, watched: Set[str]) -> List[dict]:
+        token = blockchain.get_usdc_contract().address
+        base = {"fromBlock": from_block, "toBlock": to_block, "address": token}
+        if len(watched) <= INDEXER_TOPIC_FILTER_MAX:
+            topics = [_topic(a) for a in sorted(watched)]
+            logs = blockchain.WEB3_PROVIDER.eth.get_logs({**base, "topics": [TRANSFER_TOPIC, topics]})
+            logs += blockchain.WEB3_PROVIDER.eth.get_logs({**base, "topics": [TRANSFER_TOPIC, None, topics]})
+        else:
+            logs = blockchain.WEB3_PROVIDER.eth.get_logs({**base, "topics": [TRANSFER_TOPIC]})
+
+        scale = 10 ** blockchain.CHAIN.decimals(blockchain.get_usdc_contract())
+        transfers: Dict[str, dict] = {}
+        for log in logs:
+            if log.get("removed") or len(log["topics"]) < 3:
+                continue
+            from_address, to_address = _address(log["topics"][1]), _address(log["topics"][2])
+            if from_address not in watched and to_address not in watched:
+                continue
+            tx_hash = Web3.to_hex(log["transactionHash"])
+            key = f"{tx_hash}:{log['logIndex']}" # 自转账会同时出现在两次查询中
+            transfers[key] = {
+                "id": key,
+                "block_number": log["blockNumber"],
+                "block_hash": Web3.to_hex(log["blockHash"]),
+                "tx_hash": tx_hash,
+                "log_index": log["logIndex"],
+                "from_address": from_address,
+                "to_address": to_address,
+                "amount_micro": int.from_bytes(bytes(log["data"]), "big") * 1_000_000 // scale,
+            }
+        return list(transfers.values())
+
+    # --- 索引流程 ---
+    async def _watched_addresses(self) -> Set[str]:
+        async with database.AsyncSessionLocal() as db:
+            wallets = await crud.get_agent_wallets(db)
+        addresses = set(wallets) | {blockchain.PLATFORM_ADDRESS, blockchain.PLATFORM_FEE_RECIPIENT_ADDRESS}
+        # 只保留格式正确的地址 (注册时生成的占位地址无法出现在链上)
+        return {a.lower() for a in addresses if a and Web3.is_address(a)}
+
+    async def _checkpoint(self, safe_head: int):
+        async with database.AsyncSessionLocal() as db:
+            checkpoint = await crud.get_indexer_checkpoint(db, self.name)
+        if checkpoint is not None:
+            return checkpoint.block_number, checkpoint.block_hash
+        start = int(INDEXER_START_BLOCK) if INDEXER_START_BLOCK else safe_head
+        return max(start, 0) - 1, None # 链高度还不到确认数时 (例如刚启动的模拟链) 从创世块开始
+
+    async def _detect_reorg(self, block_number: int, block_hash: Optional[str]) -> Optional[int]:
+        if block_hash is None or block_number < 0:
+            return None
+        if await blockchain.run_blocking(self._block_hash, block_number) == block_hash:
+            return None
+        rewind_to = max(block_number - INDEXER_REORG_REWIND, 0)
+        print(f"Transfer indexer: reorg detected at block {block_number}, rewinding to {rewind_to}")
+        async with database.AsyncSessionLocal() as db:
+            await crud.rewind_indexer(db, self.name, rewind_to, await blockchain.run_blocking(self._block_hash, rewind_to))
+        return rewind_to
+
+    async def index_once(self) -> int:
+        """索引到当前安全高度, 返回本轮处理的区块数。"""
+        safe_head = await blockchain.get_block_number() - INDEXER_CONFIRMATIONS
+        last_block, last_hash = await self._checkpoint(safe_head)
+        rewound = await self._detect_reorg(last_block, last_hash)
+        if rewound is not None:
+            last_block = rewound
+        watched = await self._watched_addresses()
+
+        processed = 0
+        while last_block < safe_head:
+            from_block = last_block + 1
+            to_block = min(from_block + self.block_range - 1, safe_head)
+            try:
+                transfers = await blockchain.run_blocking(self._get_logs, from_block, to_block, watched)
+            except Exception as e:
+                if to_block == from_block:
+                    raise
+                # 范围过大或结果过多: 缩小范围重试
+                self.block_range = max(1, (to_block - from_block + 1) // 2)
+                print(f"Transfer indexer: getLogs {from_block}-{to_block} failed ({e}), range -> {self.block_range}")
+                continue
+            to_hash = await blockchain.run_blocking(self._block_hash, to_block)
+            async with database.AsyncSessionLocal() as db:
+                await crud.save_indexed_transfers(db, self.name, from_block, to_block, to_hash, transfers)
+            processed += to_block - from_block + 1
+            last_block = to_block
+            self.block_range = min(INDEXER_MAX_RANGE, int(self.block_range * 1.5) + 1)
+        return processed
+
+indexer = TransferIndexer()
+
+async def run_forever(stop: asyncio.Event = None):
+    stop = stop or asyncio.Event()
+    while not stop.is_set():
+        try:
+            await indexer.index_once()
+        except Exception as e:
+            print(f"Transfer indexer error: {e}")
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=INDEXER_POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
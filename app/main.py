@@ -1,39 +1,72 @@
-from fastapi import FastAPI, Depends, HTTPException, status, Header
-from sqlalchemy.orm import Session
-from typing import List, Optional
+import asyncio
+import hashlib
+import json
+import os
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Depends, HTTPException, status, Header, Query, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+from pydantic import TypeAdapter, ValidationError
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Literal, Optional
 from uuid import uuid4
 
-from . import models, crud, database, blockchain
-from .database import SessionLocal, engine, init_db
+from . import models, crud, cache, database, blockchain, dispatch, auth, events, fees, search, settlement, balances, indexer, webhooks
+from .database import AsyncSessionLocal, init_db
+
+# --- Background Workers ---
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    stop = asyncio.Event()
+    workers = []
+    if settlement.SETTLEMENT_WORKER_IN_APP:
+        workers.append(asyncio.create_task(settlement.run_forever(stop)))
+    if indexer.INDEXER_IN_APP:
+        workers.append(asyncio.create_task(indexer.run_forever(stop)))
+    if webhooks.WEBHOOK_WORKER_IN_APP:
+        workers.append(asyncio.create_task(webhooks.run_forever(stop)))
+    yield
+    stop.set()
+    events.broker.close() # 结束所有SSE/WebSocket订阅
+    await asyncio.gather(*workers, return_exceptions=True)
 
 # --- FastAPI App Initialization ---
 app = FastAPI(
     title="AgentTaskHub API",
     version="1.0.0",
     description="API for AgentTaskHub - an Agent-to-Agent Bounty Marketplace",
-    openapi_url="/openapi.json"
+    openapi_url="/openapi.json",
+    lifespan=lifespan
 )
 
 # 初始化数据库
 init_db()
 
+TASK_BATCH_MAX_ITEMS = int(os.getenv("TASK_BATCH_MAX_ITEMS", "100000"))
+BALANCE_MAX_AGENTS = int(os.getenv("BALANCE_MAX_AGENTS", "5000"))
+WEBHOOK_MAX_PER_AGENT = int(os.getenv("WEBHOOK_MAX_PER_AGENT", "10"))
+TASK_MULTI_GET_MAX = int(os.getenv("TASK_MULTI_GET_MAX", "500"))
+TASK_LIST_MAX_LIMIT = int(os.getenv("TASK_LIST_MAX_LIMIT", "1000"))
+
 # Dependency to get DB session
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
 # --- Security Dependency ---
-def get_current_agent(api_key: str = Header(..., alias="X-API-Key"), db: Session = Depends(get_db)):
-    db_agent = crud.get_agent_by_api_key(db, api_key=api_key)
+async def get_current_agent(api_key: str = Header(..., alias="X-API-Key"), db: AsyncSession = Depends(get_db)):
+    # 热路径: 命中进程内缓存时不访问数据库
+    key_hash = auth.hash_api_key(api_key)
+    db_agent = auth.agent_cache.get(key_hash)
+    if db_agent:
+        return db_agent
+    db_agent = await crud.get_agent_by_api_key_hash(db, api_key_hash=key_hash)
     if not db_agent:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid API Key",
             headers={"WWW-Authenticate": "Bearer"},
         )
+    auth.agent_cache.put(key_hash, db_agent)
     return db_agent
 
 # --- Root Endpoint ---
@@ -43,62 +76,363 @@ async def read_root():
 
 # --- Agent Endpoints ---
 @app.post("/agents/", response_model=models.Agent)
-async def register_agent(agent: models.AgentCreate, db: Session = Depends(get_db)):
-    db_agent_exists = crud.get_agent_by_name(db, name=agent.name)
+async def register_agent(agent: models.AgentCreate, db: AsyncSession = Depends(get_db)):
+    db_agent_exists = await crud.get_agent_by_name(db, name=agent.name)
     if db_agent_exists:
         raise HTTPException(status_code=400, detail="Agent name already registered")
     
-    # 临时生成API Key、钱包地址和推荐码
-    api_key = str(uuid4()) # 简化，实际应更安全生成
+    # 临时生成钱包地址和推荐码
+    api_key = auth.generate_api_key()
     wallet_address = f"0x{uuid4().hex[:40]}" # 简化，实际应与区块链钱包关联
     referral_code = str(uuid4())[:8] # 简化
     
-    db_agent = crud.create_agent(db=db, agent=agent, api_key=api_key, wallet_address=wallet_address, referral_code=referral_code)
+    db_agent = await crud.create_agent(db=db, agent=agent, api_key=api_key, wallet_address=wallet_address, referral_code=referral_code)
     
-    return db_agent
+    # 数据库只保存哈希, 明文Key仅在注册时返回这一次
+    return models.Agent.model_validate(db_agent).model_copy(update={"api_key": api_key})
 
 @app.get("/agents/me/", response_model=models.Agent)
 async def get_my_agent_profile(current_agent: models.Agent = Depends(get_current_agent)):
     return current_agent
 
+@app.post("/agents/me/api-key", response_model=models.APIKeyResponse)
+async def rotate_api_key(
+    current_agent: models.Agent = Depends(get_current_agent),
+    db: AsyncSession = Depends(get_db)
+):
+    new_api_key = auth.generate_api_key()
+    await crud.update_agent_api_key(db, agent_id=current_agent.id, api_key=new_api_key)
+    # 旧Key立即失效 (本进程); 其他worker进程中的缓存条目在 AUTH_CACHE_TTL 内过期
+    auth.agent_cache.invalidate_agent(current_agent.id)
+    return models.APIKeyResponse(api_key=new_api_key)
+
+@app.post("/agents/balances", response_model=models.AgentBalances)
+async def get_agent_balances(
+    request: models.AgentBalanceRequest,
+    current_agent: models.Agent = Depends(get_current_agent),
+    db: AsyncSession = Depends(get_db)
+):
+    if len(request.agent_ids) > BALANCE_MAX_AGENTS:
+        raise HTTPException(status_code=400, detail=f"At most {BALANCE_MAX_AGENTS} agents per request")
+    agents = await crud.get_agents_by_ids(db, request.agent_ids)
+    # 所有钱包通过Multicall一次查询, 同一区块内的重复请求直接命中缓存
+    block_number, wallet_balances = await balances.balance_service.get_balances([a.wallet_address for a in agents])
+    return models.AgentBalances(
+        block_number=block_number,
+        balances=[
+            models.AgentBalance(agent_id=a.id, wallet_address=a.wallet_address, balance=wallet_balances[a.wallet_address])
+            for a in agents
+        ],
+    )
+
+@app.get("/agents/me/transfers", response_model=List[models.UsdcTransfer])
+async def get_my_transfers(
+    limit: int = Query(50, ge=1, le=500),
+    before_block: Optional[int] = None,
+    before_log_index: Optional[int] = None,
+    current_agent: models.Agent = Depends(get_current_agent),
+    db: AsyncSession = Depends(get_db)
+):
+    # 来自本地的 usdc_transfers 索引, 不访问链; 翻页时传入上一页最后一条的 block_number/log_index
+    wallet = current_agent.wallet_address.lower()
+    transfers = await crud.get_transfers_for_address(
+        db, wallet, limit=limit, before_block=before_block, before_log_index=before_log_index
+    )
+    return [
+        models.UsdcTransfer(
+            tx_hash=t.tx_hash,
+            log_index=t.log_index,
+            block_number=t.block_number,
+            from_address=t.from_address,
+            to_address=t.to_address,
+            amount=fees.from_micro(t.amount_micro),
+            direction="self" if t.from_address == t.to_address else ("in" if t.to_address == wallet else "out"),
+        )
+        for t in transfers
+    ]
+
+# --- Webhook Endpoints ---
+def _webhook_model(db_webhook, secret: Optional[str] = None) -> models.Webhook:
+    return models.Webhook(
+        id=db_webhook.id,
+        url=db_webhook.url,
+        event_types=db_webhook.event_types.split(",") if db_webhook.event_types else None,
+        active=db_webhook.active,
+        created_at=db_webhook.created_at,
+        secret=secret,
+    )
+
+@app.post("/agents/me/webhooks", response_model=models.Webhook)
+async def register_webhook(
+    webhook: models.WebhookCreate,
+    current_agent: models.Agent = Depends(get_current_agent),
+    db: AsyncSession = Depends(get_db)
+):
+    try:
+        await webhooks.check_url(webhook.url)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    unknown = set(webhook.event_types or []) - set(events.EVENT_TYPES.values())
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown event types: {sorted(unknown)}")
+    if len(await crud.get_webhooks(db, current_agent.id)) >= WEBHOOK_MAX_PER_AGENT:
+        raise HTTPException(status_code=400, detail=f"Too many webhooks (max {WEBHOOK_MAX_PER_AGENT})")
+    # 签名密钥只在注册时返回这一次
+    secret = webhooks.generate_secret()
+    db_webhook = await crud.create_webhook(db, current_agent.id, webhook.url, secret, webhook.event_types)
+    return _webhook_model(db_webhook, secret=secret)
+
+@app.get("/agents/me/webhooks", response_model=List[models.Webhook])
+async def list_webhooks(
+    current_agent: models.Agent = Depends(get_current_agent),
+    db: AsyncSession = Depends(get_db)
+):
+    return [_webhook_model(w) for w in await crud.get_webhooks(db, current_agent.id)]
+
+@app.delete("/agents/me/webhooks/{webhook_id}", status_code=204)
+async def delete_webhook(
+    webhook_id: str,
+    current_agent: models.Agent = Depends(get_current_agent),
+    db: AsyncSession = Depends(get_db)
+):
+    if not await crud.deactivate_webhook(db, webhook_id, "Webhook deleted", agent_id=current_agent.id):
+        raise HTTPException(status_code=404, detail="Webhook not found")
+    return Response(status_code=204)
+
 # --- Task Endpoints ---
 @app.post("/tasks/", response_model=models.Task)
 async def create_task(
     task: models.TaskCreate,
     current_agent: models.Agent = Depends(get_current_agent),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     # 平台收取1%手续费的逻辑将在任务批准时处理
     # 任务发布时，赏金将被"冻结" (概念上)
-    db_task = crud.create_task(db=db, task=task, poster_id=current_agent.id)
+    db_task = await crud.create_task(db=db, task=task, poster_id=current_agent.id)
     return db_task
 
+def _parse_task_batch(body: bytes, content_type: str) -> list:
+    # 支持JSON数组和NDJSON (每行一个TaskCreate); NDJSON中无法解析的行按单条错误返回
+    if "ndjson" in content_type or "jsonl" in content_type:
+        items = []
+        for line in body.splitlines():
+            if not line.strip():
+                continue
+            try:
+                items.append(json.loads(line))
+            except ValueError as e:
+                items.append(e)
+        return items
+    try:
+        items = json.loads(body)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid JSON body: {e}")
+    if not isinstance(items, list):
+        raise HTTPException(status_code=400, detail="Expected a JSON array of tasks")
+    return items
+
+@app.post("/tasks/batch", response_class=StreamingResponse, responses={200: {"model": models.TaskBatchResult}})
+async def create_tasks_batch(
+    request: Request,
+    current_agent: models.Agent = Depends(get_current_agent),
+    db: AsyncSession = Depends(get_db)
+):
+    """批量发布任务: 有效任务在一个事务中插入, 提交后按请求顺序以NDJSON返回每条的结果。"""
+    items = _parse_task_batch(await request.body(), request.headers.get("content-type", ""))
+    if len(items) > TASK_BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Batch too large (max {TASK_BATCH_MAX_ITEMS} tasks)")
+
+    # 一次遍历完成校验, 有效任务在同一个事务中批量插入
+    results = [None] * len(items)
+    valid_tasks, valid_indexes = [], []
+    for index, item in enumerate(items):
+        if isinstance(item, ValueError):
+            results[index] = {"index": index, "status": "error", "errors": [{"msg": f"Invalid JSON: {item}"}]}
+            continue
+        try:
+            valid_tasks.append(models.TaskCreate.model_validate(item))
+            valid_indexes.append(index)
+        except ValidationError as e:
+            results[index] = {"index": index, "status": "error", "errors": json.loads(e.json(include_url=False))}
+
+    task_ids = await crud.create_tasks_bulk(db, valid_tasks, poster_id=current_agent.id)
+    for index, task_id in zip(valid_indexes, task_ids):
+        results[index] = {"index": index, "status": "created", "id": task_id}
+
+    # 结果在事务提交后才全部确定, 这里只是分块序列化NDJSON, 避免一次拼出整个响应体
+    def stream_results(chunk_size: int = 1000):
+        for start in range(0, len(results), chunk_size):
+            yield "".join(json.dumps(result) + "\n" for result in results[start:start + chunk_size])
+
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
+# --- Conditional GET ---
+# 弱ETag来自任务版本号 (每次写入从全局计数器取号): 先只查版本, If-None-Match 命中时直接返回304, 不加载任务行。
+# no-cache: 客户端/代理可以缓存响应, 但每次使用前都要带 If-None-Match 重新验证
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # If-None-Match 使用弱比较: 忽略 W/ 前缀
+    opaque = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == opaque for tag in if_none_match.split(","))
+
+def _set_etag(response: Response, etag: str):
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "no-cache"
+
+def _not_modified(etag: str) -> Response:
+    response = Response(status_code=304)
+    _set_etag(response, etag)
+    return response
+
+TASK_LIST_ADAPTER = TypeAdapter(List[models.Task])
+
+async def _fill_task_list(skip, limit, status, cursor, sort, order) -> cache.CachedResponse:
+    # 在独立的会话中执行: 合并的填充可能比发起它的请求活得更久
+    async with AsyncSessionLocal() as db:
+        # 版本在读取列表之前取得, 期间发生的写入最多让客户端多拉取一次, 不会漏掉变更
+        etag = f'W/"tasks-{await crud.get_task_board_version(db)}"'
+        next_cursor = None
+        # 兼容旧客户端的offset分页; 新客户端应使用响应头 X-Next-Cursor 中的游标翻页
+        if skip and not cursor:
+            tasks = await crud.get_tasks(db, skip=skip, limit=limit, status=status)
+        else:
+            tasks, next_cursor = await crud.get_tasks_page(db, limit=limit, status=status, cursor=cursor, sort=sort, order=order)
+    body = TASK_LIST_ADAPTER.dump_json(TASK_LIST_ADAPTER.validate_python(tasks, from_attributes=True))
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if next_cursor:
+        headers["X-Next-Cursor"] = next_cursor
+    return cache.CachedResponse(body, headers, etag)
+
 @app.get("/tasks/", response_model=List[models.Task])
-async def read_tasks(skip: int = 0, limit: int = 100, status: Optional[str] = None, db: Session = Depends(get_db)):
-    tasks = crud.get_tasks(db, skip=skip, limit=limit, status=status)
-    return tasks
+async def read_tasks(
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=TASK_LIST_MAX_LIMIT),
+    status: Optional[models.TaskStatus] = None,
+    cursor: Optional[str] = None,
+    sort: Literal["created_at", "amount", "deadline_at"] = "created_at",
+    order: Literal["asc", "desc"] = "asc",
+    if_none_match: Optional[str] = Header(None),
+):
+    # 列表的ETag是整个任务板的版本: 任何任务变化都会使所有列表失效, 但判断只需要一次索引查找。
+    # 响应体按规范化后的参数缓存为已序列化的bytes (见 cache.py), 命中时不访问数据库。
+    # 不使用请求级的会话: 未命中时填充会另开一个连接, 请求不应在等待它的同时占着另一个连接
+    key = ("tasks", skip, limit, status, cursor, sort, order)
+    cached = cache.task_list_cache.get(key)
+    if cached is None and if_none_match:
+        async with AsyncSessionLocal() as db:
+            etag = f'W/"tasks-{await crud.get_task_board_version(db)}"'
+        if _etag_matches(if_none_match, etag):
+            return _not_modified(etag)
+    try:
+        cached = cached or await cache.task_list_cache.get_or_fill(
+            key, lambda: _fill_task_list(skip, limit, status, cursor, sort, order)
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if _etag_matches(if_none_match, cached.etag):
+        return _not_modified(cached.etag)
+    return Response(content=cached.body, media_type="application/json", headers=cached.headers)
+
+@app.get("/tasks/multi", response_model=List[models.Task])
+async def read_tasks_by_ids(
+    response: Response,
+    ids: str = Query(..., description="Comma-separated task ids"),
+    if_none_match: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_db)
+):
+    # 按请求顺序返回存在的任务; ETag由每个id的版本组成 (不存在的任务也参与, 出现后ETag随之变化)
+    task_ids = list(dict.fromkeys(i.strip() for i in ids.split(",") if i.strip()))
+    if not task_ids:
+        raise HTTPException(status_code=400, detail="ids must not be empty")
+    if len(task_ids) > TASK_MULTI_GET_MAX:
+        raise HTTPException(status_code=400, detail=f"At most {TASK_MULTI_GET_MAX} ids per request")
+    versions = await crud.get_task_versions(db, task_ids)
+    digest = hashlib.sha256(",".join(f"{i}:{versions.get(i, '-')}" for i in task_ids).encode()).hexdigest()[:32]
+    etag = f'W/"tasks-{digest}"'
+    if _etag_matches(if_none_match, etag):
+        return _not_modified(etag)
+    _set_etag(response, etag)
+    tasks = {task.id: task for task in await crud.get_tasks_by_ids(db, [i for i in task_ids if i in versions])}
+    return [tasks[i] for i in task_ids if i in tasks]
+
+@app.get("/tasks/search", response_model=List[models.TaskSearchResult])
+async def search_tasks(
+    q: str,
+    status: Optional[models.TaskStatus] = None,
+    limit: int = Query(20, ge=1, le=100),
+    db: AsyncSession = Depends(get_db)
+):
+    hits = await search.search_tasks(db, q, status=status, limit=limit)
+    return [
+        models.TaskSearchResult.model_validate(
+            {**models.Task.model_validate(task).model_dump(), "snippet": snippet, "score": score}
+        )
+        for task, snippet, score in hits
+    ]
+
+@app.get("/tasks/{task_id}", response_model=models.Task)
+async def read_task(
+    task_id: str,
+    response: Response,
+    if_none_match: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_db)
+):
+    version = await crud.get_task_version(db, task_id)
+    if version is None:
+        raise HTTPException(status_code=404, detail="Task not found")
+    etag = f'W/"task-{task_id}-{version}"'
+    if _etag_matches(if_none_match, etag):
+        return _not_modified(etag)
+    db_task = await crud.get_task(db, task_id)
+    if db_task is None:
+        raise HTTPException(status_code=404, detail="Task not found")
+    # 响应头使用实际返回的行的版本 (两次查询之间可能有写入)
+    _set_etag(response, f'W/"task-{task_id}-{db_task.version}"')
+    return db_task
+
+@app.post("/tasks/claim-next", response_model=models.Task)
+async def claim_next_task(
+    request: Optional[models.ClaimNextRequest] = None,
+    current_agent: models.Agent = Depends(get_current_agent),
+    db: AsyncSession = Depends(get_db)
+):
+    # 服务端直接分配一个任务, 按发布者加权公平派发, Agent之间不再竞争同一个任务
+    request = request or models.ClaimNextRequest()
+    db_task = await dispatch.claim_next(
+        db,
+        claimer_id=current_agent.id,
+        min_amount=request.min_amount,
+        deadline_horizon_minutes=request.deadline_horizon_minutes,
+    )
+    if not db_task:
+        raise HTTPException(status_code=404, detail="No open task matches the filters")
+    return db_task
 
 @app.post("/tasks/{task_id}/claim", response_model=models.Task)
 async def claim_task(
     task_id: str,
     current_agent: models.Agent = Depends(get_current_agent),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    db_task = crud.get_task(db, task_id)
-    if not db_task:
-        raise HTTPException(status_code=404, detail="Task not found")
-    if db_task.status != "open":
-        raise HTTPException(status_code=400, detail="Task is not open for claiming")
-    if db_task.claimer_id:
-        raise HTTPException(status_code=400, detail="Task already claimed")
-    
     # 这里需要实现Agent质押USDC的逻辑
     # 质押金额 = db_task.amount * 0.1 (10% stake)
     # 模拟质押 (实际需要与区块链交互)
     # await blockchain.approve_usdc(current_agent.private_key, PLATFORM_CONTRACT_ADDRESS, stake_amount)
     # await blockchain.transfer_usdc(current_agent.private_key, PLATFORM_CONTRACT_ADDRESS, stake_amount)
-    
-    updated_task = crud.update_task_status(db, task_id=task_id, new_status="claimed", claimer_id=current_agent.id)
+
+    # 单条条件UPDATE完成认领, 并发认领同一任务时只有一个Agent会成功
+    updated_task = await crud.claim_task(db, task_id=task_id, claimer_id=current_agent.id)
+    if not updated_task:
+        # 只有失败路径才需要再读一次, 用于返回准确的错误
+        db_task = await crud.get_task(db, task_id)
+        if not db_task:
+            raise HTTPException(status_code=404, detail="Task not found")
+        if db_task.status != "open":
+            raise HTTPException(status_code=400, detail="Task is not open for claiming")
+        raise HTTPException(status_code=400, detail="Task already claimed")
     return updated_task
 
 @app.post("/tasks/{task_id}/submit", response_model=models.Task)
@@ -106,9 +440,9 @@ async def submit_task(
     task_id: str,
     submission: models.TaskSubmission,
     current_agent: models.Agent = Depends(get_current_agent),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    db_task = crud.get_task(db, task_id)
+    db_task = await crud.get_task(db, task_id)
     if not db_task:
         raise HTTPException(status_code=404, detail="Task not found")
     if db_task.claimer_id != current_agent.id:
@@ -116,7 +450,7 @@ async def submit_task(
     if db_task.status != "claimed":
         raise HTTPException(status_code=400, detail="Task is not in claimed state")
     
-    updated_task = crud.submit_task_work(db, task_id=task_id, submission_content=submission.content)
+    updated_task = await crud.submit_task_work(db, task_id=task_id, submission_content=submission.content)
     return updated_task
 
 @app.post("/tasks/{task_id}/review", response_model=models.Task)
@@ -124,9 +458,9 @@ async def review_task(
     task_id: str,
     review: models.TaskReview,
     current_agent: models.Agent = Depends(get_current_agent),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    db_task = crud.get_task(db, task_id)
+    db_task = await crud.get_task(db, task_id)
     if not db_task:
         raise HTTPException(status_code=404, detail="Task not found")
     if db_task.poster_id != current_agent.id:
@@ -135,37 +469,139 @@ async def review_task(
         raise HTTPException(status_code=400, detail="Task is not in submitted state")
     
     if review.approved:
-        # --- 支付逻辑 (包括手续费) ---
-        platform_fee_rate = 0.01 # 1%
-        platform_fee_amount = db_task.amount * platform_fee_rate
-        bounty_amount_to_claimer = db_task.amount - platform_fee_amount
-        
-        # 实际的区块链转账操作
-        # 这里需要从发布者的钱包转账，因此需要发布者的私钥，这在生产环境中是敏感且需要安全处理的
-        # 为了演示，我们暂时假设可以通过平台私钥来发起
-        try:
-            # 假设PLATFORM_PRIVATE_KEY拥有足够的USDC和ETH
-            # 生产环境应该从poster的钱包中转出
-            tx_info = await blockchain.transfer_usdc(
-                blockchain.PLATFORM_PRIVATE_KEY, # 实际应是poster的私钥
-                db_task.claimer.wallet_address,
-                bounty_amount_to_claimer,
-                platform_fee_amount
-            )
-            # 记录交易
-            crud.create_transaction(db, models.TransactionCreate(
-                task_id=task_id,
-                from_address=current_agent.wallet_address, # 实际应是poster的钱包地址
-                to_address=db_task.claimer.wallet_address,
-                amount=bounty_amount_to_claimer,
-                fee_amount=platform_fee_amount,
-                fee_recipient_address=blockchain.PLATFORM_FEE_RECIPIENT_ADDRESS
-            ), tx_hash=tx_info["bounty_tx_hash"])
-
-            updated_task = crud.update_task_status(db, task_id=task_id, new_status="approved")
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Blockchain transaction failed: {e}")
+        # --- 支付逻辑 (包括手续费, 按整数micro-USDC计算) ---
+        bounty_micro, fee_micro = fees.split_fee(fees.to_micro(db_task.amount))
+
+        # 审核通过与待支付记录在同一个事务中写入; 链上转账由settlement worker异步完成,
+        # 审核请求不再等待出块
+        updated = await crud.apply_task_reviews(db, [task_id], [], [{
+            "task_id": task_id,
+            "from_address": current_agent.wallet_address, # 实际应是poster的钱包地址
+            "to_address": db_task.claimer.wallet_address,
+            "amount": fees.from_micro(bounty_micro),
+            "fee_amount": fees.from_micro(fee_micro),
+            "fee_recipient_address": blockchain.PLATFORM_FEE_RECIPIENT_ADDRESS,
+        }])
     else:
-        updated_task = crud.update_task_status(db, task_id=task_id, new_status="rejected")
+        updated = await crud.apply_task_reviews(db, [], [task_id], [])
+    if task_id not in updated:
+        raise HTTPException(status_code=400, detail="Task is not in submitted state")
+    updated_task = await crud.get_task(db, task_id)
     
     return updated_task
+
+@app.post("/tasks/review-batch", response_model=List[models.TaskReviewResult])
+async def review_tasks_batch(
+    batch: models.TaskReviewBatch,
+    current_agent: models.Agent = Depends(get_current_agent),
+    db: AsyncSession = Depends(get_db)
+):
+    results = {}
+    tasks_by_id = {t.id: t for t in await crud.get_tasks_by_ids(db, [item.task_id for item in batch.items])}
+    approved, rejected = [], []
+    for item in batch.items:
+        db_task = tasks_by_id.get(item.task_id)
+        if item.task_id in results:
+            detail = "Duplicate task in batch"
+        elif not db_task:
+            detail = "Task not found"
+        elif db_task.poster_id != current_agent.id:
+            detail = "Only the task poster can review"
+        elif db_task.status != "submitted":
+            detail = "Task is not in submitted state"
+        else:
+            (approved if item.approved else rejected).append(db_task)
+            results[item.task_id] = None
+            continue
+        results.setdefault(item.task_id, models.TaskReviewResult(task_id=item.task_id, status="error", detail=detail))
+
+    # 手续费和赏金按整数micro-USDC一次性计算
+    payouts, platform_fees = fees.split_fees([fees.to_micro(t.amount) for t in approved])
+
+    transactions = [
+        {
+            "task_id": db_task.id,
+            "from_address": current_agent.wallet_address, # 实际应是poster的钱包地址
+            "to_address": db_task.claimer.wallet_address,
+            "amount": fees.from_micro(payout),
+            "fee_amount": fees.from_micro(fee),
+            "fee_recipient_address": blockchain.PLATFORM_FEE_RECIPIENT_ADDRESS,
+        }
+        for db_task, payout, fee in zip(approved, payouts, platform_fees)
+    ]
+
+    # 所有状态变更和待支付记录在一个数据库事务中写入;
+    # settlement worker 会把同一认领者的多笔赏金合并为一次转账
+    approved_ids = {t.id for t in approved}
+    updated = await crud.apply_task_reviews(db, list(approved_ids), [t.id for t in rejected], transactions)
+    for task_id in [t.id for t in approved + rejected]:
+        if task_id not in updated:
+            results[task_id] = models.TaskReviewResult(task_id=task_id, status="error", detail="Task is not in submitted state")
+        else:
+            new_status = "approved" if task_id in approved_ids else "rejected"
+            results[task_id] = models.TaskReviewResult(task_id=task_id, status=new_status)
+    return list(results.values())
+
+# --- Task Event Stream ---
+def _task_subscription(status: Optional[str], poster_id: Optional[str], min_amount: Optional[float]):
+    return events.Subscription(statuses=events.parse_statuses(status), poster_id=poster_id, min_amount=min_amount)
+
+@app.get("/events/tasks", response_class=StreamingResponse)
+async def stream_task_events(
+    request: Request,
+    status: Optional[str] = None, # 逗号分隔, 按任务的新状态过滤: open,claimed,submitted,approved,rejected
+    poster_id: Optional[str] = None,
+    min_amount: Optional[float] = None,
+    last_event_id: Optional[str] = Header(None, alias="Last-Event-ID"),
+):
+    # Server-Sent Events; EventSource断线重连时自动带上 Last-Event-ID, 从环形缓冲区补发错过的事件
+    subscription, reset = events.broker.subscribe(_task_subscription(status, poster_id, min_amount), last_event_id)
+
+    async def stream():
+        try:
+            yield "retry: 3000\n\n"
+            if reset:
+                yield "event: reset\ndata: {}\n\n"
+            while not subscription.evicted:
+                event = await subscription.next(timeout=events.EVENT_HEARTBEAT_INTERVAL)
+                if event is not None:
+                    yield event.to_sse()
+                elif await request.is_disconnected():
+                    break
+                elif not subscription.evicted:
+                    yield ": ping\n\n"
+            if subscription.evicted:
+                yield "event: evicted\ndata: {}\n\n"
+        finally:
+            events.broker.unsubscribe(subscription)
+
+    return StreamingResponse(
+        stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.websocket("/events/tasks/ws")
+async def task_events_websocket(
+    websocket: WebSocket,
+    status: Optional[str] = None,
+    poster_id: Optional[str] = None,
+    min_amount: Optional[float] = None,
+    last_event_id: Optional[str] = Query(None),
+):
+    # 每条消息: {"id", "event", "data"}; 重连时用最后收到的id作为 ?last_event_id= 续传
+    await websocket.accept()
+    subscription, reset = events.broker.subscribe(_task_subscription(status, poster_id, min_amount), last_event_id)
+    try:
+        if reset:
+            await websocket.send_text(json.dumps({"id": None, "event": "reset", "data": {}}))
+        while not subscription.evicted:
+            event = await subscription.next(timeout=events.EVENT_HEARTBEAT_INTERVAL)
+            if event is not None:
+                await websocket.send_text(event.to_json())
+            elif not subscription.evicted:
+                await websocket.send_text(json.dumps({"id": None, "event": "ping", "data": {}}))
+        await websocket.send_text(json.dumps({"id": None, "event": "evicted", "data": {}}))
+        await websocket.close(code=1013) # try again later
+    except WebSocketDisconnect:
+        pass
+    finally:
+        events.broker.unsubscribe(subscription)
@@ -0,0 +1,283 @@
+"""
+Versioned schema migrations.
+
+init_db() 先执行 create_all (只会创建缺失的表), 再按版本号顺序执行这里尚未应用的迁移,
+并记录到 schema_migrations 表。迁移必须是幂等的: 新库由 create_all 直接建出最新结构,
+迁移在新库上应当是空操作, 在旧的 sql_app.db 上补齐缺失的索引/列。
+
+用法:
+    python -m app.migrations upgrade   # 应用所有待执行迁移
+    python -m app.migrations status    # 查看已应用/待执行的迁移
+    python -m app.migrations explain   # 打印 crud.py 中热点查询的执行计划
+"""
+import argparse
+from datetime import datetime
+from typing import Callable, List, NamedTuple
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, inspect, select, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import IntegrityError
+
+migration_metadata = MetaData()
+
+schema_migrations = Table(
+    "schema_migrations",
+    migration_metadata,
+    Column("version", Integer, primary_key=True),
+    Column("name", String, nullable=False),
+    Column("applied_at", DateTime, default=datetime.utcnow),
+)
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    upgrade: Callable[[Connection], None]
+    # False: 在事务外执行 (例如PostgreSQL的 CREATE INDEX CONCURRENTLY 不能在事务中运行)
+    transactional: bool = True
+
+# --- 迁移辅助函数 ---
+def _concurrently(conn: Connection) -> str:
+    # 只有在事务外 (transactional=False 的迁移) 才能使用 CONCURRENTLY
+    autocommit = conn.get_execution_options().get("isolation_level") == "AUTOCOMMIT"
+    return "CONCURRENTLY " if conn.dialect.name == "postgresql" and autocommit else ""
+
+def create_index(conn: Connection, name: str, table: str, columns: List[str], unique: bool = False):
+    # SQLite: 建索引只持有写锁, WAL模式下读请求不受影响, 无需导出/重建数据库
+    # PostgreSQL: CONCURRENTLY 在线建索引, 不阻塞写入
+    unique_sql = "UNIQUE " if unique else ""
+    concurrently = _concurrently(conn)
+    conn.exec_driver_sql(
+        f"CREATE {unique_sql}INDEX {concurrently}IF NOT EXISTS {name} ON {table} ({', '.join(columns)})"
+    )
+
+def drop_index(conn: Connection, name: str):
+    concurrently = _concurrently(conn)
+    conn.exec_driver_sql(f"DROP INDEX {concurrently}IF EXISTS {name}")
+
+def has_column(conn: Connection, table: str, column: str) -> bool:
+    return column in {c["name"] for c in inspect(conn).get_columns(table)}
+
+def datetime_sql(conn: Connection) -> str:
+    return "DATETIME" if conn.dialect.name == "sqlite" else "TIMESTAMP"
+
+def add_column(conn: Connection, table: str, column_ddl: str):
+    column = column_ddl.split()[0]
+    if not has_column(conn, table, column):
+        conn.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {column_ddl}")
+
+# --- 迁移定义 ---
+def _hot_query_indexes(conn: Connection):
+    create_index(conn, "ix_tasks_status_created_at", "tasks", ["status", "created_at"])
+    create_index(conn, "ix_tasks_created_at", "tasks", ["created_at"])
+    create_index(conn, "ix_tasks_deadline_at", "tasks", ["deadline_at"])
+    create_index(conn, "ix_tasks_poster_id", "tasks", ["poster_id"])
+    create_index(conn, "ix_tasks_claimer_id", "tasks", ["claimer_id"])
+    create_index(conn, "ix_transactions_task_id", "transactions", ["task_id"])
+
+def _keyset_pagination_indexes(conn: Connection):
+    # keyset分页按 (key, id) 排序, 索引末尾带上id才能避免额外排序
+    for key in ("created_at", "amount", "deadline_at"):
+        create_index(conn, f"ix_tasks_status_{key}_id", "tasks", ["status", key, "id"])
+        create_index(conn, f"ix_tasks_{key}_id", "tasks", [key, "id"])
+    # 已被上面的复合索引覆盖 (前缀相同)
+    drop_index(conn, "ix_tasks_status_created_at")
+    drop_index(conn, "ix_tasks_created_at")
+    drop_index(conn, "ix_tasks_deadline_at")
+
+def _claim_next_index(conn: Connection):
+    create_index(conn, "ix_tasks_status_poster_id_amount", "tasks", ["status", "poster_id", "amount DESC", "created_at"])
+
+def _hash_api_keys(conn: Connection):
+    from .auth import hash_api_key
+    add_column(conn, "agents", "api_key_hash VARCHAR")
+    if has_column(conn, "agents", "api_key"):
+        rows = conn.exec_driver_sql("SELECT id, api_key FROM agents WHERE api_key IS NOT NULL").fetchall()
+        for agent_id, api_key in rows:
+            conn.execute(
+                text("UPDATE agents SET api_key_hash = :key_hash WHERE id = :id"),
+                {"key_hash": hash_api_key(api_key), "id": agent_id},
+            )
+        # 清除明文Key (列保留, 避免在SQLite上重建表)
+        conn.exec_driver_sql("UPDATE agents SET api_key = NULL")
+    create_index(conn, "ix_agents_api_key_hash", "agents", ["api_key_hash"], unique=True)
+
+def _task_search_index(conn: Connection):
+    # FTS5外部内容表, 只存倒排索引; 触发器在insert/update/delete时同步 (只有标题/描述变化才重建该行)
+    if conn.dialect.name != "sqlite":
+        return
+    conn.exec_driver_sql(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS tasks_fts USING fts5("
+        "title, description, content='tasks', content_rowid='rowid', tokenize='unicode61 remove_diacritics 2')"
+    )
+    conn.exec_driver_sql("""
+        CREATE TRIGGER IF NOT EXISTS tasks_fts_ai AFTER INSERT ON tasks BEGIN
+            INSERT INTO tasks_fts(rowid, title, description) VALUES (new.rowid, new.title, new.description);
+        END
+    """)
+    conn.exec_driver_sql("""
+        CREATE TRIGGER IF NOT EXISTS tasks_fts_ad AFTER DELETE ON tasks BEGIN
+            INSERT INTO tasks_fts(tasks_fts, rowid, title, description) VALUES ('delete', old.rowid, old.title, old.description);
+        END
+    """)
+    conn.exec_driver_sql("""
+        CREATE TRIGGER IF NOT EXISTS tasks_fts_au AFTER UPDATE OF title, description ON tasks BEGIN
+            INSERT INTO tasks_fts(tasks_fts, rowid, title, description) VALUES ('delete', old.rowid, old.title, old.description);
+            INSERT INTO tasks_fts(rowid, title, description) VALUES (new.rowid, new.title, new.description);
+        END
+    """)
+    # 为已有任务建立索引
+    conn.exec_driver_sql("INSERT INTO tasks_fts(tasks_fts) VALUES ('rebuild')")
+
+def _payout_outbox(conn: Connection):
+    timestamp = datetime_sql(conn)
+    add_column(conn, "transactions", "platform_fee_tx_hash VARCHAR")
+    add_column(conn, "transactions", "attempts INTEGER NOT NULL DEFAULT 0")
+    add_column(conn, "transactions", f"next_attempt_at {timestamp}")
+    add_column(conn, "transactions", f"locked_until {timestamp}")
+    add_column(conn, "transactions", "last_error VARCHAR")
+    add_column(conn, "transactions", f"submitted_at {timestamp}")
+    add_column(conn, "transactions", f"completed_at {timestamp}")
+    create_index(conn, "ix_transactions_status_next_attempt_at", "transactions", ["status", "next_attempt_at"])
+
+def _fee_ledger(conn: Connection):
+    # fee_accruals/fee_sweeps 表由 create_all 创建; 这里为尚未广播的pending支付补记手续费,
+    # 这些交易之后由worker只支付赏金, 手续费进入归集
+    conn.exec_driver_sql("""
+        INSERT INTO fee_accruals (task_id, transaction_id, amount_micro, created_at)
+        SELECT t.task_id, t.id, CAST(ROUND(t.fee_amount * 1000000) AS INTEGER), t.created_at
+        FROM transactions t
+        WHERE t.status = 'pending' AND t.tx_hash IS NULL AND t.fee_amount > 0
+          AND NOT EXISTS (SELECT 1 FROM fee_accruals a WHERE a.transaction_id = t.id)
+    """)
+
+def _confirmation_tracker(conn: Connection):
+    add_column(conn, "transactions", "block_number INTEGER")
+    add_column(conn, "transactions", "block_hash VARCHAR")
+    create_index(conn, "ix_transactions_tx_hash", "transactions", ["tx_hash"])
+
+def _task_versions(conn: Connection):
+    # 已有任务的版本为0; 计数器从当前最大版本开始
+    add_column(conn, "tasks", "version INTEGER NOT NULL DEFAULT 0")
+    create_index(conn, "ix_tasks_version", "tasks", ["version"])
+    conn.exec_driver_sql("""
+        INSERT INTO counters (name, value)
+        SELECT 'task_version', COALESCE(MAX(version), 0) FROM tasks
+        WHERE NOT EXISTS (SELECT 1 FROM counters WHERE name = 'task_version')
+    """)
+
+def _signed_outbox(conn: Connection):
+    # 已签名交易与nonce随outbox行一起保存; 旧的 stuck_nonce/stuck_since 列不再使用, 保留在旧库中无害
+    add_column(conn, "transactions", "nonce INTEGER")
+    add_column(conn, "transactions", "raw_tx VARCHAR")
+    add_column(conn, "transactions", f"broadcast_at {datetime_sql(conn)}")
+
+def _approval_outbox(conn: Connection):
+    add_column(conn, "transactions", "kind VARCHAR NOT NULL DEFAULT 'payout'")
+
+MIGRATIONS: List[Migration] = [
+    Migration(1, "hot_query_indexes", _hot_query_indexes, transactional=False),
+    Migration(2, "keyset_pagination_indexes", _keyset_pagination_indexes, transactional=False),
+    Migration(3, "claim_next_index", _claim_next_index, transactional=False),
+    Migration(4, "hash_api_keys", _hash_api_keys),
+    Migration(5, "task_search_index", _task_search_index),
+    Migration(6, "payout_outbox", _payout_outbox),
+    Migration(7, "fee_ledger", _fee_ledger),
+    Migration(8, "confirmation_tracker", _confirmation_tracker),
+    Migration(9, "task_versions", _task_versions),
+    Migration(10, "signed_outbox", _signed_outbox),
+    Migration(11, "approval_outbox", _approval_outbox),
+]
+
+# --- 执行 ---
+def applied_versions(engine: Engine) -> set:
+    with engine.connect() as conn:
+        return set(conn.execute(select(schema_migrations.c.version)).scalars())
+
+def upgrade(engine: Engine) -> List[Migration]:
+    migration_metadata.create_all(bind=engine)
+    done = applied_versions(engine)
+    applied = []
+    for migration in sorted(MIGRATIONS, key=lambda m: m.version):
+        if migration.version in done:
+            continue
+        if migration.transactional:
+            with engine.begin() as conn:
+                migration.upgrade(conn)
+        else:
+            with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+                migration.upgrade(conn)
+        try:
+            with engine.begin() as conn:
+                conn.execute(schema_migrations.insert().values(
+                    version=migration.version, name=migration.name, applied_at=datetime.utcnow()
+                ))
+        except IntegrityError:
+            pass # 其他worker进程同时完成了同一迁移 (迁移本身是幂等的)
+        applied.append(migration)
+    return applied
+
+# --- 查询计划 ---
+def hot_queries():
+    # 直接使用 crud 中的查询构造函数, 计划与实际执行的查询一致; 新增热点查询时一并加到这里
+    from datetime import datetime
+    from . import crud, database
+    TaskDB, TransactionDB = database.TaskDB, database.TransactionDB
+    after = (datetime(2026, 1, 1), "task-id")
+    return {
+        "crud.get_tasks (status)": crud.tasks_query(status="open"),
+        "crud.get_tasks": crud.tasks_query(),
+        "crud.get_tasks_page (status, cursor)": crud.task_page_query(101, "open", after=after),
+        "crud.get_tasks_page (amount desc)": crud.task_page_query(101, "open", sort="amount", order="desc"),
+        "crud.get_tasks_page (null deadline segment)": crud.task_page_query(
+            101, "open", sort="deadline_at", after=(None, "task-id"), null_segment=True),
+        "crud.get_open_poster_ids": crud.open_poster_ids_query(),
+        "crud.claim_next_task (poster)": crud.claim_candidate_query("agent-id", poster_id="poster-id", min_amount=1.0),
+        "crud.get_task": crud.task_query("task-id"),
+        "crud.get_task_board_version": crud.task_board_version_query(),
+        "crud.get_agent_by_api_key_hash": crud.agent_by_api_key_hash_query("key-hash"),
+        # 外键查找 (迁移1的索引)
+        "tasks by poster": select(TaskDB).filter(TaskDB.poster_id == "agent-id"),
+        "tasks by claimer": select(TaskDB).filter(TaskDB.claimer_id == "agent-id"),
+        "transactions by task": select(TransactionDB).filter(TransactionDB.task_id == "task-id"),
+    }
+
+def explain(engine: Engine, statement) -> List[str]:
+    with engine.connect() as conn:
+        compiled = statement.compile(dialect=conn.dialect)
+        if compiled.positional:
+            params = tuple(compiled.params[name] for name in compiled.positiontup)
+        else:
+            params = compiled.params
+        prefix = "EXPLAIN QUERY PLAN " if conn.dialect.name == "sqlite" else "EXPLAIN "
+        rows = conn.exec_driver_sql(prefix + str(compiled), params).fetchall()
+    if engine.dialect.name == "sqlite":
+        return [row[-1] for row in rows] # (id, parent, notused, detail)
+    return [" ".join(str(col) for col in row) for row in rows]
+
+def main(argv=None):
+    from . import database
+
+    parser = argparse.ArgumentParser(prog="python -m app.migrations", description="AgentTaskHub schema migrations")
+    parser.add_argument("command", choices=["upgrade", "status", "explain"])
+    args = parser.parse_args(argv)
+
+    if args.command == "upgrade":
+        database.Base.metadata.create_all(bind=database.engine)
+        applied = upgrade(database.engine)
+        for migration in applied:
+            print(f"applied {migration.version:04d} {migration.name}")
+        print(f"schema up to date ({len(applied)} applied)")
+    elif args.command == "status":
+        migration_metadata.create_all(bind=database.engine)
+        done = applied_versions(database.engine)
+        for migration in sorted(MIGRATIONS, key=lambda m: m.version):
+            state = "applied" if migration.version in done else "pending"
+            print(f"{migration.version:04d} {migration.name:<32} {state}")
+    else:
+        for name, statement in hot_queries().items():
+            print(f"-- {name}")
+            for line in explain(database.engine, statement):
+                print(f"   {line}")
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
-from typing import Optional, List
+import os
+from typing import Literal, Optional, List
 from pydantic import BaseModel, Field
 from datetime import datetime
 
@@ -12,7 +13,7 @@ class AgentCreate(AgentBase):
 
 class AgentInDBBase(AgentBase):
     id: str
-    api_key: str
+    api_key: Optional[str] = None # 只在注册时返回, 数据库中仅保存哈希
     wallet_address: str
     referral_code: str
     created_at: datetime
@@ -23,6 +24,27 @@ class AgentInDBBase(AgentBase):
 class Agent(AgentInDBBase):
     pass
 
+class UsdcTransfer(BaseModel):
+    tx_hash: str
+    log_index: int
+    block_number: int
+    from_address: str
+    to_address: str
+    amount: float # USDC
+    direction: str # in, out, self
+
+class AgentBalanceRequest(BaseModel):
+    agent_ids: List[str] = Field(..., min_length=1)
+
+class AgentBalance(BaseModel):
+    agent_id: str
+    wallet_address: str
+    balance: Optional[float] = None # USDC; 钱包地址无效或查询失败时为None
+
+class AgentBalances(BaseModel):
+    block_number: int # 余额对应的区块高度
+    balances: List[AgentBalance]
+
 # --- Task Models ---
 class TaskBase(BaseModel):
     title: str = Field(..., example="Summarize this article")
@@ -33,6 +55,14 @@ class TaskBase(BaseModel):
 class TaskCreate(TaskBase):
     pass
 
+class TaskBatchResult(BaseModel):
+    index: int # 请求中的位置
+    status: str # created, error
+    id: Optional[str] = None
+    errors: Optional[list] = None
+
+TaskStatus = Literal["open", "claimed", "submitted", "approved", "rejected"]
+
 class TaskUpdate(BaseModel):
     title: Optional[str] = None
     description: Optional[str] = None
@@ -49,6 +79,7 @@ class TaskInDBBase(TaskBase):
     submission_content: Optional[str] = None
     approved_at: Optional[datetime] = None
     rejected_at: Optional[datetime] = None
+    version: int = 0 # 每次修改都会增大, 与ETag对应
 
     class Config:
         from_attributes = True
@@ -56,6 +87,10 @@ class TaskInDBBase(TaskBase):
 class Task(TaskInDBBase):
     pass
 
+class TaskSearchResult(Task):
+    snippet: str # 匹配片段, 命中词用 <mark></mark> 高亮
+    score: float # 相关度, 越大越相关
+
 # --- Transaction Models ---
 class TransactionBase(BaseModel):
     task_id: str
@@ -85,11 +120,44 @@ class APIKeyResponse(BaseModel):
     api_key: str
     message: str = "Please save this API key securely. It will not be shown again."
 
+# --- Webhook Models ---
+class WebhookCreate(BaseModel):
+    url: str = Field(..., example="https://agent.example.com/hooks/agenttaskhub")
+    event_types: Optional[List[str]] = Field(None, example=["task.submitted", "task.approved"]) # 为空表示全部事件
+
+class Webhook(BaseModel):
+    id: str
+    url: str
+    event_types: Optional[List[str]] = None
+    active: bool
+    created_at: datetime
+    secret: Optional[str] = None # 签名密钥, 只在注册时返回
+
 # --- Task Submission Model ---
 class TaskSubmission(BaseModel):
     content: str = Field(..., example="Here is the 5 bullet points summary...")
 
+# --- Claim Next Task Model ---
+class ClaimNextRequest(BaseModel):
+    min_amount: Optional[float] = Field(None, gt=0, example=2.0)
+    deadline_horizon_minutes: Optional[int] = Field(None, gt=0, example=60) # 只派发截止时间晚于 now + horizon 的任务
+
 # --- Task Approval/Rejection Model ---
 class TaskReview(BaseModel):
     approved: bool
     feedback: Optional[str] = None
+
+# --- Batch Review Models ---
+class TaskReviewItem(TaskReview):
+    task_id: str
+
+# 审核批次在一个事务中更新任务并写入支付记录, 上限比 /tasks/batch (TASK_BATCH_MAX_ITEMS) 小得多
+TASK_REVIEW_BATCH_MAX_ITEMS = int(os.getenv("TASK_REVIEW_BATCH_MAX_ITEMS", "1000"))
+
+class TaskReviewBatch(BaseModel):
+    items: List[TaskReviewItem] = Field(..., min_length=1, max_length=TASK_REVIEW_BATCH_MAX_ITEMS)
+
+class TaskReviewResult(BaseModel):
+    task_id: str
+    status: str # approved, rejected, error
+    detail: Optional[str] = None
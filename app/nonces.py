@@ -0,0 +1,114 @@
+"""
+Nonce allocation for the platform signer.
+
+每次转账前读取 get_transaction_count(pending) 的做法无法支持并发: 两笔同时发起的转账会拿到同一个nonce。
+这里在数据库 signer_nonces 表中为每个签名地址维护 next_nonce, 通过比较并交换 (CAS) 的UPDATE分配,
+因此同一进程内的多个线程/协程以及多个worker进程都不会拿到重复的nonce, 多笔支付可以同时在mempool中等待确认。
+
+与链上状态的同步:
+- 链上pending nonce大于本地值 (例如钱包被外部使用) 时直接跳到链上的值;
+- reserve(assign=...) 在分配nonce的同一个数据库事务中回调 assign(conn, nonces): settlement用它把签好的交易
+  (nonce, raw_tx) 写到outbox行上。分配和记录要么都提交要么都回滚, 不存在 "nonce已分配但没有对应交易" 的状态;
+  已分配的nonce永远属于这笔交易, 交易丢失时由确认跟踪器重新广播同一笔交易 (或在同一nonce上提价替换),
+  而不是把nonce交给另一笔支付;
+- release() 只用于不经过outbox的发送 (assign=None): 节点明确拒绝时回收末尾的nonce。
+"""
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Callable, List, Optional
+
+from sqlalchemy import select, update
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import IntegrityError
+
+from . import database
+
+NONCE_SYNC_INTERVAL = float(os.getenv("NONCE_SYNC_INTERVAL", "10")) # 链上pending nonce的刷新间隔 (秒)
+NONCE_CAS_RETRIES = 50
+
+class NonceManager:
+    def __init__(self, address: str, fetch_pending_nonce: Callable[[str], int], engine: Optional[Engine] = None):
+        self.address = address
+        self._fetch_pending_nonce = fetch_pending_nonce
+        self._engine = engine or database.engine
+        self._table = database.SignerNonceDB.__table__
+        # reserve() 在区块链线程池中调用, 用线程锁串行化本进程内的分配; 跨进程依赖数据库CAS
+        self._lock = threading.Lock()
+        self._chain_nonce: Optional[int] = None
+        self._synced_at = 0.0
+
+    def _chain_pending_nonce(self, force: bool = False) -> int:
+        now = time.monotonic()
+        if force or self._chain_nonce is None or now - self._synced_at > NONCE_SYNC_INTERVAL:
+            self._chain_nonce = self._fetch_pending_nonce(self.address)
+            self._synced_at = now
+        return self._chain_nonce
+
+    def resync(self):
+        """下一次分配前重新读取链上的pending nonce (例如节点返回 nonce too low)。"""
+        with self._lock:
+            self._chain_nonce = None
+
+    def _load(self):
+        with self._engine.begin() as conn:
+            return conn.execute(select(self._table).where(self._table.c.address == self.address)).first()
+
+    def _insert(self, next_nonce: int, nonces: List[int], assign) -> bool:
+        try:
+            with self._engine.begin() as conn:
+                conn.execute(self._table.insert().values(
+                    address=self.address, next_nonce=next_nonce, updated_at=datetime.utcnow()
+                ))
+                if assign:
+                    assign(conn, nonces)
+            return True
+        except IntegrityError:
+            # 其他进程已经插入, 重新走CAS
+            return False
+
+    def _try_reserve(self, count: int, assign) -> Optional[List[int]]:
+        table = self._table
+        chain_nonce = self._chain_pending_nonce()
+        row = self._load()
+        if row is None:
+            nonces = list(range(chain_nonce, chain_nonce + count))
+            return nonces if self._insert(chain_nonce + count, nonces, assign) else None
+
+        start = max(row.next_nonce, chain_nonce)
+        nonces = list(range(start, start + count))
+        with self._engine.begin() as conn:
+            result = conn.execute(
+                update(table)
+                .where(table.c.address == self.address, table.c.next_nonce == row.next_nonce)
+                .values(next_nonce=start + count, updated_at=datetime.utcnow())
+            )
+            if result.rowcount != 1:
+                return None
+            if assign:
+                # assign抛出异常时整个事务回滚, nonce没有被分配
+                assign(conn, nonces)
+        return nonces
+
+    def reserve(self, count: int = 1, assign: Optional[Callable[[Connection, List[int]], None]] = None) -> List[int]:
+        """分配 count 个连续的nonce; assign(conn, nonces) 与分配在同一个事务中执行。"""
+        with self._lock:
+            for _ in range(NONCE_CAS_RETRIES):
+                nonces = self._try_reserve(count, assign)
+                if nonces is not None:
+                    return nonces
+            raise RuntimeError(f"Could not reserve a nonce for {self.address}: too much contention")
+
+    def release(self, nonces: List[int]):
+        """回收已分配但未被节点接受的nonce (只能回收末尾的nonce)。记录在outbox行上的nonce不能回收。"""
+        table = self._table
+        with self._lock, self._engine.begin() as conn:
+            for nonce in sorted(nonces, reverse=True):
+                result = conn.execute(
+                    update(table)
+                    .where(table.c.address == self.address, table.c.next_nonce == nonce + 1)
+                    .values(next_nonce=nonce, updated_at=datetime.utcnow())
+                )
+                if result.rowcount != 1:
+                    break
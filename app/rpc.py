@@ -0,0 +1,200 @@
+"""
+Pooled, auto-batching, multi-endpoint JSON-RPC provider.
+
+替代单个 HTTPProvider(RPC_URL):
+- 每个RPC端点一个 requests.Session, 连接池大小 RPC_POOL_SIZE, 复用keep-alive连接;
+- 自动批量: 区块链线程池中并发发出的调用在 RPC_BATCH_WINDOW_MS 内合并为一个JSON-RPC批量请求;
+- 多端点 (RPC_URLS, 逗号分隔): 按延迟的指数滑动平均和在途请求数选择端点, 失败时切换到下一个端点;
+- 熔断: 连续失败 RPC_BREAKER_THRESHOLD 次的端点在 RPC_BREAKER_COOLDOWN 秒内不再被选择,
+  冷却后再放行请求试探, 成功即恢复。
+
+JSON-RPC层面的错误 (例如合约revert、nonce too low) 是节点的正常响应, 不计入端点失败, 也不会换端点重试。
+"""
+import os
+import random
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, List, Optional
+
+import requests
+import rlp
+from eth_account.typed_transactions import TypedTransaction
+from hexbytes import HexBytes
+from requests.adapters import HTTPAdapter
+from rlp.sedes import Binary, big_endian_int
+from web3 import Web3
+from web3.providers.base import JSONBaseProvider
+from web3.types import RPCEndpoint, RPCResponse
+
+RPC_POOL_SIZE = int(os.getenv("RPC_POOL_SIZE", "32"))
+RPC_TIMEOUT = float(os.getenv("RPC_TIMEOUT", "10"))
+RPC_BATCH_WINDOW = float(os.getenv("RPC_BATCH_WINDOW_MS", "2")) / 1000 # 0: 不自动合并
+RPC_MAX_BATCH_SIZE = int(os.getenv("RPC_MAX_BATCH_SIZE", "50"))
+RPC_BREAKER_THRESHOLD = int(os.getenv("RPC_BREAKER_THRESHOLD", "3"))
+RPC_BREAKER_COOLDOWN = float(os.getenv("RPC_BREAKER_COOLDOWN", "30"))
+RPC_LATENCY_ALPHA = 0.2 # 延迟EWMA的平滑系数
+RPC_EXPLORE_RATE = 0.05 # 偶尔选择非最优端点, 让延迟估计保持更新
+
+# legacy交易的RLP字段: [nonce, gasPrice, gas, to, value, data, v, r, s]
+LEGACY_TRANSACTION_FIELDS = ("nonce", "gasPrice", "gas", "to", "value", "data", "v", "r", "s")
+LEGACY_TRANSACTION_SEDES = rlp.sedes.List([big_endian_int] * 3 + [Binary(), big_endian_int, Binary()] + [big_endian_int] * 3)
+
+def decode_raw_transaction(raw: bytes) -> dict:
+    """把 eth_sendRawTransaction 的原始交易解码为字段dict (包含v/r/s)。typed交易 (EIP-2718) 第一个字节 <= 0x7f。"""
+    if raw[0] <= 0x7f:
+        return TypedTransaction.from_bytes(HexBytes(raw)).as_dict()
+    # eth-account没有公开legacy交易的解码接口, 直接按RLP解码
+    return dict(zip(LEGACY_TRANSACTION_FIELDS, rlp.decode(bytes(raw), sedes=LEGACY_TRANSACTION_SEDES)))
+
+def rpc_urls(default_url: str) -> List[str]:
+    urls = [url.strip() for url in os.getenv("RPC_URLS", "").split(",") if url.strip()]
+    return urls or [default_url]
+
+def make_endpoint(url: str) -> "Endpoint":
+    # sim:// 端点由进程内的模拟链处理 (CHAIN_BACKEND=sim, 见 chain_sim.py)
+    if url.startswith("sim://"):
+        from .chain_sim import SimulatedEndpoint
+        return SimulatedEndpoint(url)
+    return Endpoint(url)
+
+class Endpoint:
+    def __init__(self, url: str):
+        self.url = url
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=RPC_POOL_SIZE)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update({"Content-Type": "application/json"})
+        self.latency: Optional[float] = None # 秒, EWMA
+        self.in_flight = 0
+        self.failures = 0
+        self.open_until = 0.0
+
+    def available(self, now: float) -> bool:
+        return self.open_until <= now
+
+    def score(self) -> float:
+        # 还没有延迟数据的端点优先试一次
+        return (self.latency or 0.0) * (1 + self.in_flight)
+
+    def record_success(self, elapsed: float):
+        self.latency = elapsed if self.latency is None else (
+            RPC_LATENCY_ALPHA * elapsed + (1 - RPC_LATENCY_ALPHA) * self.latency
+        )
+        self.failures = 0
+        self.open_until = 0.0
+
+    def record_failure(self):
+        self.failures += 1
+        if self.failures >= RPC_BREAKER_THRESHOLD:
+            self.open_until = time.monotonic() + RPC_BREAKER_COOLDOWN
+
+    def post(self, payload: bytes) -> bytes:
+        response = self.session.post(self.url, data=payload, timeout=RPC_TIMEOUT)
+        response.raise_for_status()
+        return response.content
+
+class PooledRPCProvider(JSONBaseProvider):
+    def __init__(self, urls: List[str], **kwargs):
+        super().__init__(**kwargs)
+        if not urls:
+            raise ValueError("At least one RPC URL is required")
+        self.endpoints = [make_endpoint(url) for url in urls]
+        self._lock = threading.Lock()
+        self._pending: List[tuple] = [] # (request_id, payload, future)
+        self._flush_scheduled = False
+
+    def __str__(self) -> str:
+        return f"PooledRPCProvider({', '.join(e.url for e in self.endpoints)})"
+
+    # --- 端点选择与故障转移 ---
+    def _ranked_endpoints(self) -> List[Endpoint]:
+        now = time.monotonic()
+        with self._lock:
+            healthy = sorted((e for e in self.endpoints if e.available(now)), key=Endpoint.score)
+            broken = sorted((e for e in self.endpoints if not e.available(now)), key=lambda e: e.open_until)
+        if len(healthy) > 1 and random.random() < RPC_EXPLORE_RATE:
+            healthy.insert(0, healthy.pop(random.randrange(1, len(healthy))))
+        # 所有端点都熔断时仍然按恢复时间依次尝试, 不直接失败
+        return healthy + broken
+
+    def _post(self, payload: bytes) -> bytes:
+        last_error: Optional[Exception] = None
+        for endpoint in self._ranked_endpoints():
+            with self._lock:
+                endpoint.in_flight += 1
+            started = time.monotonic()
+            try:
+                raw = endpoint.post(payload)
+            except requests.RequestException as e:
+                with self._lock:
+                    endpoint.in_flight -= 1
+                    endpoint.record_failure()
+                last_error = e
+                continue
+            with self._lock:
+                endpoint.in_flight -= 1
+                endpoint.record_success(time.monotonic() - started)
+            return raw
+        raise ConnectionError(f"All RPC endpoints failed: {last_error}")
+
+    # --- 请求编码 ---
+    def _encode(self, method: RPCEndpoint, params: Any) -> tuple:
+        request_id = next(self.request_counter)
+        payload = Web3.to_json({"jsonrpc": "2.0", "method": method, "params": params or [], "id": request_id})
+        return request_id, payload.encode("utf-8")
+
+    # --- 自动批量 ---
+    def _flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, []
+            self._flush_scheduled = False
+        for i in range(0, len(pending), RPC_MAX_BATCH_SIZE):
+            self._send_chunk(pending[i:i + RPC_MAX_BATCH_SIZE])
+
+    def _send_chunk(self, chunk: List[tuple]):
+        try:
+            if len(chunk) == 1:
+                _, payload, future = chunk[0]
+                future.set_result(self.decode_rpc_response(self._post(payload)))
+                return
+            responses = self.decode_rpc_response(self._post(b"[" + b",".join(p for _, p, _ in chunk) + b"]"))
+        except Exception as e:
+            for _, _, future in chunk:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        if not isinstance(responses, list):
+            # 端点不支持批量请求: 逐个发送
+            for item in chunk:
+                self._send_chunk([item])
+            return
+        by_id = {response.get("id"): response for response in responses}
+        for request_id, payload, future in chunk:
+            if request_id in by_id:
+                future.set_result(by_id[request_id])
+            else:
+                self._send_chunk([(request_id, payload, future)])
+
+    def make_request(self, method: RPCEndpoint, params: Any) -> RPCResponse:
+        request_id, payload = self._encode(method, params)
+        if RPC_BATCH_WINDOW <= 0:
+            return self.decode_rpc_response(self._post(payload))
+        future: Future = Future()
+        with self._lock:
+            self._pending.append((request_id, payload, future))
+            leader = not self._flush_scheduled
+            self._flush_scheduled = True
+        if leader:
+            # 第一个请求负责等待合并窗口并发送整批, 其余请求只等待自己的结果
+            time.sleep(RPC_BATCH_WINDOW)
+            self._flush()
+        return future.result()
+
+    def make_batch_request(self, requests_: List[tuple]) -> List[RPCResponse] | RPCResponse:
+        encoded = [self._encode(method, params)[1] for method, params in requests_]
+        response = self.decode_rpc_response(self._post(b"[" + b",".join(encoded) + b"]"))
+        if not isinstance(response, list):
+            return response
+        return sorted(response, key=lambda r: r.get("id", 0))
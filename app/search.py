@@ -0,0 +1,92 @@
+"""
+Full-text search over task titles and descriptions.
+
+SQLite: FTS5外部内容表 tasks_fts (由 migrations.py 创建), 通过触发器与 tasks 表保持同步,
+按 bm25 排序 (标题权重高于描述) 并用 snippet() 生成高亮片段。
+其他数据库: 退化为 LIKE 匹配, 在Python中生成片段; 可在此处接入数据库自身的全文索引。
+"""
+import re
+from typing import List, Optional
+
+from sqlalchemy import and_, case, or_, select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import crud, database
+
+SNIPPET_OPEN = "<mark>"
+SNIPPET_CLOSE = "</mark>"
+SNIPPET_TOKENS = 16
+TITLE_WEIGHT = 10.0
+DESCRIPTION_WEIGHT = 1.0
+
+def _terms(query: str) -> List[str]:
+    return [term for term in re.findall(r"\w+", query, flags=re.UNICODE)]
+
+def fts_match_expression(query: str) -> Optional[str]:
+    # 用户输入不直接作为FTS5语法: 每个词加引号 (隐式AND), 最后一个词做前缀匹配
+    terms = _terms(query)
+    if not terms:
+        return None
+    quoted = [f'"{term}"' for term in terms]
+    quoted[-1] += "*"
+    return " ".join(quoted)
+
+async def _search_fts(db: AsyncSession, query: str, status: Optional[str], limit: int):
+    match = fts_match_expression(query)
+    if not match:
+        return []
+    status_sql = "AND tasks.status = :status" if status else ""
+    result = await db.execute(
+        text(f"""
+            SELECT tasks.id,
+                   snippet(tasks_fts, -1, :open, :close, '…', :tokens) AS snippet,
+                   bm25(tasks_fts, :title_weight, :description_weight) AS rank
+            FROM tasks_fts JOIN tasks ON tasks.rowid = tasks_fts.rowid
+            WHERE tasks_fts MATCH :match {status_sql}
+            ORDER BY rank
+            LIMIT :limit
+        """),
+        {
+            "open": SNIPPET_OPEN, "close": SNIPPET_CLOSE, "tokens": SNIPPET_TOKENS,
+            "title_weight": TITLE_WEIGHT, "description_weight": DESCRIPTION_WEIGHT,
+            "match": match, "status": status, "limit": limit,
+        },
+    )
+    # bm25越小越相关, 对外统一为越大越相关
+    return [(task_id, snippet, -rank) for task_id, snippet, rank in result.all()]
+
+def _highlight(value: str, terms: List[str]) -> str:
+    lowered = value.lower()
+    positions = [lowered.find(term.lower()) for term in terms]
+    positions = [p for p in positions if p >= 0]
+    start = max(min(positions) - 40, 0) if positions else 0
+    fragment = value[start:start + 160]
+    for term in terms:
+        fragment = re.sub(f"({re.escape(term)})", f"{SNIPPET_OPEN}\\1{SNIPPET_CLOSE}", fragment, flags=re.IGNORECASE)
+    return ("…" if start else "") + fragment
+
+async def _search_like(db: AsyncSession, query: str, status: Optional[str], limit: int):
+    terms = _terms(query)
+    if not terms:
+        return []
+    TaskDB = database.TaskDB
+    matches = [or_(TaskDB.title.ilike(f"%{term}%"), TaskDB.description.ilike(f"%{term}%")) for term in terms]
+    title_hits = sum(case((TaskDB.title.ilike(f"%{term}%"), TITLE_WEIGHT), else_=DESCRIPTION_WEIGHT) for term in terms)
+    stmt = select(TaskDB.id, TaskDB.title, TaskDB.description, title_hits.label("rank")).filter(and_(*matches))
+    if status:
+        stmt = stmt.filter(TaskDB.status == status)
+    result = await db.execute(stmt.order_by(text("rank DESC")).limit(limit))
+    hits = []
+    for task_id, title, description, rank in result.all():
+        source = description if not any(t.lower() in (title or "").lower() for t in terms) else title
+        hits.append((task_id, _highlight(source or "", terms), float(rank)))
+    return hits
+
+async def search_tasks(db: AsyncSession, query: str, status: Optional[str] = None, limit: int = 20):
+    """返回 [(task, snippet, score)], 按相关度从高到低排序。"""
+    if db.bind.dialect.name == "sqlite":
+        hits = await _search_fts(db, query, status, limit)
+    else:
+        hits = await _search_like(db, query, status, limit)
+    tasks_by_id = {t.id: t for t in await crud.get_tasks_by_ids(db, [task_id for task_id, _, _ in hits])}
+    return [(tasks_by_id[task_id], snippet, score) for task_id, snippet, score in hits if task_id in tasks_by_id]
@@ -0,0 +1,350 @@
+"""
+Settlement worker: drains the payout outbox.
+
+审核通过时只在数据库中写入 pending 的 TransactionDB 行 (与任务状态变更同一个事务),
+HTTP请求立即返回; 本worker在后台租用到期的pending行, 按收款地址合并后发起转账
+(配置了 DISPERSE_CONTRACT_ADDRESS 时, 多个收款地址按gas预算分批, 每批一笔批量交易),
+失败时指数退避重试, 超过最大次数后进入死信 (status=failed, last_error记录原因)。
+
+交易状态: pending -> completed / failed。
+签名的交易 (nonce, raw_tx, tx_hash) 在分配nonce的同一个事务中写入outbox行, 然后才广播, 不再逐笔等待回执:
+确认跟踪器每出现一个新区块, 用JSON-RPC批量请求查询所有已提交交易的回执, 达到 CONFIRMATION_DEPTH 后批量标记为
+completed; 通过记录的区块哈希发现重组; 迟迟没有上链的交易定期重新广播同一笔已签名交易。
+
+批量支付需要的Disperse授权同样是outbox交易 (kind=approval), 额度不足时生成, 授权上链前批量支付只是推迟。
+
+平台手续费不随每笔赏金发送: 审核通过时记入 fee_accruals 账本, 待归集总额超过 FEE_SWEEP_THRESHOLD_USDC
+或最早一笔等待超过 FEE_SWEEP_INTERVAL 时, 生成一次归集 (fee_sweeps) 和一笔转到手续费地址的outbox交易,
+与赏金走同样的支付/重试流程。
+
+默认单独运行, 不随API进程启动 (每个API worker进程各起一份会争抢同一批outbox行); 开发时可以设置 SETTLEMENT_WORKER_IN_APP=1:
+    python -m scripts.settlement_worker
+"""
+import asyncio
+import os
+import random
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+from . import blockchain, crud, database, fees
+
+SETTLEMENT_WORKER_IN_APP = os.getenv("SETTLEMENT_WORKER_IN_APP", "0") == "1"
+SETTLEMENT_POLL_INTERVAL = float(os.getenv("SETTLEMENT_POLL_INTERVAL", "2"))
+SETTLEMENT_BATCH_SIZE = int(os.getenv("SETTLEMENT_BATCH_SIZE", "200"))
+SETTLEMENT_LEASE_SECONDS = float(os.getenv("SETTLEMENT_LEASE_SECONDS", "300"))
+SETTLEMENT_MAX_ATTEMPTS = int(os.getenv("SETTLEMENT_MAX_ATTEMPTS", "5"))
+SETTLEMENT_BACKOFF_BASE = float(os.getenv("SETTLEMENT_BACKOFF_BASE", "5"))
+SETTLEMENT_BACKOFF_MAX = float(os.getenv("SETTLEMENT_BACKOFF_MAX", "600"))
+# 已广播但还没有回执的交易每隔这么久重新广播一次 (同一笔已签名交易, 节点丢弃了它时补上nonce空洞)
+SETTLEMENT_REBROADCAST_INTERVAL = float(os.getenv("SETTLEMENT_REBROADCAST_INTERVAL", "60"))
+# 广播后超过这个时间仍查不到回执, 在同一nonce上提价替换 (绝不换nonce重新支付)
+SETTLEMENT_DROP_AFTER = float(os.getenv("SETTLEMENT_DROP_AFTER", "1800"))
+# 提价替换的次数上限, 之后改为发送取消交易占用这个nonce, 取消交易确认后才重新支付
+SETTLEMENT_MAX_REPLACEMENTS = int(os.getenv("SETTLEMENT_MAX_REPLACEMENTS", "3"))
+# 回执所在区块之上累计多少个区块 (含自身) 才视为最终确认
+CONFIRMATION_DEPTH = int(os.getenv("CONFIRMATION_DEPTH", "3"))
+CONFIRMATION_POLL_INTERVAL = float(os.getenv("CONFIRMATION_POLL_INTERVAL", "2"))
+FEE_SWEEP_THRESHOLD_USDC = float(os.getenv("FEE_SWEEP_THRESHOLD_USDC", "100"))
+FEE_SWEEP_INTERVAL = float(os.getenv("FEE_SWEEP_INTERVAL", "86400")) # 秒
+
+def backoff_delay(attempts: int) -> float:
+    delay = min(SETTLEMENT_BACKOFF_BASE * (2 ** attempts), SETTLEMENT_BACKOFF_MAX)
+    return delay * random.uniform(0.5, 1.0)
+
+async def _retry_or_dead_letter(rows, error: Exception):
+    message = f"{type(error).__name__}: {error}"
+    async with database.AsyncSessionLocal() as db:
+        retry_ids = []
+        for row in rows:
+            if row.attempts + 1 >= SETTLEMENT_MAX_ATTEMPTS:
+                await crud.update_transaction_status(db, row.id, "failed", error=message)
+            else:
+                retry_ids.append(row.id)
+        if retry_ids:
+            attempts = max(row.attempts for row in rows)
+            next_attempt_at = datetime.utcnow() + timedelta(seconds=backoff_delay(attempts))
+            await crud.schedule_transaction_retry(db, retry_ids, message, next_attempt_at)
+
+async def _submit(rows, kind: str, sign):
+    """sign(persist) 分配nonce并签名, persist在同一个事务中把交易 (nonce, raw_tx) 记录到rows上, 然后才广播。
+
+    记录之后这些行只会被重新广播 (或在同一nonce上替换), 不会再换一个nonce重新支付。
+    """
+    transaction_ids = [row.id for row in rows]
+    locked_until = rows[0].locked_until # 同一次租用的行租约相同
+
+    def persist(conn, nonce, tx_hash, raw_tx):
+        crud.assign_signed_transaction(
+            conn, transaction_ids, locked_until, blockchain.PLATFORM_ADDRESS, nonce, kind, tx_hash, raw_tx
+        )
+
+    try:
+        tx_hash, raw_tx = await sign(persist)
+    except crud.TransactionLeaseLost as e:
+        print(f"Settlement skipped: {e}")
+        return
+    except Exception as e:
+        # 失败发生在nonce分配和记录提交之前: 交易没有被记录也没有广播, 只有这种情况可以安全地重试
+        await _retry_or_dead_letter(rows, e)
+        return
+    # 从这里开始这些行是 "已提交、状态未知": 广播失败 (包括连接错误) 也不重试支付, 由确认跟踪器按哈希/nonce对账
+    await _broadcast({tx_hash: raw_tx})
+
+async def _broadcast(transactions: Dict[str, str]):
+    """广播已记录在outbox中的交易 {tx_hash: raw_tx}; 失败时交易保持已提交状态, 由确认跟踪器稍后重新广播。"""
+    if not transactions:
+        return
+    results = await asyncio.gather(
+        *(blockchain.send_raw_transaction(raw_tx) for raw_tx in transactions.values()), return_exceptions=True
+    )
+    sent, errors = [], {}
+    for tx_hash, result in zip(transactions, results):
+        if isinstance(result, Exception):
+            # rejected: 节点明确拒绝 (例如 nonce too low: 可能是这笔交易已经上链, 也可能nonce被其他交易占用);
+            # unknown: 连接错误等, 交易可能已经进入mempool。两种情况都保留nonce, 由确认跟踪器对账
+            state = "rejected" if blockchain.is_rejected(result) else "unknown"
+            errors[tx_hash] = f"broadcast {state}: {type(result).__name__}: {result}"
+            print(f"Broadcast of {tx_hash} {state}, reconciling by receipt/nonce: {result}")
+        else:
+            sent.append(tx_hash)
+    async with database.AsyncSessionLocal() as db:
+        await crud.record_transaction_broadcast(db, sent)
+        for tx_hash, error in errors.items():
+            await crud.record_transaction_broadcast(db, [tx_hash], error)
+
+def _payout_micro(rows) -> int:
+    # outbox中的金额按整数micro-USDC累加后原样交给链上层, 单笔和批量支付的换算完全一致
+    return sum(fees.to_micro(row.amount) for row in rows)
+
+async def _pay(to_address: str, rows):
+    # 同一收款地址的多笔赏金合并为一次转账; 手续费由 sweep_fees() 归集
+    await _submit(rows, "transfer", lambda persist: blockchain.sign_usdc_transfer(
+        blockchain.PLATFORM_PRIVATE_KEY, # 实际应是poster的私钥
+        to_address,
+        _payout_micro(rows),
+        persist,
+    ))
+
+async def _pay_batch(groups):
+    # 多个收款地址通过Disperse合约一次支付, 每个TransactionDB行记录同一个批量交易哈希
+    payouts = [(to_address, _payout_micro(rows)) for to_address, rows in groups]
+    rows = [row for _, group_rows in groups for row in group_rows]
+    await _submit(rows, "disperse", lambda persist: blockchain.sign_usdc_batch(blockchain.PLATFORM_PRIVATE_KEY, payouts, persist))
+
+async def _approve(row):
+    # 授权也是一笔outbox交易: 签名、广播、确认与赏金相同, 上链之前批量支付只是推迟, 不阻塞worker
+    await _submit([row], "approve", lambda persist: blockchain.sign_usdc_approve(
+        blockchain.PLATFORM_PRIVATE_KEY, row.to_address, fees.to_micro(row.amount), persist
+    ))
+
+def _payout_chunks(fresh: Dict[str, List]):
+    groups = list(fresh.items())
+    size = blockchain.payout_batch_size()
+    for i in range(0, len(groups), size):
+        yield groups[i:i + size]
+
+async def _disperse_allowance_ready(batches) -> bool:
+    """已上链的授权额度扣除在途批量支付之后, 是否足够支付本轮的批量交易; 不够时生成一笔approve的outbox交易。"""
+    spender = blockchain.DISPERSE_CONTRACT_ADDRESS
+    needed = sum(_payout_micro(rows) for chunk in batches for _, rows in chunk)
+    allowance = await blockchain.get_usdc_allowance_micro(blockchain.PLATFORM_ADDRESS, spender)
+    async with database.AsyncSessionLocal() as db:
+        if allowance - await crud.get_inflight_disperse_micro(db) >= needed:
+            return True
+        # 已有未完成的授权时不重复生成; approve是覆盖而不是累加, 额度取本轮总额和配置值中较大的一个
+        if not await crud.has_pending_approval(db, spender):
+            amount_micro = max(needed, fees.to_micro(blockchain.DISPERSE_APPROVAL_USDC))
+            await crud.create_approval_transaction(db, blockchain.PLATFORM_ADDRESS, spender, amount_micro)
+            print(f"Disperse allowance too low, queued an approval of {fees.from_micro(amount_micro)} USDC")
+    return False
+
+async def sweep_fees():
+    """待归集的手续费达到阈值或时间窗口结束时, 生成一次归集; 返回新建的FeeSweepDB或None。"""
+    async with database.AsyncSessionLocal() as db:
+        total_micro, count, oldest = await crud.get_fee_ledger_summary(db)
+        if not count:
+            return None
+        window_ended = oldest is not None and datetime.utcnow() - oldest >= timedelta(seconds=FEE_SWEEP_INTERVAL)
+        if total_micro < fees.to_micro(FEE_SWEEP_THRESHOLD_USDC) and not window_ended:
+            return None
+        sweep = await crud.open_fee_sweep(
+            db, blockchain.PLATFORM_ADDRESS, blockchain.PLATFORM_FEE_RECIPIENT_ADDRESS
+        )
+    if sweep:
+        print(f"Fee sweep {sweep.id}: {fees.from_micro(sweep.amount_micro)} USDC from {sweep.accrual_count} tasks")
+    return sweep
+
+async def settle_once() -> int:
+    """处理一批到期的outbox行, 返回本轮租用的行数。"""
+    await sweep_fees()
+    async with database.AsyncSessionLocal() as db:
+        rows = await crud.lease_due_transactions(db, SETTLEMENT_BATCH_SIZE, SETTLEMENT_LEASE_SECONDS)
+    if not rows:
+        return 0
+
+    approvals = [row for row in rows if row.kind == "approval"]
+    fresh: Dict[str, List] = {}
+    for row in rows:
+        if row.kind != "approval":
+            fresh.setdefault(row.to_address, []).append(row)
+    chunks = list(_payout_chunks(fresh))
+    batches = [chunk for chunk in chunks if len(chunk) > 1]
+    if batches:
+        try:
+            ready = await _disperse_allowance_ready(batches)
+        except Exception as e:
+            print(f"Could not check the Disperse allowance: {e}")
+            ready = False
+        if not ready:
+            # 授权上链之前推迟批量支付, 不计入重试次数 (推迟一个轮询间隔, 下一轮先租到approve行);
+            # 单个收款地址的转账不需要授权, 照常发送
+            next_attempt_at = datetime.utcnow() + timedelta(seconds=SETTLEMENT_POLL_INTERVAL)
+            async with database.AsyncSessionLocal() as db:
+                await crud.release_transactions(
+                    db, [row.id for chunk in batches for _, group in chunk for row in group], next_attempt_at
+                )
+            chunks = [chunk for chunk in chunks if len(chunk) == 1]
+    await asyncio.gather(
+        *(_approve(row) for row in approvals),
+        *(_pay(*chunk[0]) if len(chunk) == 1 else _pay_batch(chunk) for chunk in chunks),
+    )
+    return len(rows)
+
+# --- 确认跟踪 ---
+async def _replace(group, signed):
+    """在同一nonce上签一笔提价的替换交易; 替换次数用完后改为取消交易 (0金额自转账), 只为占用nonce。"""
+    row = group[0]
+    cancel = len(signed) > SETTLEMENT_MAX_REPLACEMENTS # signed包含原交易
+    kind = "cancel" if cancel else next((s.kind for s in signed if s.tx_hash == row.tx_hash), "transfer")
+    try:
+        tx_hash, raw_tx = await blockchain.sign_replacement(blockchain.PLATFORM_PRIVATE_KEY, row.raw_tx, cancel=cancel)
+    except Exception as e:
+        print(f"Could not replace transaction {row.tx_hash}: {e}")
+        return
+    async with database.AsyncSessionLocal() as db:
+        recorded = await crud.record_transaction_replacement(
+            db, [r.id for r in group], row.tx_hash, blockchain.PLATFORM_ADDRESS, row.nonce, kind, tx_hash, raw_tx,
+        )
+    if recorded:
+        print(f"Transaction {row.tx_hash} (nonce {row.nonce}) not mined, {'cancelled' if cancel else 'replaced'} by {tx_hash}")
+        await _broadcast({tx_hash: raw_tx})
+
+async def track_confirmations(head: int) -> int:
+    """用一次(分批的)JSON-RPC批量请求查询所有已提交交易的回执, 达到确认深度的批量标记为completed; 返回完成的交易数。
+
+    已记录nonce的交易永远不会换nonce重新支付, 除非确认深度处的链上状态证明这笔支付不会发生:
+    nonce被我们的取消交易或其他交易占用, 或者交易上链但revert。长时间没有上链的交易在同一nonce上提价替换,
+    替换 SETTLEMENT_MAX_REPLACEMENTS 次后改为取消交易。
+    """
+    async with database.AsyncSessionLocal() as db:
+        rows = await crud.get_submitted_transactions(db)
+        if not rows:
+            return 0
+        signed = await crud.get_signed_transactions(
+            db, blockchain.PLATFORM_ADDRESS, sorted({row.nonce for row in rows if row.nonce is not None})
+        )
+    by_hash: Dict[str, List] = {}
+    for row in rows:
+        by_hash.setdefault(row.tx_hash, []).append(row)
+    # 先读取确认深度处的nonce, 再查回执: nonce已被使用时, 如果占用它的是我们的交易, 之后的回执查询一定能看到
+    confirmed_nonce = await blockchain.get_transaction_count(
+        blockchain.PLATFORM_ADDRESS, max(head - CONFIRMATION_DEPTH + 1, 0)
+    )
+    # 同一nonce上签过的所有交易 (替换之后, 上链的可能是更早签的那笔)
+    receipts = await blockchain.get_transaction_receipts(
+        list(set(by_hash) | {s.tx_hash for candidates in signed.values() for s in candidates})
+    )
+
+    now = datetime.utcnow()
+    blocks, confirmed, replace = [], [], []
+    rebroadcast: Dict[str, str] = {}
+    for tx_hash, group in by_hash.items():
+        row = group[0]
+        candidates = signed.get(row.nonce, [])
+        mined = next((s for s in candidates if receipts.get(s.tx_hash)), None)
+        mined_hash = mined.tx_hash if mined else (tx_hash if receipts.get(tx_hash) else None)
+
+        if mined_hash is None:
+            if row.nonce is not None and row.nonce < confirmed_nonce:
+                # 这个nonce在确认深度上已被另一笔交易使用, 本交易永远不会上链: 这时才可以换nonce重新支付
+                await _retry_or_dead_letter(group, RuntimeError(f"Nonce {row.nonce} of {tx_hash} was used by another transaction"))
+            elif row.block_hash:
+                # 之前已上链, 现在查不到: 所在区块被重组掉, 交易回到mempool (或被丢弃)
+                print(f"Transaction {tx_hash} was reorged out of block {row.block_hash}")
+                blocks.extend(
+                    {"id": r.id, "tx_hash": tx_hash, "raw_tx": r.raw_tx, "block_number": None, "block_hash": None} for r in group
+                )
+            elif row.nonce is None:
+                # 没有记录nonce和已签名交易的旧行: 无法在同一nonce上替换, 也不能重新支付, 超时后交给人工对账
+                if row.submitted_at and now - row.submitted_at > timedelta(seconds=SETTLEMENT_DROP_AFTER):
+                    async with database.AsyncSessionLocal() as db:
+                        for r in group:
+                            await crud.update_transaction_status(
+                                db, r.id, "failed", error=f"Transaction {tx_hash} not mined and has no recorded nonce; reconcile manually"
+                            )
+            elif row.submitted_at and now - row.submitted_at > timedelta(seconds=SETTLEMENT_DROP_AFTER):
+                replace.append((group, candidates))
+            elif row.broadcast_at is None or now - row.broadcast_at > timedelta(seconds=SETTLEMENT_REBROADCAST_INTERVAL):
+                # 节点丢弃了交易 (或广播时连接失败): 重新广播同一笔交易, nonce不变
+                rebroadcast[tx_hash] = row.raw_tx
+            continue
+
+        receipt = receipts[mined_hash]
+        if mined_hash != tx_hash or receipt["blockHash"] != row.block_hash:
+            # 首次看到回执, 重组后被打包进了另一个区块, 或者上链的是同一nonce上的另一笔交易: 从新区块重新计算确认数
+            raw_tx = mined.raw_tx if mined else row.raw_tx
+            blocks.extend(
+                {"id": r.id, "tx_hash": mined_hash, "raw_tx": raw_tx, "block_number": receipt["blockNumber"],
+                 "block_hash": receipt["blockHash"]}
+                for r in group
+            )
+        if head - receipt["blockNumber"] + 1 < CONFIRMATION_DEPTH:
+            continue
+        if mined is not None and mined.kind == "cancel":
+            # 取消交易已经确认, 这笔支付没有发生: 换nonce重新支付
+            await _retry_or_dead_letter(group, RuntimeError(f"Transaction {tx_hash} was cancelled by {mined_hash}"))
+        elif receipt["status"] == 1:
+            confirmed.extend(r.id for r in group)
+        else:
+            await _retry_or_dead_letter(group, RuntimeError(f"Transaction {mined_hash} reverted"))
+
+    async with database.AsyncSessionLocal() as db:
+        await crud.record_transaction_blocks(db, blocks)
+        completed = await crud.complete_transactions(db, confirmed)
+    await _broadcast(rebroadcast)
+    for group, candidates in replace:
+        await _replace(group, candidates)
+    return completed
+
+async def _confirmation_loop(stop: asyncio.Event):
+    # 只在出现新区块时查询回执: RPC开销随区块数增长, 与待确认交易数无关
+    last_head = None
+    while not stop.is_set():
+        try:
+            head = await blockchain.get_block_number()
+            if head != last_head:
+                await track_confirmations(head)
+                last_head = head
+        except Exception as e:
+            print(f"Confirmation tracker error: {e}")
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=CONFIRMATION_POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+
+async def _settlement_loop(stop: asyncio.Event):
+    while not stop.is_set():
+        try:
+            processed = await settle_once()
+        except Exception as e:
+            print(f"Settlement worker error: {e}")
+            processed = 0
+        if processed < SETTLEMENT_BATCH_SIZE:
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=SETTLEMENT_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+async def run_forever(stop: asyncio.Event = None):
+    stop = stop or asyncio.Event()
+    await asyncio.gather(_settlement_loop(stop), _confirmation_loop(stop))
@@ -0,0 +1,291 @@
+"""
+Outbound webhook delivery worker.
+
+Agent注册的webhook在其发布或认领的任务状态变化时收到推送, 集成方不再需要轮询。
+- 投递记录 (webhook_deliveries) 与任务状态变更在同一个数据库事务中写入, 进程重启后继续投递;
+- worker租用到期的投递, 按webhook分组, 突发的多个事件合并为一个请求 (每个请求最多 WEBHOOK_BATCH_SIZE 个事件):
+      POST <url>  {"events": [{"id", "type", "created_at", "data"}, ...]}
+- 同一webhook的请求依次发送, 不同webhook之间最多 WEBHOOK_CONCURRENCY 个并发; 共用一个httpx连接池;
+- 请求头 X-AgentTaskHub-Signature: t=<unix时间>,v1=<HMAC-SHA256(secret, "<t>.<body>") hex>;
+- 非2xx或网络错误时指数退避重试 (429时遵循Retry-After), 超过 WEBHOOK_MAX_ATTEMPTS 次后标记为failed;
+  返回410 Gone的webhook被停用。
+- 防SSRF: 注册时和每次投递前都解析主机名, 任何一个地址是回环/私有/链路本地/保留等非公网地址都拒绝
+  (WEBHOOK_ALLOW_PRIVATE_HOSTS=1 只用于本地开发); 投递时直接连接校验过的IP (Host头和TLS SNI仍是原主机名),
+  不会再解析一次, 防止DNS rebinding; 不跟随重定向。
+
+投递语义是至少一次: 接收方应按事件id去重; 重试可能使事件乱序, 以 data.status 为准。
+
+API以多个进程部署时投递worker只需要一份, 因此默认单独运行 (WEBHOOK_WORKER_IN_APP=1 时随API进程启动):
+    python -m scripts.webhook_worker
+"""
+import asyncio
+import hashlib
+import hmac
+import ipaddress
+import os
+import random
+import secrets
+import socket
+import ssl
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit
+
+import certifi
+import httpcore
+import httpx
+
+from . import crud, database
+
+WEBHOOK_WORKER_IN_APP = os.getenv("WEBHOOK_WORKER_IN_APP", "0") == "1"
+WEBHOOK_POLL_INTERVAL = float(os.getenv("WEBHOOK_POLL_INTERVAL", "1"))
+WEBHOOK_LEASE_LIMIT = int(os.getenv("WEBHOOK_LEASE_LIMIT", "500")) # 每轮租用的投递数
+WEBHOOK_LEASE_SECONDS = float(os.getenv("WEBHOOK_LEASE_SECONDS", "120"))
+WEBHOOK_BATCH_SIZE = int(os.getenv("WEBHOOK_BATCH_SIZE", "50")) # 每个请求最多包含的事件数
+WEBHOOK_CONCURRENCY = int(os.getenv("WEBHOOK_CONCURRENCY", "16"))
+WEBHOOK_TIMEOUT = float(os.getenv("WEBHOOK_TIMEOUT", "10"))
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "100"))
+WEBHOOK_MAX_ATTEMPTS = int(os.getenv("WEBHOOK_MAX_ATTEMPTS", "10"))
+WEBHOOK_BACKOFF_BASE = float(os.getenv("WEBHOOK_BACKOFF_BASE", "10"))
+WEBHOOK_BACKOFF_MAX = float(os.getenv("WEBHOOK_BACKOFF_MAX", "3600"))
+WEBHOOK_ALLOW_PRIVATE_HOSTS = os.getenv("WEBHOOK_ALLOW_PRIVATE_HOSTS", "0") == "1"
+
+SIGNATURE_HEADER = "X-AgentTaskHub-Signature"
+
+def generate_secret() -> str:
+    return "whsec_" + secrets.token_hex(24)
+
+def sign(secret: str, timestamp: int, body: bytes) -> str:
+    digest = hmac.new(secret.encode("utf-8"), f"{timestamp}.".encode("utf-8") + body, hashlib.sha256).hexdigest()
+    return f"t={timestamp},v1={digest}"
+
+def _is_public_address(address: str) -> bool:
+    ip = ipaddress.ip_address(address.split("%", 1)[0]) # 去掉IPv6的zone id
+    if ip.version == 6 and ip.ipv4_mapped:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not (ip.is_loopback or ip.is_private or ip.is_link_local or ip.is_reserved
+                                 or ip.is_multicast or ip.is_unspecified)
+
+async def _resolve(host: str, port: int) -> List[str]:
+    infos = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    return list(dict.fromkeys(info[4][0] for info in infos))
+
+async def check_url(url: str) -> List[str]:
+    """校验webhook URL只指向公网地址, 返回校验过的地址, 否则抛出ValueError。
+
+    注册时和每次投递前调用 (DNS解析结果可能变化); WEBHOOK_ALLOW_PRIVATE_HOSTS=1 时不解析, 返回空列表。
+    """
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        raise ValueError("Webhook URL must be http(s) with a host")
+    if WEBHOOK_ALLOW_PRIVATE_HOSTS:
+        return []
+    try:
+        addresses = await _resolve(parts.hostname, parts.port or (443 if parts.scheme == "https" else 80))
+    except (socket.gaierror, ValueError) as e:
+        raise ValueError(f"Webhook host cannot be resolved: {e}")
+    blocked = sorted(address for address in addresses if not _is_public_address(address))
+    if blocked:
+        raise ValueError(f"Webhook host resolves to non-public address {', '.join(blocked)}")
+    return addresses
+
+class PinnedNetworkBackend(httpcore.AsyncNetworkBackend):
+    """按 pin() 记录的地址建立TCP连接, 不自己解析主机名。
+
+    连接池仍按原主机名区分连接, TLS握手的SNI和证书校验、Host头都使用原主机名。
+    没有记录过的主机名拒绝连接 (WEBHOOK_ALLOW_PRIVATE_HOSTS=1 时按主机名直接连接)。
+    """
+
+    def __init__(self, backend: Optional[httpcore.AsyncNetworkBackend] = None):
+        self._backend = backend or httpcore.AnyIOBackend()
+        self._addresses: Dict[str, str] = {}
+
+    def pin(self, host: str, address: str):
+        self._addresses[host] = address
+
+    async def connect_tcp(self, host, port, timeout=None, local_address=None, socket_options=None):
+        address = self._addresses.get(host)
+        if address is None:
+            if not WEBHOOK_ALLOW_PRIVATE_HOSTS:
+                raise httpcore.ConnectError(f"Webhook host {host} was not validated")
+            address = host
+        return await self._backend.connect_tcp(
+            address, port, timeout=timeout, local_address=local_address, socket_options=socket_options
+        )
+
+    async def sleep(self, seconds: float):
+        await self._backend.sleep(seconds)
+
+class _ResponseStream(httpx.AsyncByteStream):
+    def __init__(self, stream):
+        self._stream = stream
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self):
+        await self._stream.aclose()
+
+class PinnedTransport(httpx.AsyncBaseTransport):
+    """httpx传输层: 通过 PinnedNetworkBackend 的httpcore连接池发送请求。"""
+
+    def __init__(self, network_backend: PinnedNetworkBackend, max_connections: int, max_keepalive_connections: int):
+        self._pool = httpcore.AsyncConnectionPool(
+            ssl_context=ssl.create_default_context(cafile=certifi.where()),
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            network_backend=network_backend,
+        )
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        core_request = httpcore.Request(
+            method=request.method,
+            url=httpcore.URL(scheme=request.url.raw_scheme, host=request.url.raw_host, port=request.url.port,
+                             target=request.url.raw_path),
+            headers=request.headers.raw,
+            content=request.stream,
+            extensions=request.extensions,
+        )
+        try:
+            response = await self._pool.handle_async_request(core_request)
+        except httpcore.TimeoutException as e:
+            raise httpx.TimeoutException(str(e), request=request)
+        except (httpcore.NetworkError, httpcore.ProtocolError, httpcore.UnsupportedProtocol) as e:
+            raise httpx.TransportError(str(e))
+        return httpx.Response(status_code=response.status, headers=response.headers,
+                              stream=_ResponseStream(response.stream), extensions=response.extensions)
+
+    async def aclose(self):
+        await self._pool.aclose()
+
+def backoff_delay(attempts: int) -> float:
+    delay = min(WEBHOOK_BACKOFF_BASE * (2 ** attempts), WEBHOOK_BACKOFF_MAX)
+    return delay * random.uniform(0.5, 1.0)
+
+class DeliveryError(Exception):
+    def __init__(self, message: str, retry_after: Optional[float] = None, gone: bool = False):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.gone = gone
+
+class WebhookDispatcher:
+    def __init__(self):
+        self._client: Optional[httpx.AsyncClient] = None
+        self._semaphore = asyncio.Semaphore(WEBHOOK_CONCURRENCY)
+        self._network = PinnedNetworkBackend()
+
+    def _http(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=WEBHOOK_TIMEOUT,
+                transport=PinnedTransport(self._network, WEBHOOK_MAX_CONNECTIONS, WEBHOOK_CONCURRENCY),
+                headers={"User-Agent": "AgentTaskHub-Webhooks/1.0"},
+                follow_redirects=False, # 重定向可能指向内网地址
+            )
+        return self._client
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _post(self, webhook, deliveries):
+        # 投递记录中保存的是已序列化的事件JSON, 直接拼接, 不再重新编码
+        body = b'{"events":[' + b",".join(d.payload.encode("utf-8") for d in deliveries) + b"]}"
+        headers = {
+            "Content-Type": "application/json",
+            SIGNATURE_HEADER: sign(webhook.secret, int(time.time()), body),
+            "X-AgentTaskHub-Webhook-Id": webhook.id,
+        }
+        try:
+            addresses = await check_url(webhook.url)
+        except ValueError as e:
+            raise DeliveryError(str(e))
+        if addresses:
+            # 连接校验过的地址, 不让httpx再解析一次 (解析结果可能已被换成内网地址)
+            self._network.pin(httpx.URL(webhook.url).raw_host.decode("ascii"), addresses[0])
+        try:
+            response = await self._http().post(webhook.url, content=body, headers=headers)
+        except httpx.HTTPError as e:
+            raise DeliveryError(f"{type(e).__name__}: {e}")
+        if 200 <= response.status_code < 300:
+            return
+        retry_after = response.headers.get("Retry-After")
+        raise DeliveryError(
+            f"HTTP {response.status_code}",
+            retry_after=float(retry_after) if retry_after and retry_after.isdigit() else None,
+            gone=response.status_code == 410,
+        )
+
+    async def _deliver(self, webhook, deliveries):
+        async with self._semaphore:
+            for i in range(0, len(deliveries), WEBHOOK_BATCH_SIZE):
+                chunk = deliveries[i:i + WEBHOOK_BATCH_SIZE]
+                try:
+                    await self._post(webhook, chunk)
+                except DeliveryError as e:
+                    await self._handle_failure(webhook, chunk, deliveries[i + WEBHOOK_BATCH_SIZE:], e)
+                    return
+                async with database.AsyncSessionLocal() as db:
+                    await crud.mark_webhook_deliveries(db, [d.id for d in chunk], "delivered")
+
+    async def _handle_failure(self, webhook, failed, remaining, error: DeliveryError):
+        # 失败批次之后的事件一起推迟, 同一webhook的事件尽量保持顺序
+        async with database.AsyncSessionLocal() as db:
+            if error.gone:
+                print(f"Webhook {webhook.id} returned 410 Gone, deactivating")
+                await crud.deactivate_webhook(db, webhook.id, str(error))
+                return
+            dead = [d.id for d in failed if d.attempts + 1 >= WEBHOOK_MAX_ATTEMPTS]
+            retry = [d for d in failed if d.attempts + 1 < WEBHOOK_MAX_ATTEMPTS]
+            if dead:
+                await crud.mark_webhook_deliveries(db, dead, "failed", str(error))
+            delay = error.retry_after or backoff_delay(max(d.attempts for d in failed))
+            next_attempt_at = datetime.utcnow() + timedelta(seconds=delay)
+            if retry:
+                await crud.schedule_webhook_retry(db, [d.id for d in retry], str(error), next_attempt_at)
+            if remaining:
+                await crud.schedule_webhook_retry(db, [d.id for d in remaining], str(error), next_attempt_at, attempted=False)
+
+    async def deliver_once(self) -> int:
+        """投递一批到期的事件, 返回本轮租用的投递数。"""
+        async with database.AsyncSessionLocal() as db:
+            deliveries = await crud.lease_webhook_deliveries(db, WEBHOOK_LEASE_LIMIT, WEBHOOK_LEASE_SECONDS)
+            if not deliveries:
+                return 0
+            webhooks = {w.id: w for w in await crud.get_webhooks_by_ids(db, list({d.webhook_id for d in deliveries}))}
+
+        by_webhook: Dict[str, List] = {}
+        for delivery in deliveries:
+            by_webhook.setdefault(delivery.webhook_id, []).append(delivery)
+        jobs = []
+        for webhook_id, group in by_webhook.items():
+            webhook = webhooks.get(webhook_id)
+            if webhook is None or not webhook.active:
+                async with database.AsyncSessionLocal() as db:
+                    await crud.mark_webhook_deliveries(db, [d.id for d in group], "failed", "Webhook deleted")
+                continue
+            jobs.append(self._deliver(webhook, group))
+        await asyncio.gather(*jobs)
+        return len(deliveries)
+
+dispatcher = WebhookDispatcher()
+
+async def run_forever(stop: asyncio.Event = None):
+    stop = stop or asyncio.Event()
+    try:
+        while not stop.is_set():
+            try:
+                processed = await dispatcher.deliver_once()
+            except Exception as e:
+                print(f"Webhook worker error: {e}")
+                processed = 0
+            if processed < WEBHOOK_LEASE_LIMIT:
+                try:
+                    await asyncio.wait_for(stop.wait(), timeout=WEBHOOK_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+    finally:
+        await dispatcher.aclose()
@@ -0,0 +1,133 @@
+"""
+Payout pipeline benchmark against the in-process simulated chain.
+
+审核通过 (apply_task_reviews写入outbox) -> settlement worker广播 -> 确认跟踪器标记completed,
+全流程跑在 CHAIN_BACKEND=sim 上, 不需要网络。输出吞吐量、审核到确认的延迟分布和链上余额核对。
+故障注入通过 SIM_* 环境变量配置 (见 app/chain_sim.py), 例如:
+
+    SIM_DROP_RATE=0.02 SIM_REVERT_RATE=0.02 SIM_REORG_RATE=0.1 python -m scripts.benchmark_payouts --tasks 1000
+
+--json 在最后一行输出按钱包汇总的结果 (记录的支付 vs 链上余额, 单位micro-USDC), 供 tests/test_payouts_sim.py 核对。
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+# 必须在导入app之前设置: 模拟链、独立的临时数据库、适合短区块时间的轮询间隔
+os.environ.setdefault("CHAIN_BACKEND", "sim")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp(prefix='payout-bench-')}/bench.db")
+os.environ.setdefault("SIM_BLOCK_TIME", "1")
+os.environ.setdefault("CHAIN_BLOCK_TIME", os.environ["SIM_BLOCK_TIME"])
+os.environ.setdefault("SETTLEMENT_POLL_INTERVAL", "0.2")
+os.environ.setdefault("CONFIRMATION_POLL_INTERVAL", "0.2")
+os.environ.setdefault("SETTLEMENT_BACKOFF_BASE", "1")
+os.environ.setdefault("SETTLEMENT_DROP_AFTER", "20")
+os.environ.setdefault("SETTLEMENT_REBROADCAST_INTERVAL", "5")
+os.environ.setdefault("FEE_SWEEP_INTERVAL", "0")
+
+from eth_account import Account
+from sqlalchemy import func, insert, select
+
+from app import blockchain, chain_sim, crud, database, fees, settlement
+from app.database import init_db
+
+def _percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+async def _seed(tasks: int, claimers: int):
+    # 直接写入submitted状态的任务, 再走与 /tasks/review 相同的批量审核路径
+    poster_id = "bench-poster"
+    wallets = [Account.create().address for _ in range(claimers)]
+    async with database.AsyncSessionLocal() as db:
+        await db.execute(insert(database.AgentDB), [
+            {"id": poster_id, "name": poster_id, "api_key_hash": poster_id, "wallet_address": blockchain.PLATFORM_ADDRESS,
+             "referral_code": poster_id},
+            *({"id": f"bench-claimer-{i}", "name": f"bench-claimer-{i}", "api_key_hash": f"bench-claimer-{i}",
+               "wallet_address": wallet, "referral_code": f"bench-claimer-{i}"} for i, wallet in enumerate(wallets)),
+        ])
+        rows = [
+            {"id": f"bench-task-{i}", "title": f"Benchmark task {i}", "description": "", "amount": 1 + (i % 10) / 4,
+             "status": "submitted", "poster_id": poster_id, "claimer_id": f"bench-claimer-{i % claimers}"}
+            for i in range(tasks)
+        ]
+        await db.execute(insert(database.TaskDB), rows)
+        await db.commit()
+
+        payouts, platform_fees = fees.split_fees([fees.to_micro(row["amount"]) for row in rows])
+        transactions = [
+            {"task_id": row["id"], "from_address": blockchain.PLATFORM_ADDRESS, "to_address": wallets[i % claimers],
+             "amount": fees.from_micro(payout), "fee_amount": fees.from_micro(fee),
+             "fee_recipient_address": blockchain.PLATFORM_FEE_RECIPIENT_ADDRESS}
+            for i, (row, payout, fee) in enumerate(zip(rows, payouts, platform_fees))
+        ]
+        await crud.apply_task_reviews(db, [row["id"] for row in rows], [], transactions)
+    return wallets
+
+async def _status_counts():
+    async with database.AsyncSessionLocal() as db:
+        result = await db.execute(
+            select(database.TransactionDB.status, func.count()).group_by(database.TransactionDB.status)
+        )
+        return dict(result.all())
+
+async def main(tasks: int, claimers: int, timeout: float) -> dict:
+    init_db()
+    wallets = await _seed(tasks, claimers)
+    started = time.monotonic()
+    stop = asyncio.Event()
+    worker = asyncio.create_task(settlement.run_forever(stop))
+    while time.monotonic() - started < timeout:
+        counts = await _status_counts()
+        if not counts.get("pending"):
+            break
+        print(f"  {time.monotonic() - started:6.1f}s  block {chain_sim.chain.head}  {counts}")
+        await asyncio.sleep(1)
+    elapsed = time.monotonic() - started
+    stop.set()
+    await worker
+
+    async with database.AsyncSessionLocal() as db:
+        result = await db.execute(select(database.TransactionDB).where(database.TransactionDB.task_id.isnot(None)))
+        rows = result.scalars().all()
+    completed = [row for row in rows if row.status == "completed"]
+    latencies = [(row.completed_at - row.created_at).total_seconds() for row in completed]
+    paid_by_wallet = {wallet: 0 for wallet in wallets}
+    for row in completed:
+        paid_by_wallet[row.to_address] += fees.to_micro(row.amount)
+    paid = sum(paid_by_wallet.values())
+    # 直接读取模拟链的状态, 不经过RPC: 余额核对不受 SIM_RPC_* 故障注入影响
+    onchain = {wallet: chain_sim.chain.state.balances.get(wallet.lower(), 0) for wallet in wallets}
+    onchain_micro = {wallet: units * fees.MICRO_PER_USDC // 10 ** chain_sim.SIM_DECIMALS for wallet, units in onchain.items()}
+
+    print(f"payouts:     {len(completed)}/{len(rows)} completed, {sum(r.status == 'failed' for r in rows)} failed"
+          f" in {elapsed:.1f}s ({len(completed) / elapsed:.1f} payouts/s)")
+    print(f"latency:     p50 {_percentile(latencies, 50):.1f}s  p95 {_percentile(latencies, 95):.1f}s"
+          f"  max {max(latencies, default=0):.1f}s (approve -> confirmed)")
+    print(f"chain:       {chain_sim.chain.head} blocks, {chain_sim.chain.stats}")
+    print(f"balances:    paid {fees.from_micro(paid)} USDC, on-chain {sum(onchain.values()) / 10 ** chain_sim.SIM_DECIMALS:.6f} USDC")
+    return {
+        "transactions": len(rows),
+        "completed": len(completed),
+        "failed": sum(r.status == "failed" for r in rows),
+        "pending": sum(r.status == "pending" for r in rows),
+        "chain": chain_sim.chain.stats,
+        "paid_micro": paid_by_wallet,
+        "onchain_micro": onchain_micro,
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the payout pipeline on the simulated chain")
+    parser.add_argument("--tasks", type=int, default=500)
+    parser.add_argument("--claimers", type=int, default=100)
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--json", action="store_true", help="print the per-wallet summary as JSON on the last line")
+    args = parser.parse_args()
+    summary = asyncio.run(main(args.tasks, args.claimers, args.timeout))
+    if args.json:
+        print(json.dumps(summary))
@@ -0,0 +1,9 @@
+import asyncio
+
+from app.database import init_db
+from app import settlement
+
+if __name__ == "__main__":
+    init_db()
+    print("settlement worker started")
+    asyncio.run(settlement.run_forever())
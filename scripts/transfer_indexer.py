@@ -0,0 +1,9 @@
+import asyncio
+
+from app.database import init_db
+from app import indexer
+
+if __name__ == "__main__":
+    init_db()
+    print("transfer indexer started")
+    asyncio.run(indexer.run_forever())
@@ -0,0 +1,9 @@
+import asyncio
+
+from app.database import init_db
+from app import webhooks
+
+if __name__ == "__main__":
+    init_db()
+    print("webhook worker started")
+    asyncio.run(webhooks.run_forever())
@@ -0,0 +1,35 @@
+import os
+import tempfile
+
+# 必须在导入app之前设置: 模拟链、独立的临时数据库, 应用内不启动后台worker
+os.environ.setdefault("CHAIN_BACKEND", "sim")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp(prefix='agenttaskhub-tests-')}/test.db")
+os.environ.setdefault("SETTLEMENT_WORKER_IN_APP", "0")
+os.environ.setdefault("INDEXER_IN_APP", "0")
+os.environ.setdefault("WEBHOOK_WORKER_IN_APP", "0")
+os.environ.setdefault("TASK_CACHE_TTL", "0")
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.main import app
+
+@pytest.fixture(scope="session")
+def client():
+    with TestClient(app) as client:
+        yield client
+
+@pytest.fixture
+def make_agent(client):
+    # 注册一个新Agent, 返回 (agent, headers)
+    def make():
+        name = f"agent-{os.urandom(4).hex()}"
+        response = client.post("/agents/", json={"name": name})
+        assert response.status_code == 200, response.text
+        body = response.json()
+        return body, {"X-API-Key": body["api_key"]}
+    return make
+
+@pytest.fixture
+def agent(make_agent):
+    return make_agent()
@@ -0,0 +1,49 @@
+import asyncio
+
+from sqlalchemy import create_engine, text
+
+from app import auth, database, migrations
+
+def _agent_row(agent_id):
+    async def load():
+        async with database.AsyncSessionLocal() as db:
+            result = await db.execute(text("SELECT * FROM agents WHERE id = :id"), {"id": agent_id})
+            return result.mappings().one()
+    return asyncio.run(load())
+
+def test_rotated_key_is_rejected_immediately(client, agent):
+    body, old = agent
+    # 第一次请求把Agent放进进程内缓存, 轮换必须让缓存里的旧Key立即失效, 而不是等TTL过期
+    assert client.get("/agents/me/", headers=old).status_code == 200
+    assert auth.agent_cache.get(auth.hash_api_key(old["X-API-Key"])) is not None
+
+    response = client.post("/agents/me/api-key", headers=old)
+    assert response.status_code == 200
+    new = {"X-API-Key": response.json()["api_key"]}
+    assert new != old
+
+    assert client.get("/agents/me/", headers=old).status_code == 401
+    assert client.post("/agents/me/api-key", headers=old).status_code == 401
+    assert client.get("/agents/me/", headers=new).json()["id"] == body["id"]
+    assert client.get("/agents/me/", headers=new).json()["api_key"] is None
+
+def test_database_stores_only_the_key_hash(client, agent):
+    body, headers = agent
+    api_key = headers["X-API-Key"]
+    row = _agent_row(body["id"])
+    assert row["api_key_hash"] == auth.hash_api_key(api_key)
+    assert api_key not in [str(value) for value in row.values()]
+
+def test_migration_hashes_and_clears_plaintext_keys(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path}/legacy.db")
+    with engine.begin() as conn:
+        # 迁移之前的表结构: 明文 api_key 列
+        conn.exec_driver_sql("CREATE TABLE agents (id VARCHAR PRIMARY KEY, name VARCHAR, api_key VARCHAR UNIQUE)")
+        conn.exec_driver_sql("INSERT INTO agents VALUES ('a1', 'one', 'key-one'), ('a2', 'two', 'key-two')")
+        migrations._hash_api_keys(conn)
+    with engine.connect() as conn:
+        rows = conn.exec_driver_sql("SELECT id, api_key, api_key_hash FROM agents ORDER BY id").fetchall()
+    assert [tuple(row) for row in rows] == [
+        ("a1", None, auth.hash_api_key("key-one")),
+        ("a2", None, auth.hash_api_key("key-two")),
+    ]
@@ -0,0 +1,103 @@
+import asyncio
+
+from sqlalchemy import event
+
+from app import cache, database, main
+
+def _response(body: bytes) -> cache.CachedResponse:
+    return cache.CachedResponse(body, {}, etag=None)
+
+def test_concurrent_misses_fill_once():
+    task_cache = cache.ResponseCache(ttl=60)
+    fills = []
+
+    async def fill():
+        fills.append(1)
+        await asyncio.sleep(0.01)
+        return _response(b"[]")
+
+    async def run():
+        return await asyncio.gather(*(task_cache.get_or_fill("key", fill) for _ in range(10)))
+
+    responses = asyncio.run(run())
+    assert len(fills) == 1
+    assert all(r is responses[0] for r in responses)
+    assert task_cache.stats["coalesced"] == 9
+    assert task_cache.get("key") is responses[0]
+
+def test_write_during_fill_is_not_cached():
+    task_cache = cache.ResponseCache(ttl=60)
+
+    async def run():
+        async def fill():
+            await asyncio.sleep(0.01)
+            return _response(b"stale")
+        flight = asyncio.ensure_future(task_cache.get_or_fill("key", fill))
+        await asyncio.sleep(0)
+        task_cache.invalidate() # 填充期间发生写入
+        # 写入之后到达的请求不合并到写入之前开始的填充
+        fresh = await task_cache.get_or_fill("key", lambda: asyncio.sleep(0, _response(b"fresh")))
+        return await flight, fresh
+
+    stale, fresh = asyncio.run(run())
+    assert stale.body == b"stale" and fresh.body == b"fresh"
+    assert task_cache.get("key").body == b"fresh"
+
+def test_lru_is_bounded_by_bytes():
+    task_cache = cache.ResponseCache(ttl=60, max_entries=100, max_bytes=10)
+
+    async def put(key, body):
+        await task_cache.get_or_fill(key, lambda: asyncio.sleep(0, _response(body)))
+
+    async def run():
+        await put("a", b"aaaa")
+        await put("b", b"bbbb")
+        task_cache.get("a") # a最近使用过, 淘汰b
+        await put("c", b"cccc")
+        await put("huge", b"x" * 11) # 超过总字节上限的响应不缓存
+
+    asyncio.run(run())
+    assert task_cache.get("a") is not None and task_cache.get("c") is not None
+    assert task_cache.get("b") is None and task_cache.get("huge") is None
+    assert task_cache.size_bytes == 8
+    assert task_cache.stats["evictions"] == 1
+
+def test_task_list_misses_run_one_query_and_writes_invalidate(client, agent, monkeypatch):
+    monkeypatch.setattr(cache, "task_list_cache", cache.ResponseCache(ttl=60))
+    _, headers = agent
+    queries = []
+
+    def record(conn, cursor, statement, *args):
+        if "FROM tasks" in statement and "max(tasks.version)" not in statement:
+            queries.append(statement)
+
+    async def read_concurrently(n):
+        return await asyncio.gather(*(
+            main.read_tasks(skip=0, limit=100, status="open", cursor=None, sort="created_at", order="desc",
+                            if_none_match=None)
+            for _ in range(n)
+        ))
+
+    event.listen(database.async_engine.sync_engine, "before_cursor_execute", record)
+    try:
+        asyncio.run(read_concurrently(1))
+        per_fill = len(queries) # 单次填充的查询数 (keyset分页可能分两段查询)
+        assert per_fill > 0
+
+        cache.task_list_cache.invalidate()
+        queries.clear()
+        responses = asyncio.run(read_concurrently(10))
+        assert len(queries) == per_fill # 并发未命中只执行一次填充
+        assert len({r.body for r in responses}) == 1
+
+        queries.clear()
+        asyncio.run(read_concurrently(1))
+        assert queries == [] # 命中缓存
+
+        task_id = client.post("/tasks/", json={"title": "t", "description": "d", "amount": 1}, headers=headers).json()["id"]
+        queries.clear()
+        response = asyncio.run(read_concurrently(1))[0]
+        assert len(queries) == per_fill # 写入使缓存失效
+        assert task_id.encode() in response.body
+    finally:
+        event.remove(database.async_engine.sync_engine, "before_cursor_execute", record)
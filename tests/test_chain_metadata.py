@@ -0,0 +1,31 @@
+from app.chain_metadata import BASE_FEE_MULTIPLIER, ChainMetadata
+
+class FakeEth:
+    def __init__(self):
+        self.block_number = 100
+        self.base_fee = 1000
+        self.max_priority_fee = 10
+        self.blocks_fetched = []
+
+    def get_block(self, number):
+        self.blocks_fetched.append(number)
+        return {"number": number, "baseFeePerGas": self.base_fee}
+
+class FakeWeb3:
+    def __init__(self):
+        self.eth = FakeEth()
+
+def test_fee_params_cached_per_block():
+    w3 = FakeWeb3()
+    chain = ChainMetadata(w3)
+    first = chain.fee_params()
+    assert chain.fee_params() == first
+    assert w3.eth.blocks_fetched == [100]
+
+    # 链头前进后立即重新读取, 不等待计时器
+    w3.eth.block_number = 101
+    w3.eth.base_fee = 5000
+    params = chain.fee_params()
+    assert w3.eth.blocks_fetched == [100, 101]
+    assert params["maxFeePerGas"] == int(5000 * BASE_FEE_MULTIPLIER) + 10
+    assert params["maxPriorityFeePerGas"] == 10
@@ -0,0 +1,49 @@
+import pytest
+from sqlalchemy import event
+
+from app import database, dispatch
+
+def test_poster_weights_from_config():
+    dispatcher = dispatch.FairDispatcher()
+    dispatcher.load_weights("poster-a:2, poster-b:1")
+    claimed = {"poster-a": 0, "poster-b": 0}
+    for _ in range(30):
+        poster_id = dispatcher.order(["poster-a", "poster-b"])[0]
+        dispatcher.charge(poster_id)
+        claimed[poster_id] += 1
+    assert abs(claimed["poster-a"] - 20) <= 1
+
+@pytest.mark.parametrize("spec", ["poster-a", "poster-a:0", ":2"])
+def test_poster_weights_rejects_invalid_config(spec):
+    with pytest.raises(ValueError):
+        dispatch.FairDispatcher().load_weights(spec)
+
+def test_claim_next_caps_write_attempts(client, make_agent, monkeypatch):
+    for _ in range(5):
+        _, poster = make_agent()
+        assert client.post("/tasks/", json={"title": "t", "description": "d", "amount": 1}, headers=poster).status_code == 200
+    _, claimer = make_agent()
+    monkeypatch.setattr(dispatch.dispatcher, "_posters_loaded_at", 0.0) # 重新加载发布者集合
+    updates = []
+
+    def record(conn, cursor, statement, *args):
+        if statement.lstrip().upper().startswith("UPDATE TASKS"):
+            updates.append(statement)
+
+    event.listen(database.async_engine.sync_engine, "before_cursor_execute", record)
+    try:
+        # 没有任何任务满足min_amount: 有限次按发布者尝试, 再加一次全局认领
+        response = client.post("/tasks/claim-next", json={"min_amount": 10 ** 12}, headers=claimer)
+    finally:
+        event.remove(database.async_engine.sync_engine, "before_cursor_execute", record)
+    assert response.status_code == 404
+    assert len(updates) == dispatch.CLAIM_NEXT_MAX_POSTER_ATTEMPTS + 1
+
+def test_claim_next_claims_matching_task(client, make_agent):
+    _, poster = make_agent()
+    claimer_agent, claimer = make_agent()
+    task = client.post("/tasks/", json={"title": "t", "description": "d", "amount": 10 ** 9}, headers=poster).json()
+    response = client.post("/tasks/claim-next", json={"min_amount": 10 ** 9}, headers=claimer)
+    assert response.status_code == 200, response.text
+    assert response.json()["id"] == task["id"]
+    assert response.json()["claimer_id"] == claimer_agent["id"]
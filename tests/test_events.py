@@ -0,0 +1,63 @@
+import asyncio
+
+from app import crud, database, events, models
+
+def _create_tasks(poster_id, count):
+    async def create():
+        async with database.AsyncSessionLocal() as db:
+            tasks = [models.TaskCreate(title=f"t{i}", description="d", amount=1 + i % 5) for i in range(count)]
+            return await crud.create_tasks_bulk(db, tasks, poster_id)
+    return asyncio.run(create())
+
+def _drain(subscription):
+    drained = []
+    while not subscription.queue.empty():
+        drained.append(subscription.queue.get_nowait())
+    return drained
+
+def test_subscriber_survives_bulk_post_larger_than_queue(client, agent):
+    poster, _ = agent
+    before = events.broker.publish("task.created", events.task_payload(
+        {"id": "marker", "title": "", "amount": 1, "status": "open", "poster_id": "other"}
+    ))
+    subscription, _ = events.broker.subscribe(events.Subscription(statuses={"open"}))
+    try:
+        count = events.EVENT_QUEUE_SIZE + 500
+        _create_tasks(poster["id"], count)
+        assert not subscription.evicted
+        received = _drain(subscription)
+        assert [e.type for e in received] == [events.BULK_EVENT_TYPE]
+        bulk = received[0].task
+        assert bulk["event"] == "task.created" and bulk["count"] == count
+        assert bulk["poster_ids"] == [poster["id"]]
+        assert (bulk["min_amount"], bulk["max_amount"]) == (1, 5)
+
+        # 断线重连: 批量发布之前的事件ID仍在环形缓冲区内, 不需要reset
+        reconnect, reset = events.broker.subscribe(events.Subscription(statuses={"open"}), before.id)
+        events.broker.unsubscribe(reconnect)
+        assert not reset
+        assert [e.type for e in _drain(reconnect)] == [events.BULK_EVENT_TYPE]
+    finally:
+        events.broker.unsubscribe(subscription)
+
+def test_small_batches_publish_per_task_events(client, agent):
+    poster, _ = agent
+    subscription, _ = events.broker.subscribe(events.Subscription(poster_id=poster["id"]))
+    try:
+        _create_tasks(poster["id"], 3)
+        assert [e.type for e in _drain(subscription)] == ["task.created"] * 3
+    finally:
+        events.broker.unsubscribe(subscription)
+
+def test_bulk_event_respects_subscription_filters(client, agent):
+    poster, _ = agent
+    other_poster = events.Subscription(poster_id="someone-else")
+    too_expensive = events.Subscription(min_amount=100)
+    for subscription in (other_poster, too_expensive):
+        events.broker.subscribe(subscription)
+    try:
+        _create_tasks(poster["id"], events.EVENT_BULK_THRESHOLD + 1)
+        assert other_poster.queue.empty() and too_expensive.queue.empty()
+    finally:
+        for subscription in (other_poster, too_expensive):
+            events.broker.unsubscribe(subscription)
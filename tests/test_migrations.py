@@ -0,0 +1,19 @@
+from sqlalchemy import create_engine, inspect
+
+from app import database, migrations
+
+SUPERSEDED_INDEXES = {"ix_tasks_status_created_at", "ix_tasks_created_at", "ix_tasks_deadline_at"}
+
+def test_migrations_leave_only_final_indexes(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path}/migrations.db")
+    database.Base.metadata.create_all(bind=engine)
+    assert len(migrations.upgrade(engine)) == len(migrations.MIGRATIONS)
+    indexes = {index["name"] for index in inspect(engine).get_indexes("tasks")}
+    # 迁移2删除迁移1建的单列/前缀索引, 只留下keyset分页的复合索引
+    assert not indexes & SUPERSEDED_INDEXES
+    assert {"ix_tasks_status_created_at_id", "ix_tasks_created_at_id", "ix_tasks_deadline_at_id"} <= indexes
+    assert migrations.upgrade(engine) == []
+
+def test_hot_queries_explain():
+    for name, statement in migrations.hot_queries().items():
+        assert migrations.explain(database.engine, statement), name
@@ -0,0 +1,95 @@
+import asyncio
+
+from sqlalchemy import select, update
+
+from app import crud, database, models
+
+def _submitted_task(client, poster, claimer, amount=10):
+    task = client.post("/tasks/", json={"title": "t", "description": "d", "amount": amount}, headers=poster).json()
+    assert client.post(f"/tasks/{task['id']}/claim", headers=claimer).status_code == 200
+    assert client.post(f"/tasks/{task['id']}/submit", json={"content": "done"}, headers=claimer).status_code == 200
+    return task["id"]
+
+def _transactions(task_ids):
+    async def load():
+        async with database.AsyncSessionLocal() as db:
+            result = await db.execute(select(database.TransactionDB).filter(database.TransactionDB.task_id.in_(task_ids)))
+            return result.scalars().all()
+    return asyncio.run(load())
+
+def test_review_batch_pays_each_approved_task_once(client, make_agent):
+    _, poster = make_agent()
+    claimer_agent, claimer = make_agent()
+    first, second, third = (_submitted_task(client, poster, claimer) for _ in range(3))
+
+    response = client.post("/tasks/review-batch", headers=poster, json={"items": [
+        {"task_id": first, "approved": True},
+        {"task_id": second, "approved": True},
+        {"task_id": first, "approved": True},
+        {"task_id": third, "approved": False},
+    ]})
+    assert response.status_code == 200, response.text
+    assert response.json() == [
+        {"task_id": first, "status": "approved", "detail": None},
+        {"task_id": second, "status": "approved", "detail": None},
+        {"task_id": third, "status": "rejected", "detail": None},
+    ]
+    # 重复的条目不产生第二笔支付; 同一认领者的两笔赏金由settlement worker合并为一次转账
+    transactions = _transactions([first, second, third])
+    assert sorted(t.task_id for t in transactions) == sorted([first, second])
+    assert {t.to_address for t in transactions} == {claimer_agent["wallet_address"]}
+
+def test_review_batch_reports_per_item_errors(client, make_agent):
+    _, poster = make_agent()
+    _, other = make_agent()
+    _, claimer = make_agent()
+    submitted = _submitted_task(client, poster, claimer)
+    foreign = _submitted_task(client, other, claimer)
+    open_task = client.post("/tasks/", json={"title": "t", "description": "d", "amount": 1}, headers=poster).json()["id"]
+
+    response = client.post("/tasks/review-batch", headers=poster, json={"items": [
+        {"task_id": "missing", "approved": True},
+        {"task_id": foreign, "approved": True},
+        {"task_id": open_task, "approved": True},
+        {"task_id": submitted, "approved": True},
+    ]})
+    assert [(r["task_id"], r["status"], r["detail"]) for r in response.json()] == [
+        ("missing", "error", "Task not found"),
+        (foreign, "error", "Only the task poster can review"),
+        (open_task, "error", "Task is not in submitted state"),
+        (submitted, "approved", None),
+    ]
+    assert client.get(f"/tasks/{foreign}").json()["status"] == "submitted"
+    assert _transactions([foreign, open_task]) == []
+
+def test_review_batch_skips_tasks_reviewed_concurrently(client, make_agent, monkeypatch):
+    _, poster = make_agent()
+    _, claimer = make_agent()
+    raced, kept = _submitted_task(client, poster, claimer), _submitted_task(client, poster, claimer)
+    get_tasks_by_ids = crud.get_tasks_by_ids
+
+    async def load_then_review(db, task_ids):
+        tasks = await get_tasks_by_ids(db, task_ids)
+        # 批次读取任务之后, 另一个请求抢先审核了其中一个
+        async with database.AsyncSessionLocal() as other:
+            await other.execute(update(database.TaskDB).where(database.TaskDB.id == raced).values(status="rejected"))
+            await other.commit()
+        return tasks
+
+    monkeypatch.setattr(crud, "get_tasks_by_ids", load_then_review)
+    response = client.post("/tasks/review-batch", headers=poster, json={"items": [
+        {"task_id": raced, "approved": True},
+        {"task_id": kept, "approved": True},
+    ]})
+    assert response.json() == [
+        {"task_id": raced, "status": "error", "detail": "Task is not in submitted state"},
+        {"task_id": kept, "status": "approved", "detail": None},
+    ]
+    assert client.get(f"/tasks/{raced}").json()["status"] == "rejected"
+    assert [t.task_id for t in _transactions([raced, kept])] == [kept]
+
+def test_review_batch_size_is_bounded(client, agent):
+    _, headers = agent
+    items = [{"task_id": str(i), "approved": True} for i in range(models.TASK_REVIEW_BATCH_MAX_ITEMS + 1)]
+    assert client.post("/tasks/review-batch", headers=headers, json={"items": items}).status_code == 422
+    assert client.post("/tasks/review-batch", headers=headers, json={"items": []}).status_code == 422
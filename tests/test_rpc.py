@@ -0,0 +1,27 @@
+import json
+
+from eth_account import Account
+
+from app import rpc
+
+TX = {"nonce": 3, "gas": 21000, "to": "0x" + "11" * 20, "value": 5, "data": b"\x01\x02", "chainId": 1337}
+
+def test_decode_legacy_and_typed_transactions():
+    account = Account.create()
+    legacy = account.sign_transaction({**TX, "gasPrice": 10 ** 9}).raw_transaction
+    typed = account.sign_transaction({**TX, "maxFeePerGas": 2, "maxPriorityFeePerGas": 1}).raw_transaction
+    # 模拟链收到的是bytes, settlement从outbox读出的是HexBytes
+    for raw in (legacy, typed, bytes(legacy), bytes(typed)):
+        fields = rpc.decode_raw_transaction(raw)
+        assert (fields["nonce"], fields["gas"], fields["value"]) == (3, 21000, 5)
+        assert bytes(fields["to"]) == bytes.fromhex("11" * 20) and bytes(fields["data"]) == b"\x01\x02"
+        assert Account.recover_transaction(raw) == account.address
+    legacy_fields = rpc.decode_raw_transaction(legacy)
+    assert legacy_fields["gasPrice"] == 10 ** 9
+    assert (legacy_fields["v"] - 35) // 2 == 1337 # EIP-155
+    assert rpc.decode_raw_transaction(typed)["maxFeePerGas"] == 2
+
+def test_encode_request_hex_encodes_bytes():
+    provider = rpc.PooledRPCProvider(["http://127.0.0.1:1"])
+    request_id, payload = provider._encode("eth_sendRawTransaction", [b"\x01\xff"])
+    assert json.loads(payload) == {"jsonrpc": "2.0", "method": "eth_sendRawTransaction", "params": ["0x01ff"], "id": request_id}
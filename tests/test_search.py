@@ -0,0 +1,55 @@
+import asyncio
+import os
+
+import pytest
+
+from app import database, search
+
+@pytest.fixture
+def word():
+    # 每个测试一个唯一的词, 不受其他测试创建的任务影响
+    return f"zq{os.urandom(4).hex()}"
+
+def _create(client, headers, title, description):
+    response = client.post("/tasks/", json={"title": title, "description": description, "amount": 1}, headers=headers)
+    assert response.status_code == 200, response.text
+    return response.json()["id"]
+
+@pytest.mark.parametrize("params", [{"limit": -1}, {"limit": 0}, {"limit": 101}, {"status": "no-such-status"}])
+def test_search_rejects_invalid_params(client, params):
+    assert client.get("/tasks/search", params={"q": "task", **params}).status_code == 422
+
+def test_search_ranks_title_matches_first(client, agent, word):
+    _, headers = agent
+    in_description = _create(client, headers, "Unrelated title", f"Mentions {word} only in the description")
+    in_title = _create(client, headers, f"Translate {word} docs", "Plain description")
+
+    response = client.get("/tasks/search", params={"q": word})
+    assert response.status_code == 200
+    hits = response.json()
+    assert [hit["id"] for hit in hits] == [in_title, in_description]
+    assert hits[0]["score"] > hits[1]["score"]
+    assert f"{search.SNIPPET_OPEN}{word}{search.SNIPPET_CLOSE}" in hits[0]["snippet"]
+
+def test_search_prefix_limit_and_status(client, agent, word):
+    _, headers = agent
+    ids = [_create(client, headers, f"{word}suffix task {i}", "d") for i in range(3)]
+    # 最后一个词做前缀匹配
+    response = client.get("/tasks/search", params={"q": word, "limit": 2})
+    assert len(response.json()) == 2
+    assert {hit["id"] for hit in client.get("/tasks/search", params={"q": word}).json()} == set(ids)
+    assert client.get("/tasks/search", params={"q": word, "status": "claimed"}).json() == []
+
+def test_search_like_fallback(client, agent, word):
+    # 非SQLite数据库使用的LIKE实现, 在SQLite上同样可以运行
+    _, headers = agent
+    in_description = _create(client, headers, "Other", f"Body with {word} inside")
+    in_title = _create(client, headers, f"Title {word}", "Body")
+
+    async def run():
+        async with database.AsyncSessionLocal() as db:
+            return await search._search_like(db, word, "open", 10)
+
+    hits = asyncio.run(run())
+    assert [task_id for task_id, _, _ in hits] == [in_title, in_description]
+    assert all(f"{search.SNIPPET_OPEN}{word}{search.SNIPPET_CLOSE}" in snippet for _, snippet, _ in hits)
@@ -0,0 +1,40 @@
+import asyncio
+
+from sqlalchemy import select
+
+from app import database
+
+def _task_version_counter():
+    async def read():
+        async with database.AsyncSessionLocal() as db:
+            result = await db.execute(select(database.CounterDB.value).filter(database.CounterDB.name == "task_version"))
+            return result.scalar_one()
+    return asyncio.run(read())
+
+def _create_task(client, headers, amount=1):
+    response = client.post("/tasks/", json={"title": "t", "description": "d", "amount": amount}, headers=headers)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+def test_losing_claim_does_not_take_a_version(client, make_agent):
+    _, poster = make_agent()
+    _, winner = make_agent()
+    _, loser = make_agent()
+    task = _create_task(client, poster)
+
+    assert client.post(f"/tasks/{task['id']}/claim", headers=winner).status_code == 200
+    claimed_version = client.get(f"/tasks/{task['id']}").json()["version"]
+    assert claimed_version > task["version"]
+
+    counter = _task_version_counter()
+    assert client.post(f"/tasks/{task['id']}/claim", headers=loser).status_code == 400
+    assert _task_version_counter() == counter
+    assert client.get(f"/tasks/{task['id']}").json()["version"] == claimed_version
+
+def test_empty_claim_next_does_not_take_a_version(client, agent):
+    _, headers = agent
+    counter = _task_version_counter()
+    # 没有赏金这么高的任务: 认领落空, 版本计数器不变
+    response = client.post("/tasks/claim-next", json={"min_amount": 10 ** 12}, headers=headers)
+    assert response.status_code == 404
+    assert _task_version_counter() == counter
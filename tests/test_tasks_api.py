@@ -0,0 +1,53 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+
+from app import crud, database
+
+@pytest.mark.parametrize("limit", [0, -1, 10 ** 6])
+def test_list_tasks_rejects_out_of_range_limit(client, limit):
+    response = client.get("/tasks/", params={"limit": limit})
+    assert response.status_code == 422
+
+def test_list_tasks_rejects_negative_skip(client):
+    assert client.get("/tasks/", params={"skip": -1}).status_code == 422
+
+def test_list_tasks_rejects_unknown_status(client):
+    assert client.get("/tasks/", params={"status": "no-such-status"}).status_code == 422
+
+def test_list_tasks_empty_page(client):
+    # 游标在所有任务之后: 空页, 不返回下一页游标
+    cursor = crud._encode_cursor("created_at", "asc", datetime(9999, 1, 1), "~")
+    response = client.get("/tasks/", params={"cursor": cursor, "limit": 1})
+    assert response.status_code == 200
+    assert response.json() == []
+    assert "X-Next-Cursor" not in response.headers
+
+def test_list_tasks_cursor_pagination(client, agent):
+    _, headers = agent
+    status = "open"
+    created = [
+        client.post("/tasks/", json={"title": f"t{i}", "description": "d", "amount": 1}, headers=headers).json()["id"]
+        for i in range(3)
+    ]
+    seen, cursor = [], None
+    while True:
+        params = {"status": status, "limit": 2, **({"cursor": cursor} if cursor else {})}
+        response = client.get("/tasks/", params=params)
+        assert response.status_code == 200
+        seen.extend(task["id"] for task in response.json())
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+    assert set(created) <= set(seen)
+    assert len(seen) == len(set(seen))
+
+def test_get_tasks_page_rejects_non_positive_limit():
+    async def page(limit):
+        async with database.AsyncSessionLocal() as db:
+            return await crud.get_tasks_page(db, limit=limit)
+
+    for limit in (0, -1):
+        with pytest.raises(ValueError):
+            asyncio.run(page(limit))
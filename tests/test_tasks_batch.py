@@ -0,0 +1,50 @@
+import json
+
+from app import main
+
+NDJSON = {"Content-Type": "application/x-ndjson"}
+
+def _results(response):
+    assert response.status_code == 200, response.text
+    assert response.headers["content-type"] == "application/x-ndjson"
+    return [json.loads(line) for line in response.text.splitlines()]
+
+def test_ndjson_batch_reports_each_line(client, agent):
+    _, headers = agent
+    lines = [
+        json.dumps({"title": "a", "description": "d", "amount": 1}),
+        "{not json",
+        "",
+        json.dumps({"title": "b", "description": "d", "amount": -1}),
+        json.dumps({"title": "c", "description": "d", "amount": 2}),
+    ]
+    response = client.post("/tasks/batch", content="\n".join(lines), headers={**headers, **NDJSON})
+    results = _results(response)
+    # 空行被忽略, index 是有效行中的位置
+    assert [(r["index"], r["status"]) for r in results] == [(0, "created"), (1, "error"), (2, "error"), (3, "created")]
+    assert results[1]["errors"][0]["msg"].startswith("Invalid JSON")
+    assert results[2]["errors"][0]["loc"] == ["amount"]
+    for result, title in ((results[0], "a"), (results[3], "c")):
+        assert client.get(f"/tasks/{result['id']}").json()["title"] == title
+
+def test_json_array_batch(client, agent):
+    _, headers = agent
+    items = [{"title": f"t{i}", "description": "d", "amount": i + 1} for i in range(3)] + [{"title": "missing fields"}]
+    results = _results(client.post("/tasks/batch", json=items, headers=headers))
+    assert [r["index"] for r in results] == [0, 1, 2, 3]
+    assert [r["status"] for r in results] == ["created"] * 3 + ["error"]
+    assert len({r["id"] for r in results[:3]}) == 3
+
+def test_batch_size_limit(client, agent, monkeypatch):
+    _, headers = agent
+    monkeypatch.setattr(main, "TASK_BATCH_MAX_ITEMS", 2)
+    items = [{"title": "t", "description": "d", "amount": 1}] * 3
+    before = client.get("/tasks/", params={"limit": 1}).headers["ETag"]
+    assert client.post("/tasks/batch", json=items, headers=headers).status_code == 413
+    assert client.get("/tasks/", params={"limit": 1}).headers["ETag"] == before # 没有写入任何任务
+    assert _results(client.post("/tasks/batch", json=items[:2], headers=headers))[1]["index"] == 1
+
+def test_batch_rejects_malformed_json_array(client, agent):
+    _, headers = agent
+    assert client.post("/tasks/batch", content="[{", headers={**headers, "Content-Type": "application/json"}).status_code == 400
+    assert client.post("/tasks/batch", json={"title": "t"}, headers=headers).status_code == 400
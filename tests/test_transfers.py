@@ -0,0 +1,12 @@
+import pytest
+
+@pytest.mark.parametrize("limit", [-1, 0, 501])
+def test_transfers_rejects_out_of_range_limit(client, agent, limit):
+    _, headers = agent
+    assert client.get("/agents/me/transfers", params={"limit": limit}, headers=headers).status_code == 422
+
+def test_transfers_empty_for_new_agent(client, agent):
+    _, headers = agent
+    response = client.get("/agents/me/transfers", params={"limit": 500}, headers=headers)
+    assert response.status_code == 200
+    assert response.json() == []
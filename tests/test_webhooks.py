@@ -0,0 +1,147 @@
+import asyncio
+from types import SimpleNamespace
+
+import httpcore
+import pytest
+from sqlalchemy import event, func, select
+
+from app import database, webhooks
+
+PRIVATE_URLS = [
+    "http://127.0.0.1/hook",
+    "http://localhost:8000/hook",
+    "http://10.0.0.5/hook",
+    "http://192.168.1.1/hook",
+    "http://169.254.169.254/latest/meta-data/",
+    "http://[::1]/hook",
+    "http://[::ffff:127.0.0.1]/hook",
+    "http://0.0.0.0/hook",
+]
+
+@pytest.mark.parametrize("url", PRIVATE_URLS)
+def test_register_webhook_rejects_private_hosts(client, agent, url):
+    _, headers = agent
+    response = client.post("/agents/me/webhooks", json={"url": url}, headers=headers)
+    assert response.status_code == 400
+    assert "non-public" in response.json()["detail"]
+
+def test_register_webhook_rejects_non_http(client, agent):
+    _, headers = agent
+    response = client.post("/agents/me/webhooks", json={"url": "file:///etc/passwd"}, headers=headers)
+    assert response.status_code == 400
+
+def test_register_webhook_accepts_public_address(client, agent):
+    _, headers = agent
+    response = client.post("/agents/me/webhooks", json={"url": "https://93.184.215.14/hook"}, headers=headers)
+    assert response.status_code == 200, response.text
+    assert response.json()["secret"].startswith("whsec_")
+
+def test_delivery_rechecks_host(monkeypatch):
+    # 注册之后DNS可能改为指向内网: 投递前再次校验, 不发出请求
+    async def post(*args, **kwargs):
+        raise AssertionError("request must not be sent")
+
+    dispatcher = webhooks.WebhookDispatcher()
+    monkeypatch.setattr(dispatcher, "_http", lambda: SimpleNamespace(post=post))
+    webhook = SimpleNamespace(id="wh", url="http://127.0.0.1/hook", secret="whsec_test")
+    delivery = SimpleNamespace(payload="{}")
+    with pytest.raises(webhooks.DeliveryError, match="non-public"):
+        asyncio.run(dispatcher._post(webhook, [delivery]))
+
+def _deliveries(webhook_id):
+    async def read():
+        async with database.AsyncSessionLocal() as db:
+            result = await db.execute(
+                select(func.count()).select_from(database.WebhookDeliveryDB)
+                .filter(database.WebhookDeliveryDB.webhook_id == webhook_id)
+            )
+            return result.scalar_one()
+    return asyncio.run(read())
+
+def test_task_writes_use_cached_webhook_registry(client, agent):
+    _, headers = agent
+    statements = []
+
+    def record(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    def create_task():
+        statements.clear()
+        response = client.post("/tasks/", json={"title": "t", "description": "d", "amount": 1}, headers=headers)
+        assert response.status_code == 200, response.text
+        return [s for s in statements if "FROM webhooks" in s]
+
+    webhook = client.post("/agents/me/webhooks", json={"url": "https://93.184.215.14/hook"}, headers=headers).json()
+    event.listen(database.async_engine.sync_engine, "before_cursor_execute", record)
+    try:
+        assert create_task() # 注册使缓存失效: 第一次写入加载注册表
+        assert create_task() == [] # 之后命中缓存
+        assert _deliveries(webhook["id"]) == 2
+
+        assert client.delete(f"/agents/me/webhooks/{webhook['id']}", headers=headers).status_code == 204
+        assert create_task() # 删除同样使缓存失效
+        assert _deliveries(webhook["id"]) == 2
+    finally:
+        event.remove(database.async_engine.sync_engine, "before_cursor_execute", record)
+
+class RecordingStream(httpcore.AsyncNetworkStream):
+    def __init__(self, log):
+        self.log = log
+        self.chunks = [b"HTTP/1.1 200 OK\r\nContent-Length: 0\r\n\r\n"]
+
+    async def read(self, max_bytes, timeout=None):
+        return self.chunks.pop(0) if self.chunks else b""
+
+    async def write(self, buffer, timeout=None):
+        self.log["written"] += buffer
+
+    async def aclose(self):
+        pass
+
+    async def start_tls(self, ssl_context, server_hostname=None, timeout=None):
+        self.log["sni"] = server_hostname
+        return self
+
+class RecordingBackend(httpcore.AsyncNetworkBackend):
+    def __init__(self):
+        self.log = {"connected": [], "written": b"", "sni": None}
+
+    async def connect_tcp(self, host, port, timeout=None, local_address=None, socket_options=None):
+        self.log["connected"].append((host, port))
+        return RecordingStream(self.log)
+
+def test_delivery_connects_to_validated_address(monkeypatch):
+    # DNS rebinding: 第一次解析是公网地址, 之后同一个主机名解析为回环地址
+    answers = [["93.184.215.14"], ["127.0.0.1"]]
+    resolved = []
+
+    async def resolve(host, port):
+        resolved.append(host)
+        return answers[min(len(resolved), len(answers)) - 1]
+
+    monkeypatch.setattr(webhooks, "_resolve", resolve)
+    dispatcher = webhooks.WebhookDispatcher()
+    backend = RecordingBackend()
+    dispatcher._network._backend = backend
+    webhook = SimpleNamespace(id="wh", url="https://hooks.example.com/agent", secret="whsec_test")
+    delivery = SimpleNamespace(payload="{}")
+
+    async def deliver_twice():
+        await dispatcher._post(webhook, [delivery])
+        with pytest.raises(webhooks.DeliveryError, match="non-public"):
+            await dispatcher._post(webhook, [delivery])
+        await dispatcher.aclose()
+
+    asyncio.run(deliver_twice())
+    # 只连接过校验通过的地址; SNI和Host头仍是原主机名
+    assert backend.log["connected"] == [("93.184.215.14", 443)]
+    assert backend.log["sni"] == "hooks.example.com"
+    assert b"Host: hooks.example.com\r\n" in backend.log["written"]
+    assert resolved == ["hooks.example.com", "hooks.example.com"]
+
+def test_unvalidated_host_is_not_dialed():
+    backend = RecordingBackend()
+    network = webhooks.PinnedNetworkBackend(backend)
+    with pytest.raises(httpcore.ConnectError):
+        asyncio.run(network.connect_tcp("hooks.example.com", 443))
+    assert backend.log["connected"] == []